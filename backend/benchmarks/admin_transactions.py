@@ -0,0 +1,160 @@
+"""
+Query count and latency of the admin transaction listing as the table grows.
+
+Seeds users, instances, subscriptions and transactions into the real tables
+inside one transaction that is rolled back at the end, then lists them through
+TransactionOperation.get_all_transactions_with_details while counting the
+statements sent to the database. The listing is a single query whatever the
+size; --legacy also replays the old per subscription payment instance lookup
+for comparison.
+
+Usage (from the backend directory, against the configured database):
+    python -m benchmarks.admin_transactions --sizes 1000 10000 100000 --legacy
+"""
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+
+from src.core.config import DatabaseConfig
+from src.core.sql.operations.transaction import TransactionOperation
+from src.core.sql.tables.user_instance import UserInstance
+from src.core.sql.tables.user_subscription import UserSubscription
+from src.core.constants.transaction_const import TransactionType
+from .common import print_summary
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+async def seed(connection: AsyncConnection, start: int, stop: int, users: int):
+    """Add transactions start+1..stop, every other one a subscription payment with its own instance."""
+    if start == 0:
+        await connection.execute(text(
+            "INSERT INTO user_roles (role_id, role_name) VALUES (-1, 'bench') ON CONFLICT DO NOTHING"
+        ))
+        await connection.execute(text(
+            "INSERT INTO instance_plans (instance_plan_id, instance_package_name, vcpu_amount, ram_amount, storage_amount, cost_hour) "
+            "VALUES (-1, 'bench', 1, 1, 1, 1.0)"
+        ))
+        await connection.execute(text(
+            "INSERT INTO os_types (os_type_id, os_image_name, os_image_version) VALUES (-1, 'bench', '1')"
+        ))
+        await connection.execute(text(
+            "INSERT INTO users (user_id, username, email, role_id, password_hash, last_updated_at) "
+            "SELECT md5('bench_user_' || i)::uuid, 'bench_user_' || i, 'bench_user_' || i || '@bench', -1, '', now() "
+            "FROM generate_series(1, :users) i"
+        ), {"users": users})
+
+    params = {"start": start, "stop": stop, "users": users}
+    await connection.execute(text(
+        "INSERT INTO user_instances (instance_id, user_id, instance_plan_id, os_type_id, hostname, lxd_node_name, status, created_at, last_updated_at) "
+        "SELECT md5('bench_instance_' || i)::uuid, md5('bench_user_' || (i % :users + 1))::uuid, -1, -1, "
+        "'bench-' || i, 'bench', 'running', now(), now() "
+        "FROM generate_series(:start + 1, :stop) i WHERE i % 2 = 0"
+    ), params)
+    await connection.execute(text(
+        "INSERT INTO user_subscriptions (subscription_id, instance_id, next_payment_date, next_expire_date) "
+        "SELECT -i, md5('bench_instance_' || i)::uuid, now(), now() "
+        "FROM generate_series(:start + 1, :stop) i WHERE i % 2 = 0"
+    ), params)
+    await connection.execute(text(
+        "INSERT INTO transactions (transaction_id, user_id, reference_id, subscription_id, transaction_type, transaction_status, amount, created_at, last_updated_at) "
+        "SELECT gen_random_uuid(), md5('bench_user_' || (i % :users + 1))::uuid, "
+        "CASE WHEN i % 2 = 0 THEN 'subscription_' || -i ELSE 'topup_' || i END, "
+        "CASE WHEN i % 2 = 0 THEN -i END, "
+        "CASE WHEN i % 2 = 0 THEN 'SUBSCRIPTION_PAYMENT' ELSE 'TOP_UP' END::transactiontype, "
+        "CASE WHEN i % 2 = 0 THEN 'PAID' ELSE 'SUCCESS' END::transactionstatus, "
+        "1.0, now() - i * interval '1 second', now() - i * interval '1 second' "
+        "FROM generate_series(:start + 1, :stop) i"
+    ), params)
+    await connection.execute(text("ANALYZE transactions"))
+
+
+async def legacy_listing(transaction_opr: TransactionOperation, session: AsyncSession):
+    """The old shape: every transaction, then one instance lookup per subscription payment."""
+    rows = await transaction_opr.get_all_transactions_with_details()
+    for transaction, _, _ in rows:
+        if transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT:
+            await session.execute(select(UserInstance).join(
+                UserSubscription, UserSubscription.instance_id == UserInstance.instance_id
+            ).where(UserSubscription.subscription_id == transaction.subscription_id))
+
+
+async def timed(counter: QueryCounter, repeat: int, listing) -> Tuple[List[float], int]:
+    samples = []
+    for _ in range(repeat):
+        counter.count = 0
+        start = time.perf_counter()
+        await listing()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, counter.count
+
+
+async def run(args):
+    engine = create_async_engine(DatabaseConfig.DB_URL)
+    counter = QueryCounter()
+    try:
+        async with engine.connect() as connection:
+            await connection.begin()
+            session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint")
+
+            @asynccontextmanager
+            async def db_session(read_only: bool = False, detached: bool = False):
+                yield session
+
+            transaction_opr = TransactionOperation(db_session)
+            event.listen(engine.sync_engine, "before_cursor_execute", counter)
+
+            seeded = 0
+            for size in sorted(args.sizes):
+                await seed(connection, seeded, size, args.users)
+                seeded = size
+
+                last_row = (await transaction_opr.get_all_transactions_with_details(limit=args.page_size))[-1][0]
+                listings = {
+                    "first page": lambda: transaction_opr.get_all_transactions_with_details(limit=args.page_size),
+                    "next page": lambda: transaction_opr.get_all_transactions_with_details(
+                        limit=args.page_size, after=(last_row.created_at, last_row.transaction_id)
+                    ),
+                    "user filter": lambda: transaction_opr.get_all_transactions_with_details(
+                        limit=args.page_size, username="bench_user_1"
+                    ),
+                    "everything": lambda: transaction_opr.get_all_transactions_with_details(),
+                }
+                if args.legacy:
+                    listings["legacy everything"] = lambda: legacy_listing(transaction_opr, session)
+
+                for label, listing in listings.items():
+                    samples, queries = await timed(counter, args.repeat, listing)
+                    print_summary(f"{size} rows {label} ({queries} queries)", samples)
+                session.expunge_all()
+
+            event.remove(engine.sync_engine, "before_cursor_execute", counter)
+            await session.close()
+            await connection.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Transaction counts to measure at")
+    parser.add_argument("--users", type=int, default=100, help="Users the transactions are spread over")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per listing")
+    parser.add_argument("--legacy", action="store_true", help="also replay the old one query per instance listing")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
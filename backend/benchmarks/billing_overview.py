@@ -0,0 +1,127 @@
+"""
+Billing overview from live aggregates versus the user_billing_summary table.
+
+Seeds users, instances, subscriptions and transactions with the admin
+transactions benchmark's seeder inside a transaction that is rolled back at the
+end. Then times the old five query overview (user id, subscription count,
+upcoming sum, earliest due date, all-time aggregate), the summary lookup
+BillingOperation.get_user_billing_overview does now, the deltas every
+subscription or payment write applies to it and the full refresh the repair
+job runs.
+
+Usage (from the backend directory, against the configured database):
+    python -m benchmarks.billing_overview --transactions 200000 --users 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+
+from src.core.config import DatabaseConfig
+from src.core.sql.operations.billing import (
+    BillingOperation,
+    apply_billing_summary_deltas,
+    billing_summary_delta,
+    refresh_earliest_due_dates,
+    refresh_user_billing_summary
+)
+from src.core.sql.tables.user import User
+from .admin_transactions import seed
+from .common import print_summary
+
+LEGACY_QUERIES = [
+    "SELECT user_id FROM users WHERE username = :username",
+    "SELECT count(s.subscription_id) FROM user_subscriptions s "
+    "JOIN user_instances i ON s.instance_id = i.instance_id WHERE i.user_id = :user_id",
+    "SELECT sum(amount) FROM transactions WHERE user_id = :user_id "
+    "AND transaction_type = 'SUBSCRIPTION_PAYMENT' AND transaction_status IN ('SCHEDULED', 'OVERDUE')",
+    "SELECT min(s.next_payment_date) FROM user_subscriptions s "
+    "JOIN user_instances i ON s.instance_id = i.instance_id WHERE i.user_id = :user_id",
+    "SELECT sum(amount), count(transaction_id), max(created_at) FROM transactions WHERE user_id = :user_id "
+    "AND transaction_type = 'SUBSCRIPTION_PAYMENT' AND transaction_status = 'PAID'",
+]
+
+
+async def legacy_overview(connection: AsyncConnection, username: str):
+    user_id = (await connection.execute(text(LEGACY_QUERIES[0]), {"username": username})).scalar_one()
+    for query in LEGACY_QUERIES[1:]:
+        (await connection.execute(text(query), {"user_id": user_id})).all()
+
+
+async def apply_write_deltas(connection: AsyncConnection, username: str):
+    user_id = select(User.user_id).where(User.username == username)
+    await connection.execute(apply_billing_summary_deltas(
+        billing_summary_delta(User.user_id, upcoming_amount=0.0).where(User.username == username)
+    ))
+    await refresh_earliest_due_dates(connection, user_id)
+
+
+async def timed(repeat: int, usernames: List[str], call) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        username = random.choice(usernames)
+        start = time.perf_counter()
+        await call(username)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(args):
+    engine = create_async_engine(DatabaseConfig.DB_URL)
+    try:
+        async with engine.connect() as connection:
+            await connection.begin()
+            session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint")
+
+            @asynccontextmanager
+            async def db_session(read_only: bool = False, detached: bool = False):
+                yield session
+
+            billing_opr = BillingOperation(db_session)
+            await seed(connection, 0, args.transactions, args.users)
+            await connection.execute(text(
+                "INSERT INTO user_wallets (user_id, balance, last_updated_at) "
+                "SELECT user_id, 0, now() FROM users WHERE username LIKE 'bench_user_%' "
+                "ON CONFLICT (user_id) DO NOTHING"
+            ))
+            bench_users = select(User.user_id).where(User.username.like("bench_user_%"))
+            await refresh_user_billing_summary(connection, bench_users)
+            await connection.execute(text("ANALYZE user_billing_summary"))
+
+            usernames = [f"bench_user_{i}" for i in range(1, args.users + 1)]
+            print_summary("legacy five queries", await timed(
+                args.repeat, usernames, lambda username: legacy_overview(connection, username)
+            ))
+            print_summary("summary lookup", await timed(
+                args.repeat, usernames, lambda username: billing_opr.get_user_billing_overview(username)
+            ))
+            print_summary("deltas on write", await timed(
+                args.repeat, usernames, lambda username: apply_write_deltas(connection, username)
+            ))
+            print_summary("full refresh (repair)", await timed(
+                args.repeat, usernames, lambda username: refresh_user_billing_summary(
+                    connection, select(User.user_id).where(User.username == username)
+                )
+            ))
+
+            await session.close()
+            await connection.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000, help="Users the transactions are spread over")
+    parser.add_argument("--repeat", type=int, default=500, help="Overviews per approach")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
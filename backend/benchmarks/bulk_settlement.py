@@ -0,0 +1,140 @@
+"""
+Settling due subscription payments in bulk versus one transaction at a time.
+
+Seeds users, instances and subscriptions with the admin transactions
+benchmark's seeder inside a transaction that is rolled back at the end, makes
+every bench subscription payment due and funds the wallets for about
+--funded of them. Then settles everything with
+TransactionOperation.settle_due_subscription_payments and a sample with the
+old per transaction loop (process_transaction per due payment), each inside a
+savepoint that is rolled back so every run starts from the same state. The
+loop is extrapolated from its sample.
+
+Usage (from the backend directory, against the configured database):
+    python -m benchmarks.bulk_settlement --sizes 10000 100000 --users 1000
+"""
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+
+from src.core.config import DatabaseConfig
+from src.core.constants.transaction_const import TransactionStatus
+from src.core.models.transaction import Transaction
+from src.core.service.subscription import SubscriptionService
+from src.core.sql.database import get_db_manager
+from src.core.sql.operations import SubscriptionOperation, TransactionOperation, UserOperation
+from src.core.utils.datetime import DateTimeUtils
+from src.core.utils.permission import worker_context
+from .admin_transactions import QueryCounter, seed
+from .common import print_summary
+
+
+async def make_due(connection: AsyncConnection, funded: float):
+    await connection.execute(text(
+        "UPDATE transactions SET transaction_status = 'SCHEDULED' WHERE subscription_id < 0"
+    ))
+    await connection.execute(text(
+        "UPDATE user_subscriptions SET next_payment_date = now() - interval '1 minute' WHERE subscription_id < 0"
+    ))
+    # Every payment is 1.0, so a balance of funded times the user's count pays that share
+    await connection.execute(text(
+        "INSERT INTO user_wallets (user_id, balance, last_updated_at) "
+        "SELECT t.user_id, floor(count(*) * :funded), now() FROM transactions t "
+        "WHERE t.subscription_id < 0 GROUP BY t.user_id "
+        "ON CONFLICT (user_id) DO UPDATE SET balance = EXCLUDED.balance"
+    ), {"funded": funded})
+    await connection.execute(text("ANALYZE transactions"))
+
+
+async def settle_one_by_one(subscription_service: SubscriptionService, overdues: List[Transaction]):
+    """The settlement loop the bulk statements replaced."""
+    for transaction in overdues:
+        await subscription_service.process_transaction(transaction)
+
+
+async def in_savepoint(connection: AsyncConnection, session: AsyncSession, counter: QueryCounter, call: Callable[[], Awaitable]) -> Tuple[float, int]:
+    savepoint = await connection.begin_nested()
+    try:
+        counter.count = 0
+        start = time.perf_counter()
+        await call()
+        return (time.perf_counter() - start) * 1000, counter.count
+    finally:
+        session.expunge_all()
+        await savepoint.rollback()
+
+
+async def run(args):
+    engine = create_async_engine(DatabaseConfig.DB_URL)
+    counter = QueryCounter()
+    try:
+        async with engine.connect() as connection:
+            await connection.begin()
+            session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint")
+
+            @asynccontextmanager
+            async def db_session(read_only: bool = False, detached: bool = False):
+                yield session
+
+            transaction_opr = TransactionOperation(db_session)
+            subscription_service = SubscriptionService(
+                user_opr=UserOperation(db_session),
+                subscription_opr=SubscriptionOperation(db_session),
+                transaction_opr=transaction_opr,
+                db_manager=get_db_manager()
+            )
+            event.listen(engine.sync_engine, "before_cursor_execute", counter)
+
+            seeded = 0
+            for size in sorted(args.sizes):
+                # Every other seeded transaction is a subscription payment
+                await seed(connection, seeded, size * 2, args.users)
+                seeded = size * 2
+                await make_due(connection, args.funded)
+
+                with worker_context():
+                    samples: List[float] = []
+                    for _ in range(args.repeat):
+                        elapsed, queries = await in_savepoint(
+                            connection, session, counter, subscription_service.settle_due_subscriptions
+                        )
+                        samples.append(elapsed)
+                    print_summary(f"{size} due bulk ({queries} queries)", samples)
+
+                    overdues = (await transaction_opr.get_subscription_transactions(
+                        payment_due_before=DateTimeUtils.now_dt(),
+                        transaction_status=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
+                    ))[:args.legacy_sample]
+                    session.expunge_all()
+                    elapsed, queries = await in_savepoint(
+                        connection, session, counter,
+                        lambda: settle_one_by_one(subscription_service, overdues)
+                    )
+                    sample = len(overdues)
+                    print_summary(
+                        f"{size} due loop, {sample} sampled ({queries} queries)",
+                        [elapsed / sample * size]
+                    )
+            await session.close()
+            await connection.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Due subscription payments")
+    parser.add_argument("--users", type=int, default=1000, help="Users the subscriptions are spread over")
+    parser.add_argument("--funded", type=float, default=0.8, help="Share of payments the wallets can cover")
+    parser.add_argument("--repeat", type=int, default=3, help="Bulk settlements per size")
+    parser.add_argument("--legacy-sample", type=int, default=1000, help="Payments settled by the old loop per size")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Time from process start to the first served request, per seeding mode.
+
+Starts the backend with uvicorn once per run and seed mode (DB_SEED_MODE=rows
+checks every seed row, bulk inserts each table in one statement and skips
+unchanged seed data), polls until the first response and stops it again. The
+server only answers once startup finished, so the time covers migrations,
+seeding, pool warmup and the rest of the lifespan. The first bulk run of a
+database writes the seed marker, later ones measure the skip.
+
+Runs against the configured database and leaves its data in place, don't
+point it at APP_ENV=test, which drops the tables on every start.
+
+Usage (from the backend directory):
+    python -m benchmarks.cold_start --runs 5 --modes rows bulk
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import List
+
+from .common import print_summary
+
+
+def time_to_first_response(mode: str, port: int, timeout: float) -> float:
+    env = {**os.environ, "DB_SEED_MODE": mode}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.core.main:app", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Backend exited with {process.returncode} during startup")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/openapi.json", timeout=1):
+                    return (time.perf_counter() - start) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"No response within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["rows", "bulk"], choices=["rows", "bulk"])
+    parser.add_argument("--runs", type=int, default=5, help="Starts per mode")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the first response")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        samples: List[float] = [time_to_first_response(mode, args.port, args.timeout) for _ in range(args.runs)]
+        print_summary(f"{mode} seeding first response", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import statistics
+from typing import Dict, List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(samples_ms),
+        "mean": statistics.fmean(samples_ms) if samples_ms else 0.0,
+        "p50": percentile(samples_ms, 50),
+        "p95": percentile(samples_ms, 95),
+        "p99": percentile(samples_ms, 99),
+        "max": max(samples_ms) if samples_ms else 0.0,
+    }
+
+
+def print_summary(label: str, samples_ms: List[float]) -> None:
+    stats = summarize(samples_ms)
+    print(
+        f"{label:<32} n={stats['count']:<6} mean={stats['mean']:8.2f}ms "
+        f"p50={stats['p50']:8.2f}ms p95={stats['p95']:8.2f}ms "
+        f"p99={stats['p99']:8.2f}ms max={stats['max']:8.2f}ms"
+    )
@@ -0,0 +1,96 @@
+"""
+Time for a billing worker follower to take over when the leader goes away.
+
+Runs several LeaderElection candidates in one process against the configured
+database, each on its own connection like separate backend processes would.
+Every round removes the current leader, either gracefully (stop, which unlocks)
+or by dropping its connection the way a crashed process does, and measures
+until another candidate is elected. A vanished host additionally waits for the
+server's TCP keepalives, which this can't simulate.
+
+Usage (from the backend directory, against the configured database):
+    python -m benchmarks.leader_failover --candidates 3 --rounds 20
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from src.core.config import BillingConfig, DatabaseConfig
+from src.core.workers.leader import LeaderElection
+from .common import print_summary
+
+
+async def elected_leader(candidates: List[LeaderElection], timeout: float) -> LeaderElection:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        leaders = [candidate for candidate in candidates if candidate.is_leader]
+        if len(leaders) > 1:
+            raise AssertionError("More than one leader elected")
+        if leaders:
+            return leaders[0]
+        await asyncio.sleep(0.001)
+    raise TimeoutError(f"No leader elected within {timeout}s")
+
+
+async def crash(candidate: LeaderElection):
+    """Drop the connection without unlocking, like a killed process."""
+    candidate._task.cancel()
+    await asyncio.gather(candidate._task, return_exceptions=True)
+    await candidate._connection.invalidate()
+    candidate.is_leader = False
+
+
+async def noop():
+    pass
+
+
+def candidate(args) -> LeaderElection:
+    election = LeaderElection(
+        name="failover-bench",
+        db_url=DatabaseConfig.DIRECT_URL,
+        # Doesn't compete with a running backend's billing worker
+        lock_key=BillingConfig.LEADER_LOCK_KEY + 1,
+        check_interval=args.interval
+    )
+    election.start(on_elected=noop, on_demoted=noop)
+    return election
+
+
+async def run(args):
+    candidates = [candidate(args) for _ in range(args.candidates)]
+    samples = {"graceful": [], "crash": []}
+    try:
+        for round_number in range(args.rounds):
+            mode = "graceful" if round_number % 2 == 0 else "crash"
+            leader = await elected_leader(candidates, args.timeout)
+            candidates.remove(leader)
+            start = time.perf_counter()
+            if mode == "graceful":
+                await leader.stop()
+            else:
+                await crash(leader)
+            await elected_leader(candidates, args.timeout)
+            samples[mode].append((time.perf_counter() - start) * 1000)
+            if mode == "crash":
+                await leader.engine.dispose()
+            candidates.append(candidate(args))
+    finally:
+        for election in candidates:
+            await election.stop()
+
+    for mode, mode_samples in samples.items():
+        print_summary(f"{mode} handoff", mode_samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=20, help="Leaders removed, alternating graceful and crash")
+    parser.add_argument("--interval", type=float, default=BillingConfig.LEADER_CHECK_INTERVAL_SECONDS)
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a new leader")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
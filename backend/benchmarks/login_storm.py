@@ -0,0 +1,81 @@
+"""
+Measure how a login storm affects the latency of other endpoints.
+
+Runs a probe loop against a cheap endpoint alone, then again while a number of
+concurrent clients keep logging in, and prints the latency percentiles of both
+runs plus how many logins were rejected with 429.
+
+Usage (from the backend directory, against a running server):
+    python -m benchmarks.login_storm --username alice --password 'Secret123'
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+
+from .common import print_summary
+
+
+async def probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event, samples: List[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(path)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str, stop: asyncio.Event,
+                samples: List[float], statuses: dict):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post("/user/login", json={"username": username, "password": password})
+        samples.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        # Baseline without logins
+        stop = asyncio.Event()
+        baseline: List[float] = []
+        task = asyncio.create_task(probe(client, args.probe_path, stop, baseline))
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await task
+
+        # Same probe during the login storm
+        stop = asyncio.Event()
+        during: List[float] = []
+        login_samples: List[float] = []
+        statuses: dict = {}
+        tasks = [asyncio.create_task(probe(client, args.probe_path, stop, during))]
+        tasks += [
+            asyncio.create_task(login(client, args.username, args.password, stop, login_samples, statuses))
+            for _ in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    print_summary(f"GET {args.probe_path} (idle)", baseline)
+    print_summary(f"GET {args.probe_path} (storm)", during)
+    print_summary("POST /user/login", login_samples)
+    print(f"login throughput: {len(login_samples) / args.duration:.1f}/s, status codes: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent login clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per phase")
+    parser.add_argument("--probe-path", default="/", help="Endpoint whose latency is measured")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
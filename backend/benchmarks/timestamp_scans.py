@@ -0,0 +1,116 @@
+"""
+Compare string encoded timestamps with TIMESTAMP WITH TIME ZONE columns.
+
+Seeds two copies of the subscription and transaction shapes in temporary tables,
+one with VARCHAR timestamps decoded the way the old UTCDateTime did, one with
+native timestamptz, then times the overdue/expired scans and a user's
+transaction history read against both.
+
+Usage (from the backend directory, against the configured database):
+    python -m benchmarks.timestamp_scans --subscriptions 50000 --transactions 200000
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from src.core.config import DatabaseConfig
+from src.core.utils.datetime import DateTimeUtils
+from .common import print_summary
+
+VARIANTS = {
+    "varchar": "VARCHAR",
+    "timestamptz": "TIMESTAMP WITH TIME ZONE",
+}
+
+
+async def seed(connection: AsyncConnection, variant: str, subscriptions: int, transactions: int, users: int):
+    column_type = VARIANTS[variant]
+    # Text variant keeps the exact strftime format the old type wrote
+    to_value = (
+        "to_char({expr} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')" if variant == "varchar" else "{expr}"
+    )
+    payment_date = to_value.format(expr="now() + (i % 720 - 360) * interval '1 hour'")
+    expire_date = to_value.format(expr="now() + (i % 720 - 336) * interval '1 hour'")
+    created_at = to_value.format(expr="now() - i * interval '1 minute'")
+
+    await connection.execute(text(
+        f"CREATE TEMP TABLE subs_{variant} (subscription_id int, next_payment_date {column_type}, next_expire_date {column_type})"
+    ))
+    await connection.execute(text(
+        f"INSERT INTO subs_{variant} SELECT i, {payment_date}, {expire_date} FROM generate_series(1, :n) i"
+    ), {"n": subscriptions})
+    await connection.execute(text(
+        f"CREATE TEMP TABLE tx_{variant} (transaction_id int, user_id int, amount float, created_at {column_type}, last_updated_at {column_type})"
+    ))
+    await connection.execute(text(
+        f"INSERT INTO tx_{variant} SELECT i, i % :users, 1.0, {created_at}, {created_at} FROM generate_series(1, :n) i"
+    ), {"n": transactions, "users": users})
+    await connection.execute(text(f"CREATE INDEX ON subs_{variant} (next_payment_date)"))
+    await connection.execute(text(f"CREATE INDEX ON subs_{variant} (next_expire_date)"))
+    await connection.execute(text(f"CREATE INDEX ON tx_{variant} (user_id, created_at)"))
+    await connection.execute(text(f"ANALYZE subs_{variant}"))
+    await connection.execute(text(f"ANALYZE tx_{variant}"))
+
+
+def decoder(variant: str) -> Callable:
+    if variant == "varchar":
+        return lambda value: DateTimeUtils.from_string(value)
+    return lambda value: value.astimezone(DateTimeUtils.UTC_TZ)
+
+
+async def timed(connection: AsyncConnection, statement: str, params: dict, decode: Callable,
+                columns: List[int], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = (await connection.execute(text(statement), params)).all()
+        for row in rows:
+            for index in columns:
+                decode(row[index])
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(args):
+    engine = create_async_engine(DatabaseConfig.DB_URL)
+    try:
+        async with engine.connect() as connection:
+            for variant in VARIANTS:
+                await seed(connection, variant, args.subscriptions, args.transactions, args.users)
+
+            now = DateTimeUtils.now_dt()
+            for variant in VARIANTS:
+                given_date = now.strftime(DateTimeUtils.FORMAT) if variant == "varchar" else now
+                decode = decoder(variant)
+                print_summary(f"{variant} overdue scan", await timed(
+                    connection, f"SELECT * FROM subs_{variant} WHERE next_payment_date < :d",
+                    {"d": given_date}, decode, [1, 2], args.repeat
+                ))
+                print_summary(f"{variant} expired scan", await timed(
+                    connection, f"SELECT * FROM subs_{variant} WHERE next_expire_date < :d",
+                    {"d": given_date}, decode, [1, 2], args.repeat
+                ))
+                print_summary(f"{variant} transaction history", await timed(
+                    connection, f"SELECT * FROM tx_{variant} WHERE user_id = :u ORDER BY created_at DESC",
+                    {"u": 1}, decode, [3, 4], args.repeat
+                ))
+            await connection.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=50000)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=100, help="Users the transactions are spread over")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
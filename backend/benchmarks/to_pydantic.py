@@ -0,0 +1,106 @@
+"""
+Rows per second of ORM to pydantic conversion, per row versus compiled converters.
+
+Builds transient ORM objects in memory (no database needed) and converts them
+with the previous BaseOperation implementation, which walked the table columns
+and mapper relationships and validated every row, and with the cached
+converters to_pydantic uses now. Both results are compared before timing.
+
+Usage (from the backend directory):
+    python -m benchmarks.to_pydantic --rows 10000
+"""
+import argparse
+import time
+import uuid
+from typing import Any, Callable, List, Type
+
+from pydantic import BaseModel
+
+from src.core.constants.transaction_const import TransactionStatus, TransactionType
+from src.core.models.instance import UserInstance as UserInstanceModel
+from src.core.models.transaction import Transaction as TransactionModel
+from src.core.sql.operations.base import compile_converter
+from src.core.sql.tables.transaction import Transaction
+from src.core.sql.tables.user_instance import UserInstance
+from src.core.utils.datetime import DateTimeUtils
+from .common import summarize
+
+
+def legacy_convert(pydantic_model: Type[BaseModel], orm_object: Any) -> BaseModel:
+    data = {}
+    for c in orm_object.__table__.columns:
+        data[c.name] = getattr(orm_object, c.name)
+    mapper = orm_object.__mapper__
+    for relationship_name, _ in mapper.relationships.items():
+        if relationship_name in orm_object.__dict__:
+            related_obj = orm_object.__dict__[relationship_name]
+            if related_obj is not None:
+                data[relationship_name] = related_obj
+    return pydantic_model.model_validate(data)
+
+
+def transactions(count: int) -> List[Transaction]:
+    now = DateTimeUtils.now_dt()
+    return [Transaction(
+        transaction_id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        reference_id=f"subscription_{i}",
+        subscription_id=i,
+        transaction_type=TransactionType.SUBSCRIPTION_PAYMENT,
+        transaction_status=TransactionStatus.PAID,
+        amount=1.5,
+        created_at=now,
+        last_updated_at=now
+    ) for i in range(count)]
+
+
+def instances(count: int) -> List[UserInstance]:
+    now = DateTimeUtils.now_dt()
+    return [UserInstance(
+        instance_id=uuid.uuid4(),
+        user_id=uuid.uuid4(),
+        instance_plan_id=1,
+        os_type_id=1,
+        hostname=f"instance-{i}",
+        lxd_node_name="node-1",
+        status="running",
+        created_at=now,
+        last_updated_at=now
+    ) for i in range(count)]
+
+
+def timed(rows: List[Any], convert: Callable[[Any], BaseModel], repeat: int) -> List[float]:
+    """Rows per second of each run."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            convert(row)
+        samples.append(len(rows) / (time.perf_counter() - start))
+    return samples
+
+
+def print_rate(label: str, samples: List[float]) -> None:
+    stats = summarize(samples)
+    print(f"{label:<32} n={stats['count']:<4} mean={stats['mean']:>10,.0f} rows/s p50={stats['p50']:>10,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10, help="Conversions of the whole row set per approach")
+    args = parser.parse_args()
+
+    for label, pydantic_model, rows in (
+        ("transaction", TransactionModel, transactions(args.rows)),
+        ("user instance", UserInstanceModel, instances(args.rows)),
+    ):
+        converter = compile_converter(type(rows[0]), pydantic_model)
+        if converter(rows[0]) != legacy_convert(pydantic_model, rows[0]):
+            raise AssertionError(f"{label} conversions differ")
+        print_rate(f"{label} per row", timed(rows, lambda row: legacy_convert(pydantic_model, row), args.repeat))
+        print_rate(f"{label} compiled", timed(rows, converter, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
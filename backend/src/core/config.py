@@ -1,5 +1,6 @@
 import os
 import secrets
+import uuid
 
 APP_ENV = os.environ.get("APP_ENV", "dev")
 
@@ -16,15 +17,66 @@ class DatabaseConfig:
             DB_NAME=DB_NAME,
         )
     )
+    # Comma separated read replica URLs, read only sessions are routed to them
+    REPLICA_URLS = [url.strip() for url in os.environ.get("DB_REPLICA_URLS", "").split(",") if url.strip()]
+    # Replicas lagging more than x seconds behind are skipped in favor of the primary
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+    # Measure replica lag at most every x seconds
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_LAG_CHECK_INTERVAL", "5"))
+    # Session level features (advisory locks) don't survive PgBouncer in transaction mode,
+    # point this at the database itself when DB_URL goes through one
+    DIRECT_URL = os.environ.get("SQLALCHEMY_DIRECT_DATABASE_URL", DB_URL)
+    # Connection pool, per worker process
+    POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+    MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+    # Seconds to wait for a free connection before failing
+    POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+    # Replace connections older than x seconds, before the server or a proxy drops them
+    POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+    POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Connections opened at startup, so the first requests don't pay for the handshakes
+    POOL_WARMUP = int(os.environ.get("DB_POOL_WARMUP", str(POOL_SIZE)))
+    # asyncpg prepared statement cache per connection
+    STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "100"))
+    # PgBouncer in transaction mode can't keep prepared statements across transactions
+    PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"
+
     DB_CONFIG = {
         "echo": False, # Enable logging
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+        "connect_args": {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            # Unique names so statements never collide on a shared server connection
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        } if PGBOUNCER else {
+            "statement_cache_size": STATEMENT_CACHE_SIZE,
+        },
     }
+    # Record latency, database time, statements and rows of every operation method per route
+    OPERATION_METRICS = os.environ.get("DB_OPERATION_METRICS", "true").lower() == "true"
+    # Statements slower than x ms are kept in the slow query log with their plan, 0 turns it off
+    SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "500"))
+    # Slow queries kept, the oldest are dropped first
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get("DB_SLOW_QUERY_LOG_SIZE", "100"))
+    # "bulk" seeds each table in one statement and skips seeding when the seed data is unchanged,
+    # "rows" checks and inserts row by row on every start
+    SEED_MODE = os.environ.get("DB_SEED_MODE", "bulk").lower()
+    # Share one session per HTTP request and commit once at the end of it
+    UNIT_OF_WORK = os.environ.get("DB_UNIT_OF_WORK", "true").lower() == "true"
 
 class TokenConfig:
     SECRET_KEY = os.environ.get("SECRET_KEY", secrets.token_hex(32))
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
     REFRESH_TOKEN_EXPIRE_DAYS = 7
+    # Identity and role claims are trusted for x minutes, older tokens are checked against the database.
+    # Revocations only reach the process that made them, the others notice once the claims are this old
+    CLAIMS_MAX_AGE_MINUTES = int(os.environ.get("TOKEN_CLAIMS_MAX_AGE_MINUTES", "2"))
     ISSUER = os.environ.get("TOKEN_ISSUER", "cloudboi")
     AUDIENCE = os.environ.get("TOKEN_AUDIENCE", "cloudboi-users")
 
@@ -32,15 +84,66 @@ class TokenConfig:
     SECURE_COOKIES = APP_ENV == "production"
     SAMESITE = "strict"  # Using strict now that we have a proxy
 
+class IdentityCacheConfig:
+    # Keep identities cached across requests for x seconds, 0 caches per request only
+    TTL_SECONDS = float(os.environ.get("IDENTITY_CACHE_TTL_SECONDS", "0"))
+    MAX_ENTRIES = int(os.environ.get("IDENTITY_CACHE_MAX_ENTRIES", "10000"))
+
+class PasswordHashingConfig:
+    # Processes used for bcrypt, and how many hash/verify calls may wait for them
+    MAX_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+    MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32"))
+
 class BillingConfig:
-    # Check for overdue subscriptions every x minutes
-    OVERDUE_CHECK_INTERVAL_MINUTES = 1
-    OVERDUE_MAX_INSTANCES = 2
+    # Check for overdue subscriptions every x minutes, payments are also settled at their deadline
+    # and top ups settle their user's due payments right away
+    OVERDUE_CHECK_INTERVAL_MINUTES = int(os.environ.get("BILLING_OVERDUE_CHECK_INTERVAL_MINUTES", "15"))
+    # Overlapping runs would settle the same payments twice
+    OVERDUE_MAX_INSTANCES = 1
     
-    # Check for expired subscriptions every x minutes
-    EXPIRE_CHECK_INTERVAL_MINUTES = 1
+    # Check for expired subscriptions every x minutes, expiries are also run at their deadline
+    EXPIRE_CHECK_INTERVAL_MINUTES = int(os.environ.get("BILLING_EXPIRE_CHECK_INTERVAL_MINUTES", "60"))
     EXPIRE_MAX_INSTANCES = 2
     
+    # Recompute billing summaries to repair drift every x minutes
+    SUMMARY_REPAIR_INTERVAL_MINUTES = 60
+    # Fold the changes appended by the billing rollup trigger into the hourly buckets every x seconds,
+    # reads add the ones not folded yet so this only bounds the size of the delta table
+    ROLLUP_FOLD_INTERVAL_SECONDS = int(os.environ.get("BILLING_ROLLUP_FOLD_INTERVAL_SECONDS", "60"))
+    # Billing stats fold the deltas themselves past this many, for when no worker folds them (APP_ENV=test)
+    ROLLUP_FOLD_ON_READ_THRESHOLD = int(os.environ.get("BILLING_ROLLUP_FOLD_ON_READ_THRESHOLD", "10000"))
+
+    # "bulk" settles every due payment in one transaction, "pipeline" settles them payment
+    # by payment, several users at once
+    SETTLEMENT_MODE = os.environ.get("BILLING_SETTLEMENT_MODE", "bulk").lower()
+    # Users the pipeline settles at once, each holds a database connection
+    SETTLEMENT_CONCURRENCY = int(os.environ.get("BILLING_SETTLEMENT_CONCURRENCY", "8"))
+    # Users settled per chunk, every chunk commits on its own with the run's checkpoint
+    SETTLEMENT_CHUNK_SIZE = int(os.environ.get("BILLING_SETTLEMENT_CHUNK_SIZE", "500"))
+    # Attempts per payment before the pipeline leaves it to the next run
+    SETTLEMENT_MAX_ATTEMPTS = 3
+    SETTLEMENT_RETRY_BACKOFF_SECONDS = 0.2
+    # Settlement runs kept for the metrics endpoint
+    SETTLEMENT_HISTORY = 20
+
+    # Containers of expired instances deleted at once, and per run
+    TEARDOWN_CONCURRENCY = int(os.environ.get("BILLING_TEARDOWN_CONCURRENCY", "4"))
+    TEARDOWN_BATCH_SIZE = 100
+    # Attempts per container before it is left to an admin, the wait doubles after every failure
+    TEARDOWN_MAX_ATTEMPTS = 5
+    TEARDOWN_RETRY_BACKOFF_SECONDS = 30
+    # Check for queued teardowns every x minutes, they also run as soon as they are queued
+    TEARDOWN_CHECK_INTERVAL_MINUTES = 10
+
+    # Only the process holding this advisory lock runs the billing jobs
+    LEADER_LOCK_KEY = 7_340_001
+    # Followers try to take over every x seconds, the leader heartbeats its lock connection as often
+    LEADER_CHECK_INTERVAL_SECONDS = float(os.environ.get("BILLING_LEADER_CHECK_INTERVAL_SECONDS", "1"))
+    # Subscription changes notify the leader on this channel, so it can move the next run earlier
+    DEADLINE_CHANNEL = "billing_deadlines"
+    # Latenesses of deadline runs kept for the metrics endpoint
+    DEADLINE_HISTORY = 50
+    
 class LXDClientConfig:
     # Time interval in seconds between state measurements for calculating CPU usage
     CPU_USAGE_MEASUREMENT_INTERVAL = 0.5
\ No newline at end of file
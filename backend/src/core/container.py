@@ -1,10 +1,18 @@
 from dependency_injector import containers, providers
 
 from .sql.database import get_db_manager
+from .sql.instrumentation import get_operation_metrics
+from .sql.slow_query_log import get_slow_query_log
+from .utils.identity_cache import get_identity_cache
+from .service.helpers.password_hasher import get_password_hasher
 from .service.clients.lxd import LXDClient
 from .service.clients.websocket import LXDWebSocketManager
 from ..infra.managers.lxd import LXDManager
+from .service.helpers.settlement import get_settlement_history
 from .workers.billing import BillingWorker
+from .workers.leader import LeaderElection
+from .workers.notifications import NotificationListener
+from .config import BillingConfig, DatabaseConfig
 from .service.user import UserService
 from .service.instance import InstanceService
 from .service.subscription import SubscriptionService
@@ -23,6 +31,13 @@ class AppContainer(containers.DeclarativeContainer):
         lambda: get_db_manager().session
     )
 
+    # Caches
+    identity_cache = providers.Singleton(get_identity_cache)
+    password_hasher = providers.Singleton(get_password_hasher)
+    operation_metrics = providers.Singleton(get_operation_metrics)
+    settlement_history = providers.Singleton(get_settlement_history)
+    slow_query_log = providers.Singleton(get_slow_query_log)
+
     # Infrastructure
     lxd_manager = providers.Singleton(LXDManager)
     lxd_ws_manager = providers.Singleton(LXDWebSocketManager)
@@ -32,6 +47,24 @@ class AppContainer(containers.DeclarativeContainer):
         lxd_ws_manager=lxd_ws_manager
     )
 
+    # Only the leader among the backend processes runs the billing jobs
+    billing_leader = providers.Singleton(
+        LeaderElection,
+        name="billing-worker",
+        db_url=DatabaseConfig.DIRECT_URL,
+        lock_key=BillingConfig.LEADER_LOCK_KEY,
+        check_interval=BillingConfig.LEADER_CHECK_INTERVAL_SECONDS
+    )
+
+    # The billing leader hears about subscription deadlines on a session of its own
+    billing_deadline_listener = providers.Singleton(
+        NotificationListener,
+        name="billing-deadlines",
+        db_url=DatabaseConfig.DIRECT_URL,
+        channel=BillingConfig.DEADLINE_CHANNEL,
+        reconnect_interval=BillingConfig.LEADER_CHECK_INTERVAL_SECONDS
+    )
+
     # Database Operations
     instance_opr = providers.Factory(InstanceOperation, db_session=db_session)
     subscription_opr = providers.Factory(SubscriptionOperation, db_session=db_session)
@@ -43,19 +76,23 @@ class AppContainer(containers.DeclarativeContainer):
     # Services
     user_service = providers.Factory(
         UserService,
-        user_opr=user_opr
+        user_opr=user_opr,
+        identity_cache=identity_cache,
+        password_hasher=password_hasher
     )
     subscription_service = providers.Factory(
         SubscriptionService,
         user_opr=user_opr,
         subscription_opr=subscription_opr,
-        transaction_opr=transaction_opr
+        transaction_opr=transaction_opr,
+        db_manager=db_manager
     )
     instance_service = providers.Factory(
         InstanceService,
         subscription_service=subscription_service,
         instance_opr=instance_opr,
-        lxd_client=lxd_client
+        lxd_client=lxd_client,
+        db_manager=db_manager
     )
     lxd_cluster_service = providers.Factory(
         LXDClusterService,
@@ -65,8 +102,23 @@ class AppContainer(containers.DeclarativeContainer):
         BillingService,
         billing_opr=billing_opr,
         transaction_opr=transaction_opr,
-        subscription_service=subscription_service
+        subscription_service=subscription_service,
+        instance_service=instance_service,
+        db_manager=db_manager
     )
+
+    # Workers, before the admin service that reports on them
+    billing_worker = providers.Singleton(
+        BillingWorker,
+        subscription_service=subscription_service,
+        billing_service=billing_service,
+        instance_service=instance_service,
+        leader=billing_leader,
+        settlement_history=settlement_history,
+        deadline_listener=billing_deadline_listener
+    )
+
+    # Admin
     admin_service = providers.Factory(
         AdminService,
         admin_opr=admin_opr,
@@ -74,11 +126,13 @@ class AppContainer(containers.DeclarativeContainer):
         transaction_opr=transaction_opr,
         instance_opr=instance_opr,
         user_opr=user_opr,
-        subscription_service=subscription_service
+        subscription_service=subscription_service,
+        identity_cache=identity_cache,
+        password_hasher=password_hasher,
+        db_manager=db_manager,
+        operation_metrics=operation_metrics,
+        slow_query_log=slow_query_log,
+        billing_leader=billing_leader,
+        settlement_history=settlement_history,
+        billing_worker=billing_worker
     )
-
-    # Workers
-    billing_worker = providers.Singleton(
-        BillingWorker,
-        subscription_service=subscription_service
-    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,6 +7,7 @@ from .routers import user, instance, lxd_cluster, billing, admin
 from .utils.logging import logger, configure_logging
 from .startup import lifespan
 from .container import AppContainer
+from .utils.dependencies import db_unit_of_work, track_request_route
 
 
 def custom_generate_unique_id(route: APIRoute):
@@ -14,7 +15,8 @@ def custom_generate_unique_id(route: APIRoute):
 
 app = FastAPI(
   generate_unique_id_function=custom_generate_unique_id,
-  lifespan=lifespan
+  lifespan=lifespan,
+  dependencies=[Depends(track_request_route), Depends(db_unit_of_work)]
 )
 
 container = AppContainer()
@@ -64,6 +66,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Disposition"],
 )
 
 app.include_router(user.router)
@@ -123,4 +123,21 @@ class UserInstanceResponse(BaseModel):
 class InstanceControlResponse(BaseModel):
     instance_id: uuid.UUID
     instance_name: str
-    is_success: bool
\ No newline at end of file
+    is_success: bool
+
+class InstanceTeardown(BaseModel):
+    instance_id: uuid.UUID
+    hostname: str
+    queued_at: datetime
+    attempts: int
+    next_attempt_at: Optional[datetime]
+    last_error: Optional[str]
+
+class TeardownRun(BaseModel):
+    started_at: datetime
+    duration_ms: float
+    attempted: int
+    deleted: int
+    failed: int
+    # Failed for the last time, left for an admin
+    given_up: int
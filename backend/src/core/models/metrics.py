@@ -0,0 +1,134 @@
+from datetime import datetime
+from typing import Any, List, Optional
+from .base_model import BaseModel
+from .subscription import SettlementRun
+
+
+class IdentityCacheStats(BaseModel):
+    request_hits: int
+    shared_hits: int
+    misses: int
+    saved_queries: int
+    shared_entries: int
+    ttl_seconds: float
+
+
+class DatabasePoolStats(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    wait_ms_avg: float
+    wait_ms_max: float
+
+
+class ReplicaStats(BaseModel):
+    name: str
+    healthy: bool
+    lag_seconds: Optional[float]
+    reads: int
+    error: Optional[str]
+
+
+class DatabaseReplicaStats(BaseModel):
+    max_lag_seconds: float
+    primary_reads: int
+    replicas: List[ReplicaStats]
+
+
+class PasswordHasherStats(BaseModel):
+    max_workers: int
+    max_pending: int
+    pending: int
+    completed: int
+    rejected: int
+
+
+class HistogramBucket(BaseModel):
+    # None for the unbounded last bucket
+    le_ms: Optional[float]
+    count: int
+
+
+class OperationStats(BaseModel):
+    route: str
+    operation: str
+    calls: int
+    errors: int
+    wall_ms_total: float
+    wall_ms_avg: float
+    wall_ms_p95: float
+    wall_ms_max: float
+    db_ms_avg: float
+    db_ms_p95: float
+    db_ms_max: float
+    statements_avg: float
+    rows_avg: float
+    wall_ms_histogram: List[HistogramBucket]
+    db_ms_histogram: List[HistogramBucket]
+
+
+class SlowQueryEntry(BaseModel):
+    occurred_at: datetime
+    duration_ms: float
+    operation: Optional[str]
+    route: Optional[str]
+    statement: str
+    parameters: List[Any]
+    plan: Optional[Any]
+    plan_error: Optional[str]
+
+
+class SlowQueryLogResponse(BaseModel):
+    threshold_ms: float
+    size: int
+    recorded: int
+    skipped_explains: int
+    # Newest first
+    queries: List[SlowQueryEntry]
+
+
+class LeaderHandoffEntry(BaseModel):
+    at: datetime
+    wait_ms: Optional[float]
+    previous_leader: Optional[str]
+
+
+class BillingLeaderStats(BaseModel):
+    identity: str
+    is_leader: bool
+    leader: Optional[str]
+    leader_since: Optional[datetime]
+    elections: int
+    demotions: int
+    check_interval_seconds: float
+    last_error: Optional[str]
+    # Newest first
+    handoffs: List[LeaderHandoffEntry]
+
+
+class BillingSettlementStats(BaseModel):
+    mode: str
+    concurrency: int
+    # Newest first
+    runs: List[SettlementRun]
+
+
+class BillingDeadlineJob(BaseModel):
+    job_id: str
+    next_run: Optional[datetime]
+    # Newest first
+    lateness_ms: List[float]
+
+
+class BillingDeadlineStats(BaseModel):
+    is_leader: bool
+    listening: bool
+    notifications: int
+    listener_reconnects: int
+    listener_error: Optional[str]
+    deadline_queries: int
+    jobs: List[BillingDeadlineJob]
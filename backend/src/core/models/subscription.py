@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List
 import uuid
 
 from .base_model import BaseModel
@@ -7,4 +8,52 @@ class UserSubscription(BaseModel):
     subscription_id: int
     instance_id: uuid.UUID
     next_payment_date: datetime
-    next_expire_date: datetime
\ No newline at end of file
+    next_expire_date: datetime
+
+
+class BillingCheckpoint(BaseModel):
+    job: str
+    run_started_at: datetime
+    position: str
+    processed: int
+    updated_at: datetime
+
+
+class SettlementResult(BaseModel):
+    # Users with due payments, whose wallets were locked
+    users: int
+    due: int
+    paid: int
+    overdue: int
+    # Next cycle payments created for the paid ones
+    scheduled: int
+
+
+class ExpiryResult(BaseModel):
+    # Overdue payments marked expired, their subscriptions are gone
+    expired: int
+    # Instances queued for their containers to be deleted
+    queued: int
+
+
+class SettlementFailure(BaseModel):
+    transaction_id: uuid.UUID
+    user_id: uuid.UUID
+    attempts: int
+    error: str
+
+
+class SettlementRun(BaseModel):
+    # "bulk" or "pipeline"
+    mode: str
+    started_at: datetime
+    duration_ms: float
+    users: int
+    processed: int
+    paid: int
+    # Left overdue for lack of funds
+    unpaid: int
+    failed: int
+    retries: int
+    per_second: float
+    failures: List[SettlementFailure]
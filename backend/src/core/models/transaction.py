@@ -9,12 +9,21 @@ class Transaction(BaseModel):
     transaction_id: Optional[uuid.UUID] = None
     user_id: uuid.UUID
     reference_id: str
+    subscription_id: Optional[int] = None
     transaction_type: TransactionType
     transaction_status: TransactionStatus
     amount: float
     created_at: Optional[datetime] = None
     last_updated_at: datetime
 
+class TransactionHistoryItem(BaseModel):
+    transaction_id: uuid.UUID
+    transaction_type: TransactionType
+    transaction_status: TransactionStatus
+    amount: float
+    created_at: datetime
+    last_updated_at: datetime
+
 class UserTransactionResponse(BaseModel):
     transaction_id: uuid.UUID
     transaction_type: TransactionType
@@ -13,6 +13,10 @@ class UserInDB(User):
     password_hash: str
     last_updated_at: Optional[datetime] = None
 
+class UserIdentity(User):
+    user_id: uuid.UUID
+    role: str
+
 class UserRole(BaseModel):
     role_id: int
     role_name: str
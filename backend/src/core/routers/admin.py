@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from dependency_injector.wiring import inject, Provide
-from typing import List
+from typing import List, Literal, Optional
 from datetime import datetime
 
 from ..container import AppContainer
@@ -20,6 +21,8 @@ from ..models.admin import (
     AdminTopUpResponse
 )
 from ..models.instance import InstancePlan
+from ..constants.transaction_const import TransactionStatus, TransactionType
+from ..models.metrics import BillingDeadlineStats, BillingLeaderStats, BillingSettlementStats, DatabasePoolStats, DatabaseReplicaStats, IdentityCacheStats, OperationStats, PasswordHasherStats, SlowQueryLogResponse
 from ..service.admin import AdminService
 
 router = APIRouter(
@@ -106,9 +109,51 @@ async def get_billing_stats(
 )
 @inject
 async def get_all_transactions(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    username: Optional[str] = None,
+    transaction_type: Optional[List[TransactionType]] = Query(None),
+    transaction_status: Optional[List[TransactionStatus]] = Query(None),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
     admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
 ):
-    return await admin_service.get_all_transactions()
+    return await admin_service.get_all_transactions(
+        limit=limit,
+        cursor=cursor,
+        username=username,
+        transaction_type=transaction_type,
+        transaction_status=transaction_status,
+        start_date=start_date,
+        end_date=end_date,
+        response=response
+    )
+
+@router.get("/transactions/export")
+@inject
+async def export_transactions(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    username: Optional[str] = None,
+    transaction_type: Optional[List[TransactionType]] = Query(None),
+    transaction_status: Optional[List[TransactionStatus]] = Query(None),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    content = await admin_service.export_transactions(
+        export_format=format,
+        username=username,
+        transaction_type=transaction_type,
+        transaction_status=transaction_status,
+        start_date=start_date,
+        end_date=end_date
+    )
+    return StreamingResponse(
+        content,
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format}"}
+    )
 
 @router.post(
     "/topup",
@@ -117,6 +162,98 @@ async def get_all_transactions(
 @inject
 async def topup(
     topup_request: AdminTopUpRequest,
+    background_tasks: BackgroundTasks,
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.topup(topup_request, background_tasks)
+
+@router.get(
+    "/metrics/identity-cache",
+    response_model=IdentityCacheStats
+)
+@inject
+async def get_identity_cache_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_identity_cache_stats()
+
+@router.get(
+    "/metrics/password-hasher",
+    response_model=PasswordHasherStats
+)
+@inject
+async def get_password_hasher_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_password_hasher_stats()
+
+@router.get(
+    "/metrics/db-pool",
+    response_model=DatabasePoolStats
+)
+@inject
+async def get_db_pool_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_db_pool_stats()
+
+@router.get(
+    "/metrics/db-replicas",
+    response_model=DatabaseReplicaStats
+)
+@inject
+async def get_db_replica_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_db_replica_stats()
+
+@router.get(
+    "/metrics/operations",
+    response_model=List[OperationStats]
+)
+@inject
+async def get_operation_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_operation_stats()
+
+@router.get(
+    "/metrics/slow-queries",
+    response_model=SlowQueryLogResponse
+)
+@inject
+async def get_slow_queries(
+    limit: int = Query(50, ge=1, le=1000),
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_slow_queries(limit)
+
+@router.get(
+    "/metrics/billing-leader",
+    response_model=BillingLeaderStats
+)
+@inject
+async def get_billing_leader_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_billing_leader_stats()
+
+@router.get(
+    "/metrics/billing-settlements",
+    response_model=BillingSettlementStats
+)
+@inject
+async def get_billing_settlement_stats(
+    admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
+):
+    return await admin_service.get_billing_settlement_stats()
+
+@router.get(
+    "/metrics/billing-deadlines",
+    response_model=BillingDeadlineStats
+)
+@inject
+async def get_billing_deadline_stats(
     admin_service: AdminService = Depends(Provide[AppContainer.admin_service])
 ):
-    return await admin_service.topup(topup_request)
\ No newline at end of file
+    return await admin_service.get_billing_deadline_stats()
@@ -1,5 +1,5 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, WebSocket
+from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response, WebSocket
 from dependency_injector.wiring import Provide, inject
 from fastapi.websockets import WebSocketState
 
@@ -11,6 +11,7 @@ from ..service.billing import BillingService
 from ..models.billing import UserBillingOverviewResponse, UserTopUpRequest, UserTopUpResponse
 from ..models.transaction import UserTransactionResponse
 from ..models.user import UserWalletResponse
+from ..constants.transaction_const import TransactionStatus, TransactionType
 from ..container import AppContainer
 
 
@@ -39,9 +40,21 @@ async def get_billing_overview(
 @inject
 async def get_all_user_transactions(
     username: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    transaction_type: Optional[List[TransactionType]] = Query(None),
+    transaction_status: Optional[List[TransactionStatus]] = Query(None),
     billing_service: BillingService = Depends(Provide[AppContainer.billing_service])
 ):
-    return await billing_service.get_all_user_transactions(username=username)
+    return await billing_service.get_all_user_transactions(
+        username=username,
+        limit=limit,
+        cursor=cursor,
+        transaction_type=transaction_type,
+        transaction_status=transaction_status,
+        response=response
+    )
 
 @router.post(
     "/topup/{username}",
@@ -52,9 +65,10 @@ async def get_all_user_transactions(
 async def top_up(
     username: str,
     top_up_request: UserTopUpRequest,
+    background_tasks: BackgroundTasks,
     billing_service: BillingService = Depends(Provide[AppContainer.billing_service])
 ):
-    return await billing_service.top_up(username=username, top_up_request=top_up_request)
+    return await billing_service.top_up(username=username, top_up_request=top_up_request, background_tasks=background_tasks)
 
 @router.get(
     "/wallet/{username}",
@@ -1,6 +1,9 @@
-from typing import List, Optional
+import csv
+import io
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
 from datetime import datetime
-from fastapi import HTTPException
+from fastapi import BackgroundTasks, HTTPException, Response
+from sqlalchemy import Row
 
 from ..sql.operations import AdminOperation, BillingOperation, TransactionOperation, InstanceOperation
 from ..models.admin import (
@@ -20,12 +23,38 @@ from ..utils.permission import require_roles
 from ..constants.user_const import UserRole
 from ..utils.datetime import DateTimeUtils
 from ..service.validators.instance_validator import InstanceValidator
+from ..service.helpers.pagination_helper import PaginationHelper
 from ..sql.operations.transaction import TransactionOperation
 from ..sql.operations.billing import BillingOperation
 from ..sql.operations.user import UserOperation
 from ..service.subscription import SubscriptionService
 from ..models.transaction import Transaction
 from ..constants.transaction_const import TransactionType, TransactionStatus
+from ..models.metrics import (
+    DatabasePoolStats,
+    DatabaseReplicaStats,
+    HistogramBucket,
+    IdentityCacheStats,
+    OperationStats,
+    PasswordHasherStats,
+    ReplicaStats,
+    SlowQueryEntry,
+    SlowQueryLogResponse,
+    BillingLeaderStats,
+    BillingSettlementStats,
+    BillingDeadlineJob,
+    BillingDeadlineStats,
+    LeaderHandoffEntry
+)
+from ..utils.identity_cache import IdentityCache
+from .helpers.password_hasher import PasswordHasher
+from ..sql.database import DatabaseSessionManager
+from ..sql.instrumentation import Histogram, OperationMetrics
+from ..sql.slow_query_log import SlowQueryLog
+from ..workers.leader import LeaderElection
+from ..workers.billing import BillingWorker
+from .helpers.settlement import SettlementHistory
+from ..config import BillingConfig
 
 class AdminService:
     def __init__(
@@ -35,7 +64,15 @@ class AdminService:
         transaction_opr: TransactionOperation,
         instance_opr: InstanceOperation,
         user_opr: UserOperation,
-        subscription_service: SubscriptionService
+        subscription_service: SubscriptionService,
+        identity_cache: IdentityCache,
+        password_hasher: PasswordHasher,
+        db_manager: DatabaseSessionManager,
+        operation_metrics: OperationMetrics,
+        slow_query_log: SlowQueryLog,
+        billing_leader: LeaderElection,
+        settlement_history: SettlementHistory,
+        billing_worker: BillingWorker
     ):
         self.admin_opr = admin_opr
         self.billing_opr = billing_opr
@@ -43,6 +80,14 @@ class AdminService:
         self.instance_opr = instance_opr
         self.user_opr = user_opr
         self.subscription_service = subscription_service
+        self.identity_cache = identity_cache
+        self.password_hasher = password_hasher
+        self.db_manager = db_manager
+        self.operation_metrics = operation_metrics
+        self.slow_query_log = slow_query_log
+        self.billing_leader = billing_leader
+        self.settlement_history = settlement_history
+        self.billing_worker = billing_worker
     
     @require_roles([UserRole.ADMIN])
     async def get_all_users_with_details(self) -> List[AdminUsersResponse]:
@@ -95,23 +140,43 @@ class AdminService:
         return AdminBillingStatsResponse(stats=stats)
     
     @require_roles([UserRole.ADMIN])
-    async def get_all_transactions(self) -> List[AdminTransactionResponse]:
-        transactions_with_details = await self.transaction_opr.get_all_transactions_with_details()
+    async def get_all_transactions(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        username: Optional[str] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        response: Response = None
+    ) -> List[AdminTransactionResponse]:
+        """Transactions newest first. With a limit, the cursor of the next page is set in the X-Next-Cursor header."""
+        start_dt, end_dt = self._parse_date_range(start_date, end_date)
+        transactions_with_details = await self.transaction_opr.get_all_transactions_with_details(
+            # One extra row tells whether there is a next page
+            limit=limit + 1 if limit is not None else None,
+            after=PaginationHelper.decode_cursor(cursor) if cursor else None,
+            username=username,
+            transaction_type=transaction_type,
+            transaction_status=transaction_status,
+            start_date=start_dt,
+            end_date=end_dt
+        )
+        if limit is not None and len(transactions_with_details) > limit:
+            transactions_with_details = transactions_with_details[:limit]
+            if response:
+                last_transaction = transactions_with_details[-1][0]
+                response.headers["X-Next-Cursor"] = PaginationHelper.encode_cursor(
+                    last_transaction.created_at, last_transaction.transaction_id
+                )
         
-        response = []
+        result = []
         for transaction, user, instance in transactions_with_details:
-            # Get instance name if instance exists
-            instance_name = None
-            if transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT:
-                if instance:
-                    instance_name = instance.hostname
-                else:
-                    instance_name = "Deleted Instance"
-                
-            response.append(AdminTransactionResponse(
+            result.append(AdminTransactionResponse(
                 transaction_id=transaction.transaction_id,
                 username=user.username,
-                instance_name=instance_name,
+                instance_name=self._instance_name(transaction.transaction_type, instance.hostname if instance else None),
                 transaction_type=transaction.transaction_type,
                 transaction_status=transaction.transaction_status,
                 amount=transaction.amount,
@@ -119,7 +184,76 @@ class AdminService:
                 last_updated_at=DateTimeUtils.to_bkk_string(transaction.last_updated_at)
             ))
         
-        return response
+        return result
+
+    @require_roles([UserRole.ADMIN])
+    async def export_transactions(
+        self,
+        export_format: str = "ndjson",
+        username: Optional[str] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Every matching transaction oldest first as NDJSON lines or CSV, one chunk per database batch."""
+        # Validate before the response starts, errors can't change the status code once it streams
+        start_dt, end_dt = self._parse_date_range(start_date, end_date)
+        batches = self.transaction_opr.stream_transactions_with_details(
+            username=username,
+            transaction_type=transaction_type,
+            transaction_status=transaction_status,
+            start_date=start_dt,
+            end_date=end_dt
+        )
+        if export_format == "csv":
+            return self._export_csv(batches)
+        return self._export_ndjson(batches)
+
+    async def _export_ndjson(self, batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[str]:
+        async for rows in batches:
+            yield "".join(self._export_row(row).model_dump_json() + "\n" for row in rows)
+
+    async def _export_csv(self, batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(AdminTransactionResponse.model_fields.keys())
+        yield buffer.getvalue()
+        async for rows in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(self._export_row(row).model_dump(mode="json").values() for row in rows)
+            yield buffer.getvalue()
+
+    def _export_row(self, row: Row) -> AdminTransactionResponse:
+        return AdminTransactionResponse(
+            transaction_id=row.transaction_id,
+            username=row.username,
+            instance_name=self._instance_name(row.transaction_type, row.hostname),
+            transaction_type=row.transaction_type,
+            transaction_status=row.transaction_status,
+            amount=row.amount,
+            created_at=DateTimeUtils.to_bkk_string(row.created_at),
+            last_updated_at=DateTimeUtils.to_bkk_string(row.last_updated_at)
+        )
+
+    @staticmethod
+    def _instance_name(transaction_type: TransactionType, hostname: Optional[str]) -> Optional[str]:
+        # Only subscription payments belong to an instance, which may be gone by now
+        if transaction_type != TransactionType.SUBSCRIPTION_PAYMENT:
+            return None
+        return hostname or "Deleted Instance"
+
+    @staticmethod
+    def _parse_date_range(start_date: Optional[str], end_date: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+        try:
+            return (
+                DateTimeUtils.from_string(start_date) if start_date else None,
+                DateTimeUtils.from_string(end_date) if end_date else None
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Dates must be in the '{DateTimeUtils.FORMAT}' format")
+
     @require_roles([UserRole.ADMIN])
     async def get_instance_plans(self) -> List[AdminInstancePlan]:
         result_db = await self.instance_opr.get_instance_plans_with_user_instances()
@@ -190,7 +324,7 @@ class AdminService:
             is_success=True
         )
 
-    async def topup(self, topup_request: AdminTopUpRequest) -> AdminTopUpResponse:
+    async def topup(self, topup_request: AdminTopUpRequest, background_tasks: BackgroundTasks) -> AdminTopUpResponse:
         # Get user by username
         user = await self.user_opr.get_user_by_username(topup_request.username)
         if not user:
@@ -216,6 +350,8 @@ class AdminService:
                 status_code=500,
                 detail="Failed to process top-up"
             )
+        # Background tasks run once the request's unit of work has committed the new balance
+        background_tasks.add_task(self.subscription_service.settle_after_top_up, user.user_id)
 
         return AdminTopUpResponse(
             transaction_id=result.transaction_id,
@@ -225,3 +361,143 @@ class AdminService:
             created_at=DateTimeUtils.to_bkk_string(result.created_at),
             last_updated_at=DateTimeUtils.to_bkk_string(result.last_updated_at)
         )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_identity_cache_stats(self) -> IdentityCacheStats:
+        return IdentityCacheStats(
+            request_hits=self.identity_cache.request_hits,
+            shared_hits=self.identity_cache.shared_hits,
+            misses=self.identity_cache.misses,
+            saved_queries=self.identity_cache.saved_queries,
+            shared_entries=self.identity_cache.shared_entries,
+            ttl_seconds=self.identity_cache.ttl_seconds
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_password_hasher_stats(self) -> PasswordHasherStats:
+        return PasswordHasherStats(
+            max_workers=self.password_hasher.max_workers,
+            max_pending=self.password_hasher.max_pending,
+            pending=self.password_hasher.pending,
+            completed=self.password_hasher.completed,
+            rejected=self.password_hasher.rejected
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_db_pool_stats(self) -> DatabasePoolStats:
+        pool = self.db_manager.pool
+        return DatabasePoolStats(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # Negative while the pool hasn't grown past pool_size
+            overflow=max(pool.overflow(), 0),
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_ms_avg=pool.wait_seconds_total / pool.checkouts * 1000 if pool.checkouts else 0.0,
+            wait_ms_max=pool.wait_seconds_max * 1000
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_db_replica_stats(self) -> DatabaseReplicaStats:
+        return DatabaseReplicaStats(
+            max_lag_seconds=self.db_manager.max_replica_lag,
+            primary_reads=self.db_manager.primary_reads,
+            replicas=[
+                ReplicaStats(
+                    name=replica.name,
+                    healthy=replica.lag_seconds is not None and replica.lag_seconds <= self.db_manager.max_replica_lag,
+                    lag_seconds=replica.lag_seconds,
+                    reads=replica.reads,
+                    error=replica.error
+                )
+                for replica in self.db_manager.replicas
+            ]
+        )
+
+    @staticmethod
+    def _histogram_buckets(histogram: Histogram) -> List[HistogramBucket]:
+        bounds = [*histogram.bounds, None]
+        return [HistogramBucket(le_ms=bound, count=count) for bound, count in zip(bounds, histogram.counts)]
+
+    @require_roles([UserRole.ADMIN])
+    async def get_operation_stats(self) -> List[OperationStats]:
+        stats = [
+            OperationStats(
+                route=route,
+                operation=operation,
+                calls=record.calls,
+                errors=record.errors,
+                wall_ms_total=round(record.wall_ms.total, 3),
+                wall_ms_avg=round(record.wall_ms.total / record.calls, 3),
+                wall_ms_p95=round(record.wall_ms.percentile(95), 3),
+                wall_ms_max=round(record.wall_ms.max, 3),
+                db_ms_avg=round(record.db_ms.total / record.calls, 3),
+                db_ms_p95=round(record.db_ms.percentile(95), 3),
+                db_ms_max=round(record.db_ms.max, 3),
+                statements_avg=round(record.statements / record.calls, 2),
+                rows_avg=round(record.rows / record.calls, 2),
+                wall_ms_histogram=self._histogram_buckets(record.wall_ms),
+                db_ms_histogram=self._histogram_buckets(record.db_ms)
+            )
+            for (route, operation), record in list(self.operation_metrics.records.items())
+        ]
+        # Where the time goes first
+        return sorted(stats, key=lambda stat: stat.wall_ms_total, reverse=True)
+
+    @require_roles([UserRole.ADMIN])
+    async def get_slow_queries(self, limit: int) -> SlowQueryLogResponse:
+        entries = list(self.slow_query_log.entries)[::-1][:limit]
+        return SlowQueryLogResponse(
+            threshold_ms=self.slow_query_log.threshold_ms,
+            size=self.slow_query_log.size,
+            recorded=self.slow_query_log.recorded,
+            skipped_explains=self.slow_query_log.skipped_explains,
+            queries=[SlowQueryEntry.model_validate(entry) for entry in entries]
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_billing_leader_stats(self) -> BillingLeaderStats:
+        leader = self.billing_leader
+        return BillingLeaderStats(
+            identity=leader.identity,
+            is_leader=leader.is_leader,
+            leader=leader.leader_identity,
+            leader_since=leader.leader_since,
+            elections=leader.elections,
+            demotions=leader.demotions,
+            check_interval_seconds=leader.check_interval,
+            last_error=leader.last_error,
+            handoffs=[LeaderHandoffEntry.model_validate(handoff) for handoff in reversed(leader.handoffs)]
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_billing_settlement_stats(self) -> BillingSettlementStats:
+        return BillingSettlementStats(
+            mode=BillingConfig.SETTLEMENT_MODE,
+            concurrency=BillingConfig.SETTLEMENT_CONCURRENCY,
+            runs=list(reversed(self.settlement_history.runs))
+        )
+
+    @require_roles([UserRole.ADMIN])
+    async def get_billing_deadline_stats(self) -> BillingDeadlineStats:
+        worker = self.billing_worker
+        listener = worker.deadline_listener
+        next_runs = worker.next_runs
+        return BillingDeadlineStats(
+            is_leader=worker.is_leader,
+            listening=listener.is_listening,
+            notifications=listener.notifications,
+            listener_reconnects=listener.reconnects,
+            listener_error=listener.last_error,
+            deadline_queries=worker.deadline_queries,
+            jobs=[
+                BillingDeadlineJob(
+                    job_id=job_id,
+                    next_run=next_runs.get(job_id),
+                    lateness_ms=list(reversed(lateness_ms))
+                )
+                for job_id, lateness_ms in worker.lateness_ms.items()
+            ]
+        )
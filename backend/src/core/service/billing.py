@@ -1,17 +1,22 @@
-from typing import List
-from fastapi import HTTPException
+from datetime import timedelta
+from typing import List, Optional
+from fastapi import BackgroundTasks, HTTPException, Response
 
 from ..sql.operations.transaction import TransactionOperation
 from ..sql.operations.billing import BillingOperation
 from .subscription import SubscriptionService
+from .instance import InstanceService
 from ..utils.datetime import DateTimeUtils
 from ..utils.permission import require_roles, require_account_ownership
 from ..utils.guard import require_test_environment
+from ..sql.database import DatabaseSessionManager
 from ..models.billing import UserBillingOverviewResponse, UserTopUpRequest, UserTopUpResponse
 from ..models.transaction import UserTransactionResponse, Transaction
+from ..models.subscription import UserSubscription
 from ..models.user import UserWalletResponse
 from ..constants.user_const import UserRole
-from ..constants.transaction_const import TransactionStatus
+from ..constants.transaction_const import TransactionStatus, TransactionType
+from .helpers.pagination_helper import PaginationHelper
 
 
 class BillingService:
@@ -19,11 +24,15 @@ class BillingService:
         self,
         billing_opr: BillingOperation,
         transaction_opr: TransactionOperation,
-        subscription_service: SubscriptionService
+        subscription_service: SubscriptionService,
+        instance_service: InstanceService,
+        db_manager: DatabaseSessionManager
     ):
         self.billing_opr = billing_opr
         self.transaction_opr = transaction_opr
         self.subscription_service = subscription_service
+        self.instance_service = instance_service
+        self.db_manager = db_manager
 
     @require_roles([UserRole.ADMIN, UserRole.USER])
     @require_account_ownership()
@@ -40,10 +49,42 @@ class BillingService:
             all_time_payment=result.all_time_payment,
         )
     
+    @require_roles([UserRole.WORKER, UserRole.ADMIN])
+    async def repair_billing_summaries(self) -> int:
+        """Fix billing summaries that drifted from subscriptions and transactions, returns how many."""
+        return await self.billing_opr.repair_user_billing_summaries()
+    
+    @require_roles([UserRole.WORKER, UserRole.ADMIN])
+    async def fold_billing_rollup(self) -> int:
+        """Move the changes appended by the rollup trigger into the hourly buckets, returns how many."""
+        return await self.billing_opr.fold_billing_rollup_deltas()
+    
     @require_roles([UserRole.ADMIN, UserRole.USER])
     @require_account_ownership()
-    async def get_all_user_transactions(self, username: str) -> List[UserTransactionResponse]:
-        result = await self.transaction_opr.get_all_user_transactions(username=username)
+    async def get_all_user_transactions(
+        self,
+        username: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        response: Response = None
+    ) -> List[UserTransactionResponse]:
+        """Transactions newest first. With a limit, the cursor of the next page is set in the X-Next-Cursor header."""
+        result = await self.transaction_opr.get_user_transactions(
+            username=username,
+            # One extra row tells whether there is a next page
+            limit=limit + 1 if limit is not None else None,
+            after=PaginationHelper.decode_cursor(cursor) if cursor else None,
+            transaction_type=transaction_type,
+            transaction_status=transaction_status
+        )
+        if limit is not None and len(result) > limit:
+            result = result[:limit]
+            if response:
+                response.headers["X-Next-Cursor"] = PaginationHelper.encode_cursor(
+                    result[-1].created_at, result[-1].transaction_id
+                )
         return [UserTransactionResponse(
             transaction_id=transaction.transaction_id,
             transaction_type=transaction.transaction_type,
@@ -55,7 +96,7 @@ class BillingService:
     
     @require_roles([UserRole.ADMIN, UserRole.USER])
     @require_account_ownership()
-    async def top_up(self, username: str, top_up_request: UserTopUpRequest) -> UserTopUpResponse:
+    async def top_up(self, username: str, top_up_request: UserTopUpRequest, background_tasks: BackgroundTasks) -> UserTopUpResponse:
         user_id = (await self.subscription_service.user_opr.get_user_by_username(username)).user_id
 
         transaction = self.subscription_service._create_topup_transaction(
@@ -72,6 +113,8 @@ class BillingService:
                 status_code=500,
                 detail="Failed to process top-up",
             )
+        # Background tasks run once the request's unit of work has committed the new balance
+        background_tasks.add_task(self.subscription_service.settle_after_top_up, user_id)
         return UserTopUpResponse(
             transaction_id=result.transaction_id,
             transaction_type=result.transaction_type,
@@ -98,24 +141,46 @@ class BillingService:
 
     @require_test_environment
     async def trigger_overdue_subscription_action(self, instance_name: str):
-        subscription_transactions = await self.get_subscription_transactions(instance_name=instance_name)
-        await self.subscription_service.process_overdue_subscriptions(subscription_transactions)
+        """Settle the instance owner's payments as if the instance's payment date had passed."""
+        subscription = await self.get_subscription(instance_name=instance_name)
+        subscription_transactions = await self.get_subscription_transactions(subscription)
+        await self.subscription_service.settle_due_subscriptions(
+            user_id=subscription_transactions[0].user_id,
+            due_before=subscription.next_payment_date + timedelta(microseconds=1),
+            subscription_id=subscription.subscription_id
+        )
 
     @require_test_environment
     async def trigger_expired_subscription_action(self, instance_name: str):
-        subscription_transactions = await self.get_subscription_transactions(instance_name=instance_name)
-        await self.subscription_service.process_expired_subscriptions(subscription_transactions)
+        """Expire the instance's subscription as if its expiry date had passed, and delete its container right away."""
+        subscription = await self.get_subscription(instance_name=instance_name)
+        await self.get_subscription_transactions(subscription)
+        result = await self.subscription_service.expire_due_subscriptions(
+            expired_before=subscription.next_expire_date + timedelta(microseconds=1),
+            subscription_id=subscription.subscription_id
+        )
+        if not result.expired:
+            raise HTTPException(
+                status_code=409,
+                detail="No overdue payment to expire",
+            )
+        # The expiry must be durable before the container goes
+        await self.db_manager.commit_unit_of_work()
+        await self.instance_service.process_instance_teardowns(instance_ids=[subscription.instance_id])
 
-    async def get_subscription_transactions(self, instance_name: str) -> List[Transaction]:
+    async def get_subscription(self, instance_name: str) -> UserSubscription:
         subscription = await self.subscription_service.subscription_opr.get_subscription_by_instance(instance_name=instance_name)
         if not subscription:
             raise HTTPException(
                 status_code=404,
                 detail="Subscription not found",
             )
-        subscription_transactions = await self.subscription_service._get_subscription_transactions(
-            subscriptions=[subscription],
-            transaction_statuses=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
+        return subscription
+
+    async def get_subscription_transactions(self, subscription: UserSubscription) -> List[Transaction]:
+        subscription_transactions = await self.transaction_opr.get_subscription_transactions(
+            subscription_id=subscription.subscription_id,
+            transaction_status=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
         )
         if not subscription_transactions:
             raise HTTPException(
@@ -20,6 +20,15 @@ class BaseInstanceClient(ABC, Generic[InstanceType]):
         """Retrieve an instance by name"""
         pass
 
+    @abstractmethod
+    def instance_exists(
+        self, 
+        instance_identifier: Any, 
+        **kwargs: Any
+    ) -> bool:
+        """Check whether an instance exists"""
+        pass
+
     @abstractmethod
     def create_instance(
         self, 
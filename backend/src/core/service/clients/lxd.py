@@ -36,6 +36,12 @@ class LXDClient(BaseInstanceClient[models.Instance]):
     def get_instance(self, instance_identifier: str) -> models.Instance:
         return self.lxd_manager.get_container_by_name(instance_identifier)
     
+    async def instance_exists(self, instance_identifier: str) -> bool:
+        return await asyncio.to_thread(
+            self.lxd_manager.container_exists,
+            instance_identifier
+        )
+    
     async def create_instance(self, instance_config: InstanceCreateRequest) -> UserInstance:
         container = await asyncio.to_thread(
             self.lxd_manager.create_container,
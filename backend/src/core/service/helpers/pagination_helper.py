@@ -0,0 +1,21 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import Tuple
+from fastapi import HTTPException
+
+class PaginationHelper:
+    @staticmethod
+    def encode_cursor(created_at: datetime, row_id: uuid.UUID) -> str:
+        """Opaque keyset cursor pointing after the given row."""
+        raw = f"{created_at.isoformat()}|{row_id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            created_at, row_id = raw.split("|")
+            return datetime.fromisoformat(created_at), uuid.UUID(row_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
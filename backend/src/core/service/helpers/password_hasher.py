@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+from fastapi import HTTPException, status
+
+from ...config import PasswordHashingConfig
+from ...utils.logging import logger
+from .user_helper import UserHelper
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification in a bounded process pool.
+
+    bcrypt is CPU bound, so running it on the event loop stalls every other
+    request and websocket of the worker. Work beyond the configured queue depth
+    is rejected with 429 instead of piling up behind the pool.
+    """
+    _instance: Optional["PasswordHasher"] = None
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @classmethod
+    def get_instance(cls) -> "PasswordHasher":
+        """Get the singleton instance of PasswordHasher"""
+        if cls._instance is None:
+            cls._instance = cls(
+                max_workers=PasswordHashingConfig.MAX_WORKERS,
+                max_pending=PasswordHashingConfig.MAX_PENDING
+            )
+        return cls._instance
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        """Create the process pool, spawned so workers don't inherit the event loop."""
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Password hasher started with {self.max_workers} workers")
+
+    async def shutdown(self) -> None:
+        """Stop the process pool, waiting for the workers off the event loop."""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def hash_password(self, password: str) -> str:
+        return await self._submit(UserHelper.hash_password, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(UserHelper.verify_password, plain_password, hashed_password)
+
+    async def _submit(self, func: Callable[..., Any], *args) -> Any:
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests in progress, please try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.start()
+
+        self._pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
+
+
+def get_password_hasher() -> PasswordHasher:
+    return PasswordHasher.get_instance()
@@ -0,0 +1,141 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import AsyncContextManager, Awaitable, Callable, Deque, Dict, List, Optional
+
+from ...config import BillingConfig
+from ...constants.transaction_const import TransactionStatus
+from ...models.subscription import SettlementFailure, SettlementRun
+from ...models.transaction import Transaction
+from ...utils.datetime import DateTimeUtils
+from ...utils.logging import logger
+
+
+def settlement_run(
+    mode: str,
+    started_at: datetime,
+    started: float,
+    users: int,
+    processed: int,
+    paid: int,
+    failures: Optional[List[SettlementFailure]] = None,
+    retries: int = 0
+) -> SettlementRun:
+    """Summarize a settlement that began at the perf_counter value started."""
+    failures = failures or []
+    duration = time.perf_counter() - started
+    return SettlementRun(
+        mode=mode,
+        started_at=started_at,
+        duration_ms=round(duration * 1000, 3),
+        users=users,
+        processed=processed,
+        paid=paid,
+        unpaid=processed - paid - len(failures),
+        failed=len(failures),
+        retries=retries,
+        per_second=round(processed / duration, 2) if duration > 0 else 0.0,
+        failures=failures
+    )
+
+
+class SettlementPipeline:
+    """
+    Settles subscription payments one by one, several users at once.
+
+    Each user's payments go through a single task in order, so two tasks never
+    wait on the same wallet lock. Every attempt runs in its own unit of work, so a
+    failure rolls back the payment together with its next cycle and a retry can't
+    charge twice. A payment settled elsewhere since it was read, like by the
+    settlement after a top up, is skipped by process. After the last attempt the
+    payment is recorded and skipped; it doesn't stop the rest.
+    """
+    def __init__(
+        self,
+        process: Callable[[Transaction], Awaitable[Transaction]],
+        unit_of_work: Callable[[], AsyncContextManager],
+        concurrency: int = 8,
+        max_attempts: int = 3,
+        retry_backoff: float = 0.2
+    ):
+        self.process = process
+        self.unit_of_work = unit_of_work
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    async def run(self, transactions: List[Transaction]) -> SettlementRun:
+        started_at = DateTimeUtils.now_dt()
+        started = time.perf_counter()
+        by_user: Dict[uuid.UUID, List[Transaction]] = {}
+        for transaction in sorted(transactions, key=lambda t: (t.created_at, str(t.transaction_id))):
+            by_user.setdefault(transaction.user_id, []).append(transaction)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures: List[SettlementFailure] = []
+        counts = {"paid": 0, "retries": 0}
+
+        async def settle_user(user_transactions: List[Transaction]):
+            async with semaphore:
+                for transaction in user_transactions:
+                    settled = await self._settle(transaction, failures, counts)
+                    if settled is not None and settled.transaction_status == TransactionStatus.PAID:
+                        counts["paid"] += 1
+
+        await asyncio.gather(*(settle_user(user_transactions) for user_transactions in by_user.values()))
+        return settlement_run(
+            "pipeline", started_at, started,
+            users=len(by_user),
+            processed=len(transactions),
+            paid=counts["paid"],
+            failures=failures,
+            retries=counts["retries"]
+        )
+
+    async def _settle(
+        self,
+        transaction: Transaction,
+        failures: List[SettlementFailure],
+        counts: Dict[str, int]
+    ) -> Optional[Transaction]:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                # Processing updates the model in place, every attempt starts from the original
+                async with self.unit_of_work():
+                    return await self.process(transaction.model_copy())
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    failures.append(SettlementFailure(
+                        transaction_id=transaction.transaction_id,
+                        user_id=transaction.user_id,
+                        attempts=attempt,
+                        error=str(e)
+                    ))
+                    return None
+                counts["retries"] += 1
+                logger.warning(f"Retrying transaction({transaction.transaction_id}) after attempt {attempt}: {str(e)}")
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+
+class SettlementHistory:
+    """The latest settlement runs of this process, newest last."""
+    _instance: Optional["SettlementHistory"] = None
+
+    def __init__(self, size: int = 20):
+        self.runs: Deque[SettlementRun] = deque(maxlen=size)
+
+    @classmethod
+    def get_instance(cls) -> "SettlementHistory":
+        """Get the singleton instance of SettlementHistory"""
+        if cls._instance is None:
+            cls._instance = cls(size=BillingConfig.SETTLEMENT_HISTORY)
+        return cls._instance
+
+    def record(self, run: SettlementRun):
+        self.runs.append(run)
+
+
+def get_settlement_history() -> SettlementHistory:
+    return SettlementHistory.get_instance()
@@ -1,4 +1,6 @@
+from datetime import datetime, timedelta
 from typing import List, Optional
+import time
 import uuid
 from fastapi import HTTPException, WebSocket
 import asyncio
@@ -15,13 +17,18 @@ from ..models.instance import (
     UserInstanceResponse,
     InstanceControlResponse,
     BaseInstanceState,
-    InstanceResetPasswordRequest
+    InstanceResetPasswordRequest,
+    InstanceTeardown,
+    TeardownRun
 )
 from ..sql.operations import InstanceOperation
+from ..sql.database import DatabaseSessionManager
 from ..utils.dependencies import user_session_ctx
 from .helpers.instance_helper import InstanceHelper
 from ..utils.permission import require_roles, require_instance_ownership, require_account_ownership
 from ..constants.user_const import UserRole
+from ..config import BillingConfig
+from ..utils.logging import logger
 
 
 class InstanceService:
@@ -29,11 +36,13 @@ class InstanceService:
         self,
         subscription_service: SubscriptionService,
         instance_opr: InstanceOperation,
-        lxd_client: BaseInstanceClient
+        lxd_client: BaseInstanceClient,
+        db_manager: DatabaseSessionManager
     ):
         self.subscription_service = subscription_service
         self.instance_opr = instance_opr
         self.lxd_client = lxd_client
+        self.db_manager = db_manager
     
     @require_roles([UserRole.ADMIN, UserRole.USER])
     async def get_all_instance_details(self) -> InstanceDetails:
@@ -86,22 +95,36 @@ class InstanceService:
         if user_wallet.balance < self.subscription_service._calculate_payment_amount(instance_plan_create.cost_hour):
             raise HTTPException(status_code=400, detail="Insufficient balance")
         
+        # Don't keep the request's transaction open while the container is created
+        await self.db_manager.commit_unit_of_work()
+
         # Create instance in LXD
         instance = await self.lxd_client.create_instance(instance_create)
         if not instance:
             raise RuntimeError("Failed to create instance")
         
-        # Create instance in DB
-        created_instance = await self.instance_opr.upsert_user_instance(instance)
+        try:
+            # Create instance in DB
+            created_instance = await self.instance_opr.upsert_user_instance(instance)
 
-        # Create subscription
-        first_payment_transaction = await self.subscription_service.create_subscription(
-            user_id=user_session_ctx.get().user_id,
-            instance_id=created_instance.instance_id,
-            instance_plan=instance_plan_create
-        )
+            # Create subscription
+            first_payment_transaction = await self.subscription_service.create_subscription(
+                user_id=user_session_ctx.get().user_id,
+                instance_id=created_instance.instance_id,
+                instance_plan=instance_plan_create
+            )
 
-        await self.subscription_service.process_transaction(first_payment_transaction)
+            await self.subscription_service.process_transaction(first_payment_transaction)
+
+            # Commit before answering, a commit failing at the end of the request would orphan the container
+            await self.db_manager.commit_unit_of_work()
+        except Exception:
+            # The rows are rolled back with the request, the container must go with them
+            try:
+                await self.lxd_client.delete_instance(instance.hostname)
+            except Exception as e:
+                logger.error(f"Failed to delete the container of instance {instance.hostname} after a failed create: {str(e)}")
+            raise
 
         return InstanceCreateResponse(
             instance_name=created_instance.hostname,
@@ -195,13 +218,17 @@ class InstanceService:
             await self.get_instance(instance_id=instance_id, instance_name=instance_name)
         )
 
-        # Delete subscription
-        result = await subscription_opr.delete_subscription(instance_id=instance.instance_id)
-        if result:
-            await transaction_opr.delete_subscription_transaction(subscription_id=result.subscription_id)
+        # Delete the scheduled payment first, deleting the subscription unlinks its transactions
+        await transaction_opr.delete_subscription_transaction(instance_id=instance.instance_id)
+        await subscription_opr.delete_subscription(instance_id=instance.instance_id)
+
+        # Stop billing before the container goes, a commit failing at the end of the
+        # request would otherwise keep charging for a deleted container
+        await self.db_manager.commit_unit_of_work()
         
-        # Delete instance in LXD
-        await self.lxd_client.delete_instance(instance.hostname)
+        # Delete instance in LXD, gone already when an earlier attempt failed after deleting it
+        if await self.lxd_client.instance_exists(instance.hostname):
+            await self.lxd_client.delete_instance(instance.hostname)
 
         # Delete instance in DB
         await self.instance_opr.delete_user_instance(instance.instance_id)
@@ -212,6 +239,60 @@ class InstanceService:
             is_success=True
         )
     
+    @require_roles([UserRole.ADMIN, UserRole.WORKER])
+    async def process_instance_teardowns(self, instance_ids: Optional[List[uuid.UUID]] = None) -> TeardownRun:
+        """
+        Delete the containers of instances queued by expired subscriptions (or the given ones), several at once.
+        
+        A container that fails is retried later with a doubling wait, without
+        holding up the others, and left for an admin after its last attempt.
+        """
+        started_at = DateTimeUtils.now_dt()
+        started = time.perf_counter()
+        teardowns = await self.instance_opr.get_due_instance_teardowns(
+            due_before=started_at,
+            limit=BillingConfig.TEARDOWN_BATCH_SIZE,
+            instance_ids=instance_ids
+        )
+        semaphore = asyncio.Semaphore(BillingConfig.TEARDOWN_CONCURRENCY)
+        
+        async def teardown(instance: InstanceTeardown) -> str:
+            async with semaphore:
+                try:
+                    # Gone already when an earlier attempt deleted it but failed afterwards
+                    if await self.lxd_client.instance_exists(instance.hostname):
+                        await self.lxd_client.delete_instance(instance.hostname)
+                    # Takes the queue entry with it
+                    await self.instance_opr.delete_user_instance(instance.instance_id)
+                    return "deleted"
+                except Exception as e:
+                    attempts = instance.attempts + 1
+                    given_up = attempts >= BillingConfig.TEARDOWN_MAX_ATTEMPTS
+                    next_attempt_at = None if given_up else DateTimeUtils.now_dt() + timedelta(
+                        seconds=BillingConfig.TEARDOWN_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+                    )
+                    await self.instance_opr.fail_instance_teardown(instance.instance_id, str(e), next_attempt_at)
+                    logger.error(
+                        f"Failed to delete the container of instance {instance.hostname} (attempt {attempts}"
+                        f"{', giving up' if given_up else ''}): {str(e)}"
+                    )
+                    return "given_up" if given_up else "failed"
+        
+        results = await asyncio.gather(*(teardown(instance) for instance in teardowns))
+        return TeardownRun(
+            started_at=started_at,
+            duration_ms=round((time.perf_counter() - started) * 1000, 3),
+            attempted=len(results),
+            deleted=results.count("deleted"),
+            failed=results.count("failed") + results.count("given_up"),
+            given_up=results.count("given_up")
+        )
+    
+    @require_roles([UserRole.ADMIN, UserRole.WORKER])
+    async def get_next_teardown_at(self) -> Optional[datetime]:
+        """When the next queued container is due to be deleted."""
+        return await self.instance_opr.get_next_instance_teardown_at()
+    
     @require_roles([UserRole.ADMIN, UserRole.USER])
     @require_instance_ownership()
     async def terminal_websocket_session(self, instance_name: str, client_ws: WebSocket):
@@ -1,16 +1,25 @@
+from datetime import datetime
 from typing import List, Optional
+import time
 import uuid
 
 from ..sql.operations import TransactionOperation, SubscriptionOperation, UserOperation
-from ..models.subscription import UserSubscription
 from ..models.transaction import Transaction
 from ..models.instance import InstancePlan
 from ..models.user import UserWallet
+from ..models.subscription import BillingCheckpoint, ExpiryResult, SettlementFailure, SettlementResult, SettlementRun
 from ..utils.datetime import DateTimeUtils
 from ..constants.subscription_const import PAYMENT_INTERVAL, EXPIRE_INTERVAL
 from ..constants.transaction_const import TransactionType, TransactionStatus
-from ..utils.permission import require_roles
+from ..utils.permission import require_roles, worker_context
+from ..utils.logging import logger
 from ..constants.user_const import UserRole
+from ..config import BillingConfig
+from ..sql.database import DatabaseSessionManager
+from .helpers.settlement import SettlementPipeline, settlement_run
+
+# Checkpoint row of the chunked settlement
+SETTLEMENT_CHECKPOINT = "settle_due_subscriptions"
 
 
 class SubscriptionService:
@@ -18,11 +27,13 @@ class SubscriptionService:
         self,
         user_opr: UserOperation,
         subscription_opr: SubscriptionOperation,
-        transaction_opr: TransactionOperation
+        transaction_opr: TransactionOperation,
+        db_manager: DatabaseSessionManager
     ):
         self.user_opr = user_opr
         self.subscription_opr = subscription_opr
         self.transaction_opr = transaction_opr
+        self.db_manager = db_manager
 
     async def create_subscription(self, user_id: uuid.UUID, instance_id: uuid.UUID, instance_plan: InstancePlan) -> Transaction:
         """Create a new subscription and schedule the first payment transaction."""
@@ -49,8 +60,9 @@ class SubscriptionService:
     
     async def next_subscription(self, transaction_old: Transaction) -> None:
         """Schedule the next subscription payment after a successful payment."""
-        subscription_id = self._get_reference_id(transaction_old)
-        subscription = await self.subscription_opr.get_subscription_by_id(subscription_id)
+        if transaction_old.subscription_id is None:
+            return
+        subscription = await self.subscription_opr.get_subscription_by_id(transaction_old.subscription_id)
         
         if not subscription:
             return
@@ -75,26 +87,9 @@ class SubscriptionService:
         await self.transaction_opr.upsert_transaction(transaction_new)
     
     @require_roles([UserRole.ADMIN, UserRole.WORKER])
-    async def get_overdue_subscriptions(self) -> List[Transaction]:
-        """Get all subscriptions that are past their payment date but not yet expired."""
-        datetime_now = DateTimeUtils.now_dt()
-        overdue_subscriptions = await self.subscription_opr.get_overdue_subscriptions(datetime_now)
-
-        return await self._get_subscription_transactions(
-            subscriptions=overdue_subscriptions,
-            transaction_statuses=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
-        )
-    
-    @require_roles([UserRole.ADMIN, UserRole.WORKER])
-    async def get_expired_subscriptions(self) -> List[Transaction]:
-        """Get all subscriptions that have passed their expiration date."""
-        datetime_now = DateTimeUtils.now_dt()
-        expired_subscriptions = await self.subscription_opr.get_expired_subscriptions(datetime_now)
-
-        return await self._get_subscription_transactions(
-            subscriptions=expired_subscriptions,
-            transaction_statuses=[TransactionStatus.OVERDUE]
-        )
+    async def get_next_deadlines(self) -> tuple[Optional[datetime], Optional[datetime]]:
+        """When the next scheduled payment falls due and the next overdue subscription expires."""
+        return await self.transaction_opr.get_next_subscription_deadlines()
     
     @require_roles([UserRole.ADMIN, UserRole.USER, UserRole.WORKER])
     async def get_user_wallet(self, user_id: Optional[uuid.UUID] = None, username: Optional[str] = None) -> UserWallet:
@@ -107,8 +102,13 @@ class SubscriptionService:
         return user_wallet
     
     @require_roles([UserRole.ADMIN, UserRole.USER, UserRole.WORKER])
-    async def process_transaction(self, transaction: Transaction) -> Transaction:
-        """Process a transaction based on its type and the user's wallet balance."""
+    async def process_transaction(self, transaction: Transaction) -> Optional[Transaction]:
+        """
+        Process a transaction based on its type and the user's wallet balance.
+        
+        Returns None when the transaction was settled concurrently since it was read,
+        by the settlement after a top up for instance, nothing is charged again then.
+        """
         await self.get_user_wallet(user_id=transaction.user_id)
 
         if transaction.transaction_type == TransactionType.TOP_UP:
@@ -123,59 +123,149 @@ class SubscriptionService:
             )
             
             # If payment was successful, schedule next payment
-            if updated_transaction.transaction_status == TransactionStatus.PAID:
+            if updated_transaction is not None and updated_transaction.transaction_status == TransactionStatus.PAID:
                 await self.next_subscription(updated_transaction)
             
         return updated_transaction
     
     @require_roles([UserRole.ADMIN, UserRole.WORKER])
-    async def apply_penalty(self, transaction: Transaction) -> None:
-        """Apply penalty for expired subscriptions by removing the instance and subscription."""
-        from .instance import InstanceService
-        from ..container import AppContainer
-        instance_service: InstanceService = AppContainer.instance_service()
-
-        subscription_id = self._get_reference_id(transaction)
-        subscription = await self.subscription_opr.get_subscription_by_id(subscription_id)
-        
-        if not subscription:
-            return
+    async def process_overdue_subscriptions_concurrently(self, overdue_subscriptions: List[Transaction]) -> SettlementRun:
+        """Process overdue subscription payments several users at a time, retrying and skipping the ones that fail."""
+        pipeline = SettlementPipeline(
+            process=self.process_transaction,
+            unit_of_work=self.db_manager.unit_of_work,
+            concurrency=BillingConfig.SETTLEMENT_CONCURRENCY,
+            max_attempts=BillingConfig.SETTLEMENT_MAX_ATTEMPTS,
+            retry_backoff=BillingConfig.SETTLEMENT_RETRY_BACKOFF_SECONDS
+        )
+        return await pipeline.run(overdue_subscriptions)
         
-        # Delete user instance and subscription
-        await instance_service.delete_instance(instance_id=subscription.instance_id)
+    @require_roles([UserRole.ADMIN, UserRole.WORKER])
+    async def settle_due_subscriptions(
+        self,
+        user_id: Optional[uuid.UUID] = None,
+        due_before: Optional[datetime] = None,
+        subscription_id: Optional[int] = None
+    ) -> SettlementRun:
+        """Settle every due subscription payment at once (or one user's or subscription's), paying what wallets cover and marking the rest overdue."""
+        started_at = DateTimeUtils.now_dt()
+        started = time.perf_counter()
+        result = await self._settle_due_subscription_payments(
+            due_before=due_before or started_at,
+            user_ids=None if user_id is None else [user_id],
+            subscription_ids=None if subscription_id is None else [subscription_id]
+        )
+        return settlement_run(
+            "bulk" if user_id is None else "user", started_at, started,
+            users=result.users, processed=result.due, paid=result.paid
+        )
     
     @require_roles([UserRole.ADMIN, UserRole.WORKER])
-    async def process_overdue_subscriptions(self, overdue_subscriptions: List[Transaction]) -> None:
-        """Attempt to process all overdue subscription payments."""
-        for transaction in overdue_subscriptions:
-            try:
-                await self.process_transaction(transaction)
-            except Exception as e:
-                raise ValueError(f"Failed to process transaction({transaction.transaction_id}): {str(e)}")
+    async def settle_due_subscriptions_in_chunks(self) -> SettlementRun:
+        """
+        Settle due subscription payments a chunk of users at a time, in bulk or through the settlement pipeline.
+        
+        Every chunk commits with the checkpoint of how far the run got, so a run cut
+        short by a restart or a leader change is carried on by the next one.
+        """
+        mode = BillingConfig.SETTLEMENT_MODE
+        started = time.perf_counter()
+        checkpoint = await self.subscription_opr.get_billing_checkpoint(SETTLEMENT_CHECKPOINT)
+        run_started_at = checkpoint.run_started_at if checkpoint else DateTimeUtils.now_dt()
+        after = uuid.UUID(checkpoint.position) if checkpoint else None
+        # Payments the interrupted run already settled, the returned run counts its own
+        resumed = checkpoint.processed if checkpoint else 0
+        if checkpoint:
+            logger.info(f"Resuming the settlement run of {DateTimeUtils.to_bkk_string(run_started_at)} after {resumed} payments")
+        
+        users = processed = paid = retries = 0
+        failures: List[SettlementFailure] = []
+        async for user_ids in self.transaction_opr.iter_due_subscription_users(
+            due_before=run_started_at,
+            after=after,
+            chunk_size=BillingConfig.SETTLEMENT_CHUNK_SIZE
+        ):
+            if mode == "pipeline":
+                transactions = await self.transaction_opr.get_subscription_transactions(
+                    payment_due_before=run_started_at,
+                    transaction_status=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE],
+                    user_ids=user_ids
+                )
+                run = await self.process_overdue_subscriptions_concurrently(transactions)
+                chunk_processed, chunk_paid = run.processed, run.paid
+                failures.extend(run.failures)
+                retries += run.retries
+                # Every payment committed on its own, settling the chunk again only retries the unpaid ones
+                await self._save_checkpoint(run_started_at, user_ids[-1], resumed + processed + chunk_processed)
+            else:
+                async with self.db_manager.unit_of_work():
+                    result = await self._settle_due_subscription_payments(due_before=run_started_at, user_ids=user_ids)
+                    chunk_processed, chunk_paid = result.due, result.paid
+                    await self._save_checkpoint(run_started_at, user_ids[-1], resumed + processed + chunk_processed)
+            users += len(user_ids)
+            processed += chunk_processed
+            paid += chunk_paid
+        
+        await self.subscription_opr.delete_billing_checkpoint(SETTLEMENT_CHECKPOINT)
+        return settlement_run(
+            mode, run_started_at, started,
+            users=users, processed=processed, paid=paid, failures=failures, retries=retries
+        )
+    
+    async def settle_after_top_up(self, user_id: uuid.UUID) -> None:
+        """Settle a user's due payments once their top up is committed, instead of waiting for the billing worker."""
+        try:
+            with worker_context():
+                run = await self.settle_due_subscriptions(user_id=user_id)
+            if run.processed:
+                logger.info(f"Settled {run.processed} due payments of user {user_id} after top up, {run.paid} paid")
+        except Exception as e:
+            # The billing worker retries on its next run
+            logger.error(f"Failed to settle due payments of user {user_id} after top up: {str(e)}")
         
     @require_roles([UserRole.ADMIN, UserRole.WORKER])
-    async def process_expired_subscriptions(self, expired_subscriptions: List[Transaction]) -> None:
-        """Mark expired subscriptions and apply penalties."""
-        for transaction in expired_subscriptions:
-            try:
-                transaction.transaction_status = TransactionStatus.EXPIRED
-                transaction.last_updated_at = DateTimeUtils.now_dt()
-                await self.transaction_opr.upsert_transaction(transaction)
-                await self.apply_penalty(transaction)
-            except Exception as e:
-                raise ValueError(f"Failed to process transaction({transaction.transaction_id}): {str(e)}")
-
-    def _get_reference_id(self, transaction: Transaction) -> int:
-        """Get the subscription ID from a transaction reference ID."""
-        return int(transaction.reference_id.split("_")[1])
-
+    async def expire_due_subscriptions(
+        self,
+        expired_before: Optional[datetime] = None,
+        subscription_id: Optional[int] = None
+    ) -> ExpiryResult:
+        """Expire every overdue subscription past its expiry date at once (or one), queueing its instance for teardown."""
+        return await self.transaction_opr.expire_due_subscriptions(
+            expired_before=expired_before or DateTimeUtils.now_dt(),
+            subscription_ids=None if subscription_id is None else [subscription_id]
+        )
+    
     # Private helper methods
+    async def _settle_due_subscription_payments(
+        self,
+        due_before: datetime,
+        user_ids: Optional[List[uuid.UUID]] = None,
+        subscription_ids: Optional[List[int]] = None
+    ) -> SettlementResult:
+        next_payment_date = DateTimeUtils.now_dt() + PAYMENT_INTERVAL
+        return await self.transaction_opr.settle_due_subscription_payments(
+            due_before=due_before,
+            next_payment_date=next_payment_date,
+            next_expire_date=next_payment_date + EXPIRE_INTERVAL,
+            user_ids=user_ids,
+            subscription_ids=subscription_ids
+        )
+    
+    async def _save_checkpoint(self, run_started_at: datetime, last_user_id: uuid.UUID, processed: int) -> None:
+        await self.subscription_opr.save_billing_checkpoint(BillingCheckpoint(
+            job=SETTLEMENT_CHECKPOINT,
+            run_started_at=run_started_at,
+            position=str(last_user_id),
+            processed=processed,
+            updated_at=DateTimeUtils.now_dt()
+        ))
+    
     def _calculate_payment_amount(self, hourly_cost: float) -> float:
         """Calculate the payment amount for a subscription period."""
         hours_in_payment_interval = PAYMENT_INTERVAL.total_seconds() / 3600  
         return hourly_cost * hours_in_payment_interval
 
-    def _create_subscription_transaction(self, user_id: uuid.UUID, subscription_id: uuid.UUID, amount: float) -> Transaction:
+    def _create_subscription_transaction(self, user_id: uuid.UUID, subscription_id: int, amount: float) -> Transaction:
         """Create a subscription payment transaction."""
         current_time = DateTimeUtils.now_dt()
         return Transaction(
@@ -183,6 +273,7 @@ class SubscriptionService:
             transaction_type=TransactionType.SUBSCRIPTION_PAYMENT,
             transaction_status=TransactionStatus.SCHEDULED,
             reference_id=f"subscription_{subscription_id}",
+            subscription_id=subscription_id,
             amount=amount,
             created_at=current_time,
             last_updated_at=current_time
@@ -201,23 +292,6 @@ class SubscriptionService:
             last_updated_at=current_time
         )
 
-    async def _get_subscription_transactions(
-        self, 
-        subscriptions: List[UserSubscription], 
-        transaction_statuses: List[TransactionStatus]
-    ) -> List[Transaction]:
-        """Get transactions for a list of subscriptions with specific statuses."""
-        if not subscriptions:
-            return []
-            
-        reference_ids = [f"subscription_{subscription.subscription_id}" for subscription in subscriptions]
-        
-        return await self.transaction_opr.get_transactions_by_reference_ids(
-            reference_ids=reference_ids,
-            transaction_type=[TransactionType.SUBSCRIPTION_PAYMENT],
-            transaction_status=transaction_statuses
-        )
-
     def _process_topup_transaction(self, user_wallet: UserWallet, transaction: Transaction) -> tuple[UserWallet, Transaction]:
         """Process a top-up transaction by adding funds to user wallet."""
         user_wallet.balance += transaction.amount
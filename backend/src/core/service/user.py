@@ -1,19 +1,26 @@
+from datetime import datetime, timezone
+from typing import Optional
 from fastapi import Request, Response, HTTPException, WebSocket
 
-from ..models.user import UserCreateRequest, UserCreateResponse, UserLoginRequest, UserLoginResponse, UserSessionResponse, UserInDB, UserWallet
+from ..models.user import UserCreateRequest, UserCreateResponse, UserLoginRequest, UserLoginResponse, UserSessionResponse, UserInDB, UserIdentity, UserWallet
 from ..utils.datetime import DateTimeUtils
 from ..sql.operations import UserOperation
 from .validators.user_validator import UserValidator
-from ..utils.token import TokenUtils
-from .helpers.user_helper import UserHelper
+from ..utils.token import TokenRevocationList, TokenUtils
+from .helpers.password_hasher import PasswordHasher
 from ..utils.guard import require_test_environment
+from ..utils.identity_cache import IdentityCache
 
 class UserService:
     def __init__(
         self,
-        user_opr: UserOperation
+        user_opr: UserOperation,
+        identity_cache: IdentityCache,
+        password_hasher: PasswordHasher
     ):
         self.user_opr = user_opr
+        self.identity_cache = identity_cache
+        self.password_hasher = password_hasher
 
     async def create_user(self, user_create: UserCreateRequest) -> UserCreateResponse:
         """Create a new user with hashed password."""
@@ -35,10 +42,12 @@ class UserService:
         user_create_in_db = UserInDB(
             username=user_create.username,
             email=user_create.email,
-            password_hash=UserHelper.hash_password(user_create.password),
+            password_hash=await self.password_hasher.hash_password(user_create.password),
             last_updated_at=DateTimeUtils.now_dt()
         )
         created_user = await self.user_opr.upsert_user(user_create_in_db)
+        self.identity_cache.invalidate(created_user.username)
+        TokenRevocationList.revoke(created_user.username)
 
         # Create user wallet with initial balance of 0.0 and store in database
         user_wallet_create_in_db = UserWallet(
@@ -77,10 +86,12 @@ class UserService:
         user_create_in_db = UserInDB(
             username=user_create.username,
             email=user_create.email,
-            password_hash=UserHelper.hash_password(user_create.password),
+            password_hash=await self.password_hasher.hash_password(user_create.password),
             last_updated_at=DateTimeUtils.now_dt()
         )
         created_user = await self.user_opr.create_admin_user(user_create_in_db)
+        self.identity_cache.invalidate(created_user.username)
+        TokenRevocationList.revoke(created_user.username)
 
         # Create user wallet with initial balance of 100.0 for admin users
         user_wallet_create_in_db = UserWallet(
@@ -106,12 +117,18 @@ class UserService:
             raise HTTPException(status_code=401, detail="Invalid username or password")
         
         # Verify password
-        if not UserHelper.verify_password(user_login.password, user.password_hash):
+        if not await self.password_hasher.verify_password(user_login.password, user.password_hash):
             raise HTTPException(status_code=401, detail="Invalid username or password")
         
-        # Generate tokens
+        # Generate tokens, the access token carries identity claims so requests can skip the users table
+        user_role = await self.user_opr.get_user_role(user.username)
         token_data = {"sub": user.username, "email": user.email}
-        access_token = TokenUtils.create_access_token(token_data)
+        access_token = TokenUtils.create_access_token(TokenUtils.identity_claims(UserIdentity(
+            user_id=user.user_id,
+            username=user.username,
+            email=user.email,
+            role=user_role.role_name
+        )))
         refresh_token = TokenUtils.create_refresh_token(token_data)
         
         # Set cookies if response object is provided
@@ -133,26 +150,54 @@ class UserService:
         if not access_token:
             return unauthenticated_response
         
+        identity = await self.get_user_identity(access_token)
+        
+        return UserSessionResponse(
+            is_authenticated=True,
+            username=identity.username,
+            email=identity.email,
+            role=identity.role
+        )
+
+    async def get_user_identity(self, access_token: str, response: Optional[Response] = None) -> UserIdentity:
+        """
+        Resolve the identity of an access token.
+
+        Fresh claims are trusted as is. Stale or revoked claims are checked against the
+        database, and when a response is given the access cookie is re-issued with fresh
+        claims and the original expiry.
+        """
         # Validate token
         payload = TokenUtils.validate_token(access_token)
         if not payload:
             raise HTTPException(status_code=401, detail="Invalid access token: Validation failed")
         
+        identity = TokenUtils.get_identity_from_claims(payload)
+        if identity:
+            return identity
+        
         # Get user details
         username = payload.get("sub")
-        user = await self.user_opr.get_user_by_username(username)
+        user = await self.identity_cache.get_user(username, self.user_opr.get_user_by_username)
         if not user:
             raise HTTPException(status_code=401, detail="Invalid access token: User not found")
         
         # Get user role
-        user_role = await self.user_opr.get_user_role(user.username)
-        
-        return UserSessionResponse(
-            is_authenticated=True,
+        user_role = await self.identity_cache.get_role(user.username, self.user_opr.get_user_role)
+        identity = UserIdentity(
+            user_id=user.user_id,
             username=user.username,
             email=user.email,
             role=user_role.role_name
         )
+        
+        if response:
+            expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+            access_token = TokenUtils.create_access_token(TokenUtils.identity_claims(identity), expires_at=expires_at)
+            max_age = max(int((expires_at - DateTimeUtils.now_dt()).total_seconds()), 0)
+            TokenUtils.set_secure_cookie(response, access_token, "access", max_age=max_age)
+        
+        return identity
 
     async def get_user_session(self, request: Request) -> UserSessionResponse:
         """Get current user session information from HTTP request."""
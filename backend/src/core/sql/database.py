@@ -1,6 +1,14 @@
 from typing import Any, AsyncIterator, Dict, List, Optional, Type
-from contextlib import asynccontextmanager
-from sqlalchemy import select
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import hashlib
+import json
+import time
+from sqlalchemy import event, exc, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
     AsyncSession,
@@ -9,20 +17,121 @@ from sqlalchemy.ext.asyncio import (
 )
 
 from ..config import DatabaseConfig
+from .instrumentation import instrument_engine
 from .tables.base import Base
 from .tables import *
 from ..commons.exception import create_exception_class
+from ..utils.datetime import DateTimeUtils
 from ..utils.logging import logger
 
 DatabaseException = create_exception_class("PostgresDatabase")
 
+
+class UnitOfWork:
+    """
+    One session shared by every operation of a request, committed once at the end.
+
+    Operations may run concurrently (e.g. in a TaskGroup), but an AsyncSession can
+    only run one statement at a time, so each operation holds the lock while it
+    uses the session. The owning task may re-enter without waiting on itself.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.lock = asyncio.Lock()
+        self.owner: Optional[asyncio.Task] = None
+        self.failed = False
+        # Until the unit writes, its read only operations may still go to a replica
+        self.wrote = False
+
+
+# Context variable holding the unit of work of the current request
+unit_of_work_ctx: ContextVar[Optional[UnitOfWork]] = ContextVar("unit_of_work", default=None)
+
+
+def _track_unit_of_work_execute(orm_execute_state: ORMExecuteState):
+    if orm_execute_state.is_select:
+        # The shared identity map would otherwise hand back rows as first loaded,
+        # hiding changes made by core UPDATE statements of earlier operations
+        orm_execute_state.update_execution_options(populate_existing=True)
+    else:
+        unit_of_work = unit_of_work_ctx.get()
+        if unit_of_work is not None:
+            unit_of_work.wrote = True
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a free connection."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+class ReplicaEngine:
+    """A read replica and the replication lag measured on it."""
+    # Zero when the replica has replayed everything it received, so an idle primary doesn't look like lag
+    LAG_QUERY = text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, host: str, engine_kwargs: dict[str, Any] = {}):
+        self.engine = create_async_engine(host, **{"poolclass": InstrumentedAsyncQueuePool, **engine_kwargs})
+        instrument_engine(self.engine.sync_engine)
+        self.sessionmaker = async_sessionmaker(autocommit=False, bind=self.engine, expire_on_commit=False)
+        self.name = f"{self.engine.url.host}:{self.engine.url.port or 5432}/{self.engine.url.database}"
+        self.lag_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reads = 0
+
+    async def measure_lag(self):
+        try:
+            async with self.engine.connect() as connection:
+                self.lag_seconds = float((await connection.execute(self.LAG_QUERY)).scalar_one())
+            self.error = None
+        except Exception as e:
+            self.lag_seconds = None
+            self.error = str(e)
+            logger.warning(f"Replica {self.name} is unavailable: {self.error}")
+
+
 # Reference: https://github.com/ThomasAitken/demo-fastapi-async-sqlalchemy/blob/main/backend/app/database.py
 class DatabaseSessionManager:
     _instance: Optional["DatabaseSessionManager"] = None
 
-    def __init__(self, host: str, engine_kwargs: dict[str, Any] = {}):
-        self._engine = create_async_engine(host, **engine_kwargs)
+    def __init__(
+        self,
+        host: str,
+        engine_kwargs: dict[str, Any] = {},
+        replica_hosts: List[str] = [],
+        max_replica_lag: float = 5.0,
+        lag_check_interval: float = 5.0
+    ):
+        self._engine = create_async_engine(host, **{"poolclass": InstrumentedAsyncQueuePool, **engine_kwargs})
+        instrument_engine(self._engine.sync_engine)
         self._sessionmaker = async_sessionmaker(autocommit=False, bind=self._engine, expire_on_commit=False)
+        self.replicas = [ReplicaEngine(replica_host, engine_kwargs) for replica_host in replica_hosts]
+        self.max_replica_lag = max_replica_lag
+        self.lag_check_interval = lag_check_interval
+        self.primary_reads = 0
+        self._lag_checked_at = float("-inf")
+        self._lag_check_lock = asyncio.Lock()
+        self._next_replica = 0
 
     @classmethod
     def get_instance(cls) -> "DatabaseSessionManager":
@@ -30,14 +139,38 @@ class DatabaseSessionManager:
         if cls._instance is None:
             cls._instance = cls(
                 host=DatabaseConfig.DB_URL, 
-                engine_kwargs=DatabaseConfig.DB_CONFIG
+                engine_kwargs=DatabaseConfig.DB_CONFIG,
+                replica_hosts=DatabaseConfig.REPLICA_URLS,
+                max_replica_lag=DatabaseConfig.REPLICA_MAX_LAG_SECONDS,
+                lag_check_interval=DatabaseConfig.REPLICA_LAG_CHECK_INTERVAL
             )
         return cls._instance
 
+    @property
+    def pool(self) -> InstrumentedAsyncQueuePool:
+        if self._engine is None:
+            raise DatabaseException("DatabaseSessionManager is not initialized")
+        return self._engine.pool
+
+    async def warmup(self, connections: int):
+        """Open connections up front so early requests don't wait on handshakes."""
+        if self._engine is None:
+            raise DatabaseException("DatabaseSessionManager is not initialized")
+
+        # Hold them all at once, otherwise the pool hands the same connection back
+        connections = min(connections, self.pool.size())
+        async with AsyncExitStack() as stack:
+            await asyncio.gather(*(
+                stack.enter_async_context(self._engine.connect()) for _ in range(connections)
+            ))
+        return connections
+
     async def close(self):
         if self._engine is None:
             raise DatabaseException("DatabaseSessionManager is not initialized")
         await self._engine.dispose()
+        for replica in self.replicas:
+            await replica.engine.dispose()
         self._engine = None
         self._sessionmaker = None
 
@@ -54,20 +187,149 @@ class DatabaseSessionManager:
                 raise DatabaseException(f"Error connecting to database: {str(e)}")
 
     @asynccontextmanager
-    async def session(self) -> AsyncIterator[AsyncSession]:
+    async def connect_autocommit(self) -> AsyncIterator[AsyncConnection]:
+        """Connection outside of a transaction, for statements like CREATE INDEX CONCURRENTLY."""
+        if self._engine is None:
+            raise DatabaseException("DatabaseSessionManager is not initialized")
+
+        async with self._engine.connect() as connection:
+            yield await connection.execution_options(isolation_level="AUTOCOMMIT")
+
+    @asynccontextmanager
+    async def session(self, read_only: bool = False, detached: bool = False) -> AsyncIterator[AsyncSession]:
         if self._sessionmaker is None:
             raise DatabaseException("DatabaseSessionManager is not initialized")
 
+        # Detached sessions are for streams that outlive the request's unit of work
+        unit_of_work = None if detached else unit_of_work_ctx.get()
+        replica = None
+        # Once a unit of work has written, its reads stay on its session to see those writes
+        if read_only and (unit_of_work is None or not unit_of_work.wrote):
+            replica = await self.pick_replica()
+
+        if replica is None and unit_of_work is not None:
+            async with self._join(unit_of_work, read_only) as session:
+                yield session
+            return
+
+        sessionmaker = self._sessionmaker
+        if replica is not None:
+            replica.reads += 1
+            sessionmaker = replica.sessionmaker
+        elif read_only:
+            self.primary_reads += 1
+
+        session = sessionmaker()
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    async def pick_replica(self) -> Optional[ReplicaEngine]:
+        """Next replica within the lag threshold, or None to read from the primary."""
+        if not self.replicas:
+            return None
+
+        if time.monotonic() - self._lag_checked_at >= self.lag_check_interval:
+            async with self._lag_check_lock:
+                # Another task may have refreshed while this one waited
+                if time.monotonic() - self._lag_checked_at >= self.lag_check_interval:
+                    await asyncio.gather(*(replica.measure_lag() for replica in self.replicas))
+                    self._lag_checked_at = time.monotonic()
+
+        healthy = [
+            replica for replica in self.replicas
+            if replica.lag_seconds is not None and replica.lag_seconds <= self.max_replica_lag
+        ]
+        if not healthy:
+            return None
+        self._next_replica = (self._next_replica + 1) % len(healthy)
+        return healthy[self._next_replica]
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """Share one session across every operation in this context and commit once at the end."""
+        if self._sessionmaker is None:
+            raise DatabaseException("DatabaseSessionManager is not initialized")
+
+        current = unit_of_work_ctx.get()
+        if current is not None:
+            yield current.session
+            return
+
         session = self._sessionmaker()
+        # Begun up front (no connection until the first statement), so the operations'
+        # own transactions are savepoints even when one of them comes first
+        await session.begin()
+        event.listen(session.sync_session, "do_orm_execute", _track_unit_of_work_execute)
+        unit_of_work = UnitOfWork(session)
+        token = unit_of_work_ctx.set(unit_of_work)
         try:
             yield session
+            if unit_of_work.failed:
+                raise DatabaseException("Unit of work was rolled back by a failed operation")
             await session.commit()
         except Exception:
             await session.rollback()
             raise
         finally:
+            unit_of_work_ctx.reset(token)
             await session.close()
 
+    async def commit_unit_of_work(self):
+        """
+        Commit what the current unit of work did so far and carry on in a new transaction.
+
+        For services about to cause an external side effect, which the commit at the
+        end of the request would come too late for. Does nothing outside a unit of work.
+        """
+        unit_of_work = unit_of_work_ctx.get()
+        if unit_of_work is None:
+            return
+        if unit_of_work.failed:
+            raise DatabaseException("Unit of work was rolled back by a failed operation")
+
+        async with unit_of_work.lock:
+            await unit_of_work.session.commit()
+            await unit_of_work.session.begin()
+
+    @asynccontextmanager
+    async def _join(self, unit_of_work: UnitOfWork, read_only: bool = False) -> AsyncIterator[AsyncSession]:
+        if unit_of_work.failed:
+            raise DatabaseException("Unit of work was rolled back by a failed operation")
+
+        task = asyncio.current_task()
+        if unit_of_work.owner is task:
+            yield unit_of_work.session
+            return
+
+        async with unit_of_work.lock:
+            unit_of_work.owner = task
+            # Reads have nothing to undo, writes get a savepoint so an operation
+            # failing outside the database only takes back its own changes
+            savepoint = None if read_only else await unit_of_work.session.begin_nested()
+            try:
+                yield unit_of_work.session
+                # Flush so later operations and the final commit see a consistent state
+                await unit_of_work.session.flush()
+                if savepoint is not None:
+                    await savepoint.commit()
+            except exc.DBAPIError:
+                # The transaction is unusable after a failed statement, keep the unit all or nothing
+                unit_of_work.failed = True
+                await unit_of_work.session.rollback()
+                raise
+            except Exception:
+                if savepoint is not None and savepoint.is_active:
+                    await savepoint.rollback()
+                raise
+            finally:
+                unit_of_work.owner = None
+
     async def create_all(self):
         async with self.connect() as connection:
             await connection.run_sync(Base.metadata.create_all)
@@ -80,6 +342,9 @@ def get_db_manager() -> DatabaseSessionManager:
     return DatabaseSessionManager.get_instance()
 
 class DataInitializer:
+    # Seed marker row of the registered data
+    MARKER_NAME = "initial_data"
+
     def __init__(self):
         self.initial_data = {}
         self.unique_keys = {}
@@ -91,50 +356,105 @@ class DataInitializer:
         Args:
             model: The SQLAlchemy model class
             data: List of dictionaries containing the data to insert (without primary keys)
-            unique_keys: List of column names to use for checking if a record exists
+            unique_keys: List of column names to use for checking if a record exists,
+                must match a unique index for bulk seeding
         """
+        if not unique_keys:
+            raise ValueError(f"No unique keys defined for {model.__name__}")
+        for data_item in data:
+            missing = [key for key in unique_keys if key not in data_item]
+            if missing:
+                raise ValueError(f"Unique key '{missing[0]}' not found in data for {model.__name__}")
         self.initial_data[model] = data
         self.unique_keys[model] = unique_keys
     
-    async def execute(self):
+    def digest(self) -> str:
+        """Hash of every registered table, key and row, changes whenever the seed data does."""
+        payload = [
+            (model.__tablename__, self.unique_keys[model], data_list)
+            for model, data_list in sorted(self.initial_data.items(), key=lambda item: item[0].__tablename__)
+        ]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    
+    async def execute(self, bulk: bool = True):
         """Execute all registered data initializations with conditional insertion"""
+        try:
+            if bulk:
+                await self._execute_bulk()
+            else:
+                await self._execute_rows()
+            logger.info("Database initialization completed successfully.")
+        except Exception as e:
+            raise DatabaseException(f"Error initializing database: {str(e)}")
+    
+    async def _execute_bulk(self):
+        """One INSERT .. ON CONFLICT DO NOTHING per table, skipped entirely when the marker matches."""
+        digest = self.digest()
         async with get_db_manager().session() as session:
-            try:
-                for model, data_list in self.initial_data.items():
-                    unique_keys = self.unique_keys[model]
-                    if not unique_keys:
-                        raise ValueError(f"No unique keys defined for {model.__name__}")
+            marker = (await session.execute(select(
+                SeedMarker.digest,
+                SeedMarker.schema_version,
+                select(func.max(SchemaMigration.version)).scalar_subquery().label("current_schema_version")
+            ).where(SeedMarker.name == self.MARKER_NAME))).one_or_none()
+            if marker and marker.digest == digest and marker.schema_version == marker.current_schema_version:
+                logger.info("Seed data unchanged, skipping initialization.")
+                return
+            
+            for model, data_list in self.initial_data.items():
+                if not data_list:
+                    continue
+                primary_key = model.__mapper__.primary_key[0]
+                stmt = pg_insert(model).values(data_list).on_conflict_do_nothing(
+                    index_elements=self.unique_keys[model]
+                ).returning(primary_key)
+                inserted_count = len((await session.execute(stmt)).all())
+                if inserted_count > 0:
+                    logger.info(f"{model.__name__} table initialized with {inserted_count} new records.")
+                else:
+                    logger.info(f"No new records inserted for {model.__name__}.")
+            
+            schema_version = (await session.execute(select(func.max(SchemaMigration.version)))).scalar_one()
+            marker_stmt = pg_insert(SeedMarker).values(
+                name=self.MARKER_NAME,
+                digest=digest,
+                schema_version=schema_version or 0,
+                applied_at=DateTimeUtils.now_dt()
+            )
+            await session.execute(marker_stmt.on_conflict_do_update(
+                index_elements=['name'],
+                set_={
+                    'digest': marker_stmt.excluded.digest,
+                    'schema_version': marker_stmt.excluded.schema_version,
+                    'applied_at': marker_stmt.excluded.applied_at
+                }
+            ))
+    
+    async def _execute_rows(self):
+        """Check every row on its own and insert the missing ones."""
+        async with get_db_manager().session() as session:
+            for model, data_list in self.initial_data.items():
+                unique_keys = self.unique_keys[model]
+                
+                inserted_count = 0
+                for data in data_list:
+                    # Build a query to check if this record exists
+                    query = select(model)
+                    for key in unique_keys:
+                        # Add condition for each unique key
+                        column = getattr(model, key)
+                        query = query.where(column == data[key])
                     
-                    inserted_count = 0
-                    for data in data_list:
-                        # Build a query to check if this record exists
-                        query = select(model)
-                        for key in unique_keys:
-                            if key in data:
-                                # Add condition for each unique key
-                                column = getattr(model, key)
-                                query = query.where(column == data[key])
-                            else:
-                                raise ValueError(f"Unique key '{key}' not found in data for {model.__name__}")
-                        
-                        # Check if record exists
-                        result = await session.execute(query)
-                        existing_record = result.scalar_one_or_none()
-                        
-                        if existing_record is None:
-                            # Record doesn't exist, create it
-                            instance = model(**data)
-                            session.add(instance)
-                            inserted_count += 1
+                    # Check if record exists
+                    result = await session.execute(query)
+                    existing_record = result.scalar_one_or_none()
                     
-                    if inserted_count > 0:
-                        logger.info(f"{model.__name__} table initialized with {inserted_count} new records.")
-                    else:
-                        logger.info(f"No new records inserted for {model.__name__}.")
+                    if existing_record is None:
+                        # Record doesn't exist, create it
+                        instance = model(**data)
+                        session.add(instance)
+                        inserted_count += 1
                 
-                # Commit all changes
-                await session.commit()
-                logger.info("Database initialization completed successfully.")  
-            except Exception as e:
-                await session.rollback()
-                raise DatabaseException(f"Error initializing database: {str(e)}")
\ No newline at end of file
+                if inserted_count > 0:
+                    logger.info(f"{model.__name__} table initialized with {inserted_count} new records.")
+                else:
+                    logger.info(f"No new records inserted for {model.__name__}.")
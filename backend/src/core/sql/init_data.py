@@ -1,4 +1,5 @@
 from .database import DataInitializer 
+from ..config import DatabaseConfig
 from .tables.user_role import UserRole 
 from .tables.os_type import OsType 
 from .tables.instance_plan import InstancePlan 
@@ -70,4 +71,4 @@ async def initialize_data():
     
     initializer.register(InstancePlan, instance_plans, ["instance_package_name"]) 
  
-    await initializer.execute()
\ No newline at end of file
+    await initializer.execute(bulk=DatabaseConfig.SEED_MODE != "rows")
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Per operation latency, database time, statement and row counts.
+
+BaseOperationMeta wraps every operation method with instrument_operation, which
+opens an OperationCall in a context variable. Cursor events of the instrumented
+engines add each statement's time to the open call, so database time is
+attributed to the operation (and the request route) that issued it.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+import bisect
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .slow_query_log import get_slow_query_log
+
+# Upper bounds of the latency histogram buckets, the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Route of the request being served, set by the track_request_route dependency
+request_route_ctx: ContextVar[Optional[str]] = ContextVar("request_route", default=None)
+
+
+@dataclass
+class OperationCall:
+    """Database work done inside one operation method call."""
+    name: str
+    db_seconds: float = 0.0
+    statements: int = 0
+
+
+operation_call_ctx: ContextVar[Optional[OperationCall]] = ContextVar("operation_call", default=None)
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float] = HISTOGRAM_BUCKETS_MS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the percentile, the max for the unbounded bucket."""
+        count = self.count
+        if not count:
+            return 0.0
+        rank = pct / 100 * count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+
+@dataclass
+class OperationRecord:
+    calls: int = 0
+    errors: int = 0
+    statements: int = 0
+    rows: int = 0
+    wall_ms: Histogram = field(default_factory=Histogram)
+    db_ms: Histogram = field(default_factory=Histogram)
+
+
+class OperationMetrics:
+    """Aggregates of every (route, operation) pair since startup."""
+    _instance: Optional["OperationMetrics"] = None
+
+    # Operations running outside of a request, e.g. in the billing worker
+    NO_ROUTE = "background"
+
+    def __init__(self):
+        self.records: Dict[Tuple[str, str], OperationRecord] = {}
+
+    @classmethod
+    def get_instance(cls) -> "OperationMetrics":
+        """Get the singleton instance of OperationMetrics"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def record(self, call: OperationCall, wall_seconds: float, rows: int, failed: bool):
+        key = (request_route_ctx.get() or self.NO_ROUTE, call.name)
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = OperationRecord()
+        record.calls += 1
+        record.errors += failed
+        record.statements += call.statements
+        record.rows += rows
+        record.wall_ms.observe(wall_seconds * 1000)
+        record.db_ms.observe(call.db_seconds * 1000)
+
+    def reset(self):
+        self.records = {}
+
+
+def get_operation_metrics() -> OperationMetrics:
+    return OperationMetrics.get_instance()
+
+
+def _count_rows(result: Any) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def instrument_operation(name: str, func: Callable) -> Callable:
+    """Record wall time, database time, statements and returned rows of an async operation method."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        parent = operation_call_ctx.get()
+        call = OperationCall(name)
+        token = operation_call_ctx.set(call)
+        started = time.perf_counter()
+        result = None
+        failed = True
+        try:
+            result = await func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            operation_call_ctx.reset(token)
+            # An operation calling another one spends that one's database time too
+            if parent is not None:
+                parent.db_seconds += call.db_seconds
+                parent.statements += call.statements
+            get_operation_metrics().record(call, time.perf_counter() - started, _count_rows(result), failed)
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    call = operation_call_ctx.get()
+    if call is not None:
+        call.db_seconds += elapsed
+        call.statements += 1
+    slow_query_log = get_slow_query_log()
+    if slow_query_log.is_slow(elapsed, context):
+        slow_query_log.record(
+            conn.engine, statement, parameters, elapsed, call.name if call else None, request_route_ctx.get()
+        )
+
+
+def instrument_engine(engine: Engine):
+    """Attribute the statements run on an engine to the operation issuing them."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
@@ -0,0 +1 @@
+from .timestamptz import convert_timestamp_columns
@@ -0,0 +1,184 @@
+"""
+Rebuild or verify the hourly billing rollup.
+
+billing_rollups holds the amount and count of transactions per UTC hour, type
+and status. A row trigger on transactions appends every insert, delete and
+change of type, status, amount or created_at to billing_rollup_deltas, which
+the billing worker folds into billing_rollups. Appending never waits on
+another transaction, where updating the shared hourly rows directly would
+queue every concurrent write of the same hour. Readers add the deltas not
+folded yet, so totals are exact either way.
+
+The tables only need a rebuild after they were edited by hand or the trigger
+was disabled. Startup installs the trigger and fills the rollup through
+migration 7.
+
+    python -m src.core.sql.maintenance.billing_rollup --check
+    python -m src.core.sql.maintenance.billing_rollup
+"""
+import argparse
+import asyncio
+from typing import List, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from ..database import get_db_manager
+from ...utils.logging import logger, configure_logging
+
+# Amounts are floats, sums built one delta at a time drift by rounding only
+AMOUNT_TOLERANCE = 0.005
+
+BUCKET_EXPR = "date_trunc('hour', {row}.created_at, 'UTC')"
+
+DELTA_COLUMNS = "bucket_hour, transaction_type, transaction_status, total_amount, transaction_count"
+
+APPLY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION billing_rollup_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO billing_rollup_deltas ({DELTA_COLUMNS})
+        VALUES ({BUCKET_EXPR.format(row="OLD")}, OLD.transaction_type, OLD.transaction_status, -OLD.amount, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO billing_rollup_deltas ({DELTA_COLUMNS})
+        VALUES ({BUCKET_EXPR.format(row="NEW")}, NEW.transaction_type, NEW.transaction_status, NEW.amount, 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Moves the oldest deltas into their buckets, returns how many. Deltas locked by
+# another fold are skipped, so concurrent folds never apply one twice
+FOLD_DELTAS = f"""
+WITH folded AS (
+    DELETE FROM billing_rollup_deltas
+    WHERE delta_id IN (
+        SELECT delta_id FROM billing_rollup_deltas
+        ORDER BY delta_id LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING {DELTA_COLUMNS}
+), applied AS (
+    INSERT INTO billing_rollups AS r ({DELTA_COLUMNS})
+    SELECT bucket_hour, transaction_type, transaction_status, sum(total_amount), sum(transaction_count)
+    FROM folded
+    GROUP BY 1, 2, 3
+    ON CONFLICT (bucket_hour, transaction_type, transaction_status) DO UPDATE
+    SET total_amount = r.total_amount + EXCLUDED.total_amount,
+        transaction_count = r.transaction_count + EXCLUDED.transaction_count
+)
+SELECT count(*) FROM folded
+"""
+
+TRIGGERS = [
+    "DROP TRIGGER IF EXISTS billing_rollup_insert_delete ON transactions",
+    "CREATE TRIGGER billing_rollup_insert_delete AFTER INSERT OR DELETE ON transactions "
+    "FOR EACH ROW EXECUTE FUNCTION billing_rollup_apply()",
+    "DROP TRIGGER IF EXISTS billing_rollup_update ON transactions",
+    # Upserts rewrite every column, only real changes move amounts between buckets
+    "CREATE TRIGGER billing_rollup_update AFTER UPDATE OF transaction_type, transaction_status, amount, created_at "
+    "ON transactions FOR EACH ROW "
+    "WHEN ((OLD.transaction_type, OLD.transaction_status, OLD.amount, OLD.created_at) "
+    "IS DISTINCT FROM (NEW.transaction_type, NEW.transaction_status, NEW.amount, NEW.created_at)) "
+    "EXECUTE FUNCTION billing_rollup_apply()",
+]
+
+RAW_BUCKETS = f"""
+SELECT {BUCKET_EXPR.format(row="t")} AS bucket_hour, t.transaction_type, t.transaction_status,
+       sum(t.amount) AS total_amount, count(*) AS transaction_count
+FROM transactions t
+GROUP BY 1, 2, 3
+"""
+
+ROLLUP_BUCKETS = f"""
+SELECT bucket_hour, transaction_type, transaction_status,
+       sum(total_amount) AS total_amount, sum(transaction_count) AS transaction_count
+FROM (
+    SELECT {DELTA_COLUMNS} FROM billing_rollups
+    UNION ALL
+    SELECT {DELTA_COLUMNS} FROM billing_rollup_deltas
+) buckets
+GROUP BY 1, 2, 3
+"""
+
+# Buckets whose rollup row and pending deltas disagree with the raw transactions, missing rows count as zero
+MISMATCHES = f"""
+SELECT coalesce(r.bucket_hour, raw.bucket_hour) AS bucket_hour,
+       coalesce(r.transaction_type, raw.transaction_type) AS transaction_type,
+       coalesce(r.transaction_status, raw.transaction_status) AS transaction_status,
+       coalesce(r.total_amount, 0) AS rollup_amount, coalesce(raw.total_amount, 0) AS raw_amount,
+       coalesce(r.transaction_count, 0) AS rollup_count, coalesce(raw.transaction_count, 0) AS raw_count
+FROM ({ROLLUP_BUCKETS}) r
+FULL JOIN ({RAW_BUCKETS}) raw USING (bucket_hour, transaction_type, transaction_status)
+WHERE coalesce(r.transaction_count, 0) <> coalesce(raw.transaction_count, 0)
+   OR abs(coalesce(r.total_amount, 0) - coalesce(raw.total_amount, 0)) > :tolerance
+ORDER BY 1, 2, 3
+"""
+
+
+async def install_trigger(connection: AsyncConnection):
+    await connection.execute(text(APPLY_FUNCTION))
+    for statement in TRIGGERS:
+        await connection.execute(text(statement))
+
+
+async def rebuild(connection: AsyncConnection) -> int:
+    """Recompute every bucket inside the caller's transaction, returns the bucket count."""
+    # Waits for transactions whose trigger already ran to commit and holds back new ones,
+    # those append their deltas on top of the rebuilt rows once this commits
+    await connection.execute(text("LOCK TABLE billing_rollups, billing_rollup_deltas IN EXCLUSIVE MODE"))
+    await connection.execute(text("DELETE FROM billing_rollup_deltas"))
+    await connection.execute(text("DELETE FROM billing_rollups"))
+    result = await connection.execute(text(
+        "INSERT INTO billing_rollups (bucket_hour, transaction_type, transaction_status, total_amount, transaction_count) "
+        + RAW_BUCKETS
+    ))
+    return result.rowcount
+
+
+async def fold_deltas(connection: Union[AsyncConnection, AsyncSession], batch_size: int) -> int:
+    """Fold up to batch_size deltas into billing_rollups inside the caller's transaction, returns how many."""
+    return (await connection.execute(text(FOLD_DELTAS), {"batch_size": batch_size})).scalar_one()
+
+
+async def find_mismatches(connection: AsyncConnection) -> List[Tuple]:
+    return (await connection.execute(text(MISMATCHES), {"tolerance": AMOUNT_TOLERANCE})).all()
+
+
+async def check() -> int:
+    async with get_db_manager().connect() as connection:
+        # One snapshot for both sides, so in flight writes can't show up as drift
+        await connection.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+        mismatches = await find_mismatches(connection)
+    for row in mismatches:
+        print(
+            f"{row.bucket_hour.isoformat()} {row.transaction_type}/{row.transaction_status}: "
+            f"rollup {row.rollup_amount:.2f} in {row.rollup_count}, raw {row.raw_amount:.2f} in {row.raw_count}"
+        )
+    if not mismatches:
+        print("Billing rollup matches the transactions table")
+    return 1 if mismatches else 0
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="only report buckets that differ from the transactions table")
+    args = parser.parse_args()
+
+    configure_logging()
+    try:
+        if args.check:
+            return await check()
+        async with get_db_manager().connect() as connection:
+            await install_trigger(connection)
+            buckets = await rebuild(connection)
+        logger.info(f"Rebuilt billing rollup with {buckets} buckets")
+        return 0
+    finally:
+        await get_db_manager().close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
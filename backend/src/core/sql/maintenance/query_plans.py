@@ -0,0 +1,116 @@
+"""
+Check that the billing and instance hot path queries can use their indexes.
+
+Each query is explained with sequential scans disabled, so the check passes on
+small development databases too: it fails only when no matching index exists or
+the planner can't use it for that query shape.
+
+    python -m src.core.sql.maintenance.query_plans
+"""
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, Iterator, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..database import get_db_manager
+from ...utils.datetime import DateTimeUtils
+from ...utils.logging import configure_logging
+
+# (expected index, query, parameters)
+PLAN_CHECKS: List[Tuple[str, str, Dict[str, Any]]] = [
+    (
+        "ix_transactions_reference_id",
+        "SELECT * FROM transactions WHERE reference_id = :reference_id",
+        {"reference_id": "subscription_1"},
+    ),
+    (
+        "ix_transactions_user_history",
+        "SELECT * FROM transactions WHERE user_id = :user_id",
+        {"user_id": uuid.uuid4()},
+    ),
+    (
+        "ix_transactions_type_status",
+        "SELECT * FROM transactions WHERE transaction_type = 'SUBSCRIPTION_PAYMENT' AND transaction_status = 'PENDING'",
+        {},
+    ),
+    (
+        "ix_transactions_subscription_id",
+        "SELECT * FROM transactions WHERE subscription_id = :subscription_id",
+        {"subscription_id": 1},
+    ),
+    (
+        "ix_transactions_user_history",
+        "SELECT transaction_id, transaction_type, transaction_status, amount, created_at, last_updated_at "
+        "FROM transactions WHERE user_id = :user_id ORDER BY created_at DESC, transaction_id DESC LIMIT 50",
+        {"user_id": uuid.uuid4()},
+    ),
+    (
+        "ix_transactions_created_at",
+        "SELECT * FROM transactions ORDER BY created_at DESC, transaction_id DESC LIMIT 50",
+        {},
+    ),
+    (
+        "ix_user_subscriptions_next_payment_date",
+        "SELECT * FROM user_subscriptions WHERE next_payment_date < :given_date",
+        {"given_date": DateTimeUtils.now_dt()},
+    ),
+    (
+        "ix_user_subscriptions_next_expire_date",
+        "SELECT * FROM user_subscriptions WHERE next_expire_date < :given_date",
+        {"given_date": DateTimeUtils.now_dt()},
+    ),
+    (
+        "ix_user_instances_user_id",
+        "SELECT * FROM user_instances WHERE user_id = :user_id",
+        {"user_id": uuid.uuid4()},
+    ),
+    (
+        "ix_user_instances_hostname",
+        "SELECT * FROM user_instances WHERE hostname = :hostname",
+        {"hostname": "instance"},
+    ),
+]
+
+
+def used_indexes(plan: Dict[str, Any]) -> Iterator[str]:
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from used_indexes(child)
+
+
+async def explain(connection: AsyncConnection, query: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    result = (await connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params)).scalar_one()
+    # asyncpg hands back the json column as text
+    plan = json.loads(result) if isinstance(result, str) else result
+    return plan[0]["Plan"]
+
+
+async def check_query_plans() -> List[Tuple[str, bool, List[str]]]:
+    """Explain every check query, returns (expected index, used, indexes in the plan)."""
+    results = []
+    async with get_db_manager().connect() as connection:
+        await connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for expected_index, query, params in PLAN_CHECKS:
+            indexes = list(used_indexes(await explain(connection, query, params)))
+            results.append((expected_index, expected_index in indexes, indexes))
+    return results
+
+
+async def main() -> int:
+    configure_logging()
+    try:
+        results = await check_query_plans()
+    finally:
+        await get_db_manager().close()
+
+    for expected_index, used, indexes in results:
+        print(f"{'OK  ' if used else 'FAIL'} {expected_index:<42} plan uses: {', '.join(indexes) or 'no index'}")
+    return 0 if all(used for _, used, _ in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,140 @@
+"""
+Convert string encoded UTC timestamps to native TIMESTAMP WITH TIME ZONE columns.
+
+Older deployments stored every UTCDateTime column as VARCHAR. The conversion
+is idempotent: only columns that are still character columns are altered, one
+table per transaction, so it can be re-run after a partial failure. Startup
+applies it through migration 2, this module runs it by hand.
+
+    python -m src.core.sql.maintenance.timestamptz --check
+    python -m src.core.sql.maintenance.timestamptz
+"""
+import argparse
+import asyncio
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..database import get_db_manager
+from ..tables.base import Base
+from ...utils.datetime import UTCDateTime, DateTimeUtils
+from ...utils.logging import logger, configure_logging
+
+# Matches DateTimeUtils.FORMAT, anything else can't be converted safely
+VALID_VALUE_PATTERN = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$"
+
+
+def timestamp_columns() -> Dict[str, List[str]]:
+    """UTCDateTime columns of every mapped table."""
+    columns = {}
+    for table in Base.metadata.sorted_tables:
+        names = [column.name for column in table.columns if isinstance(column.type, UTCDateTime)]
+        if names:
+            columns[table.name] = names
+    return columns
+
+
+async def pending_columns(connection: AsyncConnection) -> Dict[str, List[str]]:
+    """UTCDateTime columns that are still stored as strings in the database."""
+    result = await connection.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND data_type = 'character varying'"
+    ))
+    string_columns = {(row.table_name, row.column_name) for row in result}
+
+    pending = {}
+    for table_name, names in timestamp_columns().items():
+        names = [name for name in names if (table_name, name) in string_columns]
+        if names:
+            pending[table_name] = names
+    return pending
+
+
+async def count_invalid_values(connection: AsyncConnection, table_name: str, column_name: str) -> int:
+    result = await connection.execute(
+        text(f'SELECT count(*) FROM "{table_name}" WHERE "{column_name}" !~ :pattern'),
+        {"pattern": VALID_VALUE_PATTERN}
+    )
+    return result.scalar_one()
+
+
+def alter_statement(table_name: str, column_names: List[str]) -> str:
+    # One ALTER per table so the table is rewritten once, values are UTC wall clock strings
+    clauses = ", ".join(
+        f'ALTER COLUMN "{name}" TYPE TIMESTAMP WITH TIME ZONE USING ("{name}"::timestamp AT TIME ZONE \'UTC\')'
+        for name in column_names
+    )
+    return f'ALTER TABLE "{table_name}" {clauses}'
+
+
+async def convert_table(connection: AsyncConnection, table_name: str, column_names: List[str], lock_timeout: str = "5s"):
+    """Convert the given columns of one table inside the caller's transaction."""
+    for column_name in column_names:
+        invalid = await count_invalid_values(connection, table_name, column_name)
+        if invalid:
+            raise ValueError(f"{table_name}.{column_name} has {invalid} values not in the '{DateTimeUtils.FORMAT}' format")
+    # Don't queue behind long running transactions while holding the table lock
+    await connection.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+    await connection.execute(text(alter_statement(table_name, column_names)))
+
+
+async def convert_timestamp_columns(lock_timeout: str = "5s", dry_run: bool = False) -> Dict[str, List[str]]:
+    """Convert every pending column, returns the converted columns per table."""
+    db_manager = get_db_manager()
+    async with db_manager.connect() as connection:
+        pending = await pending_columns(connection)
+
+    if not pending:
+        logger.info("Timestamp columns are already TIMESTAMP WITH TIME ZONE")
+        return {}
+
+    for table_name, column_names in pending.items():
+        statement = alter_statement(table_name, column_names)
+        if dry_run:
+            logger.info(f"[dry run] {statement}")
+            continue
+
+        started = DateTimeUtils.now_dt()
+        async with db_manager.connect() as connection:
+            await convert_table(connection, table_name, column_names, lock_timeout)
+        elapsed = (DateTimeUtils.now_dt() - started).total_seconds()
+        logger.info(f"Converted {table_name}({', '.join(column_names)}) to TIMESTAMP WITH TIME ZONE in {elapsed:.2f}s")
+
+    return pending
+
+
+async def check() -> int:
+    """Report pending columns and values that would block the conversion."""
+    async with get_db_manager().connect() as connection:
+        pending = await pending_columns(connection)
+        invalid_total = 0
+        for table_name, column_names in pending.items():
+            for column_name in column_names:
+                invalid = await count_invalid_values(connection, table_name, column_name)
+                invalid_total += invalid
+                print(f"{table_name}.{column_name}: pending, {invalid} invalid values")
+    if not pending:
+        print("All timestamp columns are TIMESTAMP WITH TIME ZONE")
+    return 1 if invalid_total else 0
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="only report pending columns and invalid values")
+    parser.add_argument("--dry-run", action="store_true", help="log the ALTER statements without running them")
+    parser.add_argument("--lock-timeout", default="5s", help="give up if a table lock isn't granted in time")
+    args = parser.parse_args()
+
+    configure_logging()
+    try:
+        if args.check:
+            return await check()
+        await convert_timestamp_columns(lock_timeout=args.lock_timeout, dry_run=args.dry_run)
+        return 0
+    finally:
+        await get_db_manager().close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
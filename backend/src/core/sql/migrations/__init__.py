@@ -0,0 +1,7 @@
+from .runner import Migration, MigrationRunner, create_index_concurrently
+from .versions import MIGRATIONS
+from ..database import get_db_manager
+
+
+async def run_migrations():
+    return await MigrationRunner(get_db_manager(), MIGRATIONS).run()
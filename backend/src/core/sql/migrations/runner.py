@@ -0,0 +1,101 @@
+from typing import Awaitable, Callable, List, Set
+
+from sqlalchemy import Index, insert, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateIndex
+
+from ..database import DatabaseSessionManager
+from ..tables.schema_migration import SchemaMigration
+from ...utils.datetime import DateTimeUtils
+from ...utils.logging import logger
+
+# Serializes runners of several workers starting at the same time
+MIGRATION_LOCK_KEY = 7_352_001
+
+
+class Migration:
+    """
+    A versioned schema change.
+
+    Transactional migrations run and are recorded in one transaction. The others
+    get an autocommit connection (e.g. for CREATE INDEX CONCURRENTLY) and must be
+    safe to re-run, since a failure can leave part of them applied.
+    """
+    def __init__(
+        self,
+        version: int,
+        name: str,
+        upgrade: Callable[[AsyncConnection], Awaitable[None]],
+        transactional: bool = True
+    ):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        self.transactional = transactional
+
+
+class MigrationRunner:
+    def __init__(self, db_manager: DatabaseSessionManager, migrations: List[Migration]):
+        self.db_manager = db_manager
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+
+    async def run(self) -> List[Migration]:
+        """Apply every pending migration in version order, returns the applied ones."""
+        applied = []
+        async with self.db_manager.connect_autocommit() as lock_connection:
+            await lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                async with self.db_manager.connect() as connection:
+                    await connection.run_sync(SchemaMigration.__table__.create, checkfirst=True)
+                    done = await self._applied_versions(connection)
+
+                for migration in self.migrations:
+                    if migration.version in done:
+                        continue
+                    await self._apply(migration)
+                    applied.append(migration)
+            finally:
+                await lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+        if not applied:
+            logger.info("Database schema is up to date")
+        return applied
+
+    async def _applied_versions(self, connection: AsyncConnection) -> Set[int]:
+        return set((await connection.execute(select(SchemaMigration.version))).scalars().all())
+
+    async def _apply(self, migration: Migration):
+        started = DateTimeUtils.now_dt()
+        if migration.transactional:
+            async with self.db_manager.connect() as connection:
+                await migration.upgrade(connection)
+                await self._record(connection, migration)
+        else:
+            async with self.db_manager.connect_autocommit() as connection:
+                await migration.upgrade(connection)
+            async with self.db_manager.connect() as connection:
+                await self._record(connection, migration)
+        elapsed = (DateTimeUtils.now_dt() - started).total_seconds()
+        logger.info(f"Applied migration {migration.version:04d}_{migration.name} in {elapsed:.2f}s")
+
+    async def _record(self, connection: AsyncConnection, migration: Migration):
+        await connection.execute(insert(SchemaMigration).values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=DateTimeUtils.now_dt()
+        ))
+
+
+async def create_index_concurrently(connection: AsyncConnection, index: Index):
+    """Build a declared index without blocking writes, on an autocommit connection."""
+    # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would skip
+    invalid = (await connection.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": index.name})).first()
+    if invalid:
+        await connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+    statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+    await connection.execute(text(statement.replace("INDEX", "INDEX CONCURRENTLY", 1)))
@@ -0,0 +1,140 @@
+"""
+Schema migrations, applied in version order by MigrationRunner.
+
+Migration 1 creates missing tables from the current models, so later migrations
+must tolerate their change being there already (IF NOT EXISTS and the like).
+"""
+from sqlalchemy import Index, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .runner import Migration, create_index_concurrently
+from ..maintenance.timestamptz import convert_table, pending_columns
+from ..maintenance import billing_rollup
+from ..operations.billing import refresh_user_billing_summary
+from ..tables.user import User
+from ..tables.base import Base
+
+
+async def initial_schema(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.create_all)
+
+
+async def timestamptz_columns(connection: AsyncConnection):
+    for table_name, column_names in (await pending_columns(connection)).items():
+        await convert_table(connection, table_name, column_names)
+
+
+def declared_index(table_name: str, index_name: str) -> Index:
+    return next(index for index in Base.metadata.tables[table_name].indexes if index.name == index_name)
+
+
+async def hot_path_indexes(connection: AsyncConnection):
+    for table_name, index_name in (
+        ("transactions", "ix_transactions_reference_id"),
+        ("transactions", "ix_transactions_type_status"),
+        ("user_subscriptions", "ix_user_subscriptions_next_payment_date"),
+        ("user_subscriptions", "ix_user_subscriptions_next_expire_date"),
+        ("user_instances", "ix_user_instances_user_id"),
+        ("user_instances", "ix_user_instances_hostname"),
+    ):
+        await create_index_concurrently(connection, declared_index(table_name, index_name))
+
+
+async def transaction_subscription_id(connection: AsyncConnection):
+    await connection.execute(text(
+        "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS subscription_id INTEGER "
+        "REFERENCES user_subscriptions (subscription_id) ON DELETE SET NULL"
+    ))
+    await create_index_concurrently(connection, declared_index("transactions", "ix_transactions_subscription_id"))
+
+    # Backfill from reference_id in small autocommitted batches to keep row locks short,
+    # rows of already deleted subscriptions have nothing to link to and stay NULL
+    backfill = text(
+        "UPDATE transactions t SET subscription_id = s.subscription_id "
+        "FROM user_subscriptions s "
+        "WHERE t.reference_id = 'subscription_' || s.subscription_id "
+        "AND t.transaction_id IN ("
+        "    SELECT t2.transaction_id FROM transactions t2 "
+        "    JOIN user_subscriptions s2 ON t2.reference_id = 'subscription_' || s2.subscription_id "
+        "    WHERE t2.subscription_id IS NULL LIMIT :batch_size"
+        ")"
+    )
+    while (await connection.execute(backfill, {"batch_size": 5000})).rowcount:
+        pass
+
+
+async def transaction_history_index(connection: AsyncConnection):
+    await create_index_concurrently(connection, declared_index("transactions", "ix_transactions_user_history"))
+    # Leads with user_id, so the plain user_id index built by migration 3 only slows writes down
+    await connection.execute(text('DROP INDEX CONCURRENTLY IF EXISTS "ix_transactions_user_id"'))
+
+
+async def transaction_created_at_index(connection: AsyncConnection):
+    await create_index_concurrently(connection, declared_index("transactions", "ix_transactions_created_at"))
+
+
+async def billing_rollups(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.tables["billing_rollups"].create, checkfirst=True)
+    await connection.run_sync(Base.metadata.tables["billing_rollup_deltas"].create, checkfirst=True)
+    await billing_rollup.install_trigger(connection)
+    await billing_rollup.rebuild(connection)
+
+
+async def user_billing_summary(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.tables["user_billing_summary"].create, checkfirst=True)
+    await refresh_user_billing_summary(connection, select(User.user_id))
+
+
+async def dedupe_os_types(connection: AsyncConnection):
+    # Rows seeded twice before the unique index existed, instances move to the lowest id of their image
+    duplicates = (
+        "SELECT os_type_id, min(os_type_id) OVER (PARTITION BY os_image_name, os_image_version) AS keep_id "
+        "FROM os_types"
+    )
+    await connection.execute(text(
+        f"UPDATE user_instances i SET os_type_id = d.keep_id FROM ({duplicates}) d "
+        "WHERE i.os_type_id = d.os_type_id AND d.os_type_id <> d.keep_id"
+    ))
+    await connection.execute(text(
+        f"DELETE FROM os_types o USING ({duplicates}) d "
+        "WHERE o.os_type_id = d.os_type_id AND d.os_type_id <> d.keep_id "
+        "AND NOT EXISTS (SELECT 1 FROM user_instances i WHERE i.os_type_id = o.os_type_id)"
+    ))
+
+    # Only an instance created on a duplicate in between is left, the index build would fail on it
+    left = (await connection.execute(text(
+        "SELECT os_image_name, os_image_version, count(*) FROM os_types "
+        "GROUP BY os_image_name, os_image_version HAVING count(*) > 1"
+    ))).all()
+    if left:
+        images = ", ".join(f"{name} {version} ({count} rows)" for name, version, count in left)
+        raise ValueError(f"os_types has duplicate images left after deduplicating, run the migration again: {images}")
+
+
+async def seed_markers(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.tables["seed_markers"].create, checkfirst=True)
+    await dedupe_os_types(connection)
+    await create_index_concurrently(connection, declared_index("os_types", "uq_os_types_image"))
+
+
+async def billing_checkpoints(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.tables["billing_checkpoints"].create, checkfirst=True)
+
+
+async def instance_teardowns(connection: AsyncConnection):
+    await connection.run_sync(Base.metadata.tables["instance_teardowns"].create, checkfirst=True)
+
+
+MIGRATIONS = [
+    Migration(1, "initial_schema", initial_schema),
+    Migration(2, "timestamptz_columns", timestamptz_columns),
+    Migration(3, "hot_path_indexes", hot_path_indexes, transactional=False),
+    Migration(4, "transaction_subscription_id", transaction_subscription_id, transactional=False),
+    Migration(5, "transaction_history_index", transaction_history_index, transactional=False),
+    Migration(6, "transaction_created_at_index", transaction_created_at_index, transactional=False),
+    Migration(7, "billing_rollups", billing_rollups),
+    Migration(8, "user_billing_summary", user_billing_summary),
+    Migration(9, "seed_markers", seed_markers, transactional=False),
+    Migration(10, "billing_checkpoints", billing_checkpoints),
+    Migration(11, "instance_teardowns", instance_teardowns),
+]
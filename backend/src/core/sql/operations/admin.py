@@ -12,7 +12,7 @@ from ...models.admin import AdminUsersWithDetails
 
 class AdminOperation(BaseOperation):
     async def get_all_users_with_details(self) -> List[AdminUsersWithDetails]:
-        async with self.session() as db:
+        async with self.session(read_only=True) as db:
             stmt = select(User).options(
                 selectinload(User.user_instances).selectinload(UserInstance.instance_plan),
                 selectinload(User.user_instances).selectinload(UserInstance.os_type),
@@ -1,11 +1,14 @@
 from contextlib import asynccontextmanager
 from typing import Callable, Dict, List, Optional, Sequence, Type, TypeVar, Union, AsyncContextManager, AsyncGenerator, Any
-from functools import wraps
+from functools import lru_cache, wraps
 import inspect
 from sqlalchemy.inspection import inspect as sqlalchemy_inspect
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ...config import DatabaseConfig
+from ..instrumentation import instrument_operation
+
 PydanticT = TypeVar("PydanticT", bound=BaseModel)
 
 class OperationException(Exception):
@@ -31,7 +34,7 @@ def operation_exception_handler(func):
 
 
 class BaseOperationMeta(type):
-    """Metaclass to automatically apply exception handling to all async methods"""
+    """Metaclass to automatically apply exception handling and instrumentation to all async methods"""
     def __new__(mcs: Type[type], name: str, bases: tuple[type, ...], namespace: Dict[str, Any]) -> type:
         # Create the class
         cls = super().__new__(mcs, name, bases, namespace)
@@ -45,7 +48,10 @@ class BaseOperationMeta(type):
                     not attr_name.startswith('__') and 
                     attr_name != 'session'):
                     # Replace the method with the wrapped version
-                    setattr(cls, attr_name, operation_exception_handler(attr_value))
+                    method = operation_exception_handler(attr_value)
+                    if DatabaseConfig.OPERATION_METRICS:
+                        method = instrument_operation(f"{name}.{attr_name}", method)
+                    setattr(cls, attr_name, method)
         
         return cls
 
@@ -61,11 +67,15 @@ class BaseOperation(metaclass=BaseOperationMeta):
         self.db_session = db_session
     
     @asynccontextmanager
-    async def session(self) -> AsyncGenerator[AsyncSession, None]:
-        """Get a database session with automatic commit/rollback"""
-        async with self.db_session() as session:
+    async def session(self, read_only: bool = False, detached: bool = False) -> AsyncGenerator[AsyncSession, None]:
+        """Get a database session with automatic commit/rollback, read only ones may be served by a replica"""
+        async with self.db_session(read_only=read_only, detached=detached) as session:
             yield session
     
+    def transaction(self, db: AsyncSession) -> AsyncContextManager[Any]:
+        """Begin a transaction, or a savepoint when the session is already in one (unit of work)"""
+        return db.begin_nested() if db.in_transaction() else db.begin()
+
     def to_pydantic(self, pydantic_model: Type[PydanticT], orm_objects: Union[Sequence, object, None]) -> Union[List[PydanticT], Optional[PydanticT]]:
         if orm_objects is None:
             return None
@@ -77,20 +87,32 @@ class BaseOperation(metaclass=BaseOperationMeta):
 
     def _convert_to_pydantic(self, pydantic_model: Type[PydanticT], orm_object: object) -> PydanticT:
         if hasattr(orm_object, '__table__'):  # It's a SQLAlchemy model
-            # Create a dict from the model's attributes
-            data = {}
-            for c in orm_object.__table__.columns:
-                data[c.name] = getattr(orm_object, c.name)
-            
-            # Only include loaded relationship data, don't trigger lazy loading
-            mapper = orm_object.__mapper__
-            for relationship_name, relationship_property in mapper.relationships.items():
-                # Check if the relationship is already loaded
-                if relationship_name in orm_object.__dict__:  # This won't trigger loading
-                    related_obj = orm_object.__dict__[relationship_name]
-                    if related_obj is not None:
-                        data[relationship_name] = related_obj
-                        
-            return pydantic_model.model_validate(data)
+            return compile_converter(type(orm_object), pydantic_model)(orm_object)
         else:
-            return pydantic_model.model_validate(orm_object)
\ No newline at end of file
+            return pydantic_model.model_validate(orm_object)
+
+
+@lru_cache(maxsize=None)
+def compile_converter(orm_class: type, pydantic_model: Type[PydanticT]) -> Callable[[Any], PydanticT]:
+    """
+    Build the ORM object to pydantic model conversion for a class pair once.
+    
+    Loaded attributes, columns and relationships alike, live in the instance __dict__,
+    so a fully loaded object is validated straight from it without going through the
+    instrumented attributes. Relationships that weren't loaded aren't in it and are
+    never lazy loaded. Objects with expired columns read them attribute by attribute.
+    """
+    fields = pydantic_model.model_fields
+    columns = frozenset(attr.key for attr in orm_class.__mapper__.column_attrs if attr.key in fields)
+    relationships = [name for name in orm_class.__mapper__.relationships.keys() if name in fields]
+    
+    def convert(orm_object: Any) -> PydanticT:
+        loaded = orm_object.__dict__
+        if columns <= loaded.keys():
+            return pydantic_model.model_validate(loaded)
+        
+        data = {name: getattr(orm_object, name) for name in columns}
+        data.update({name: loaded[name] for name in relationships if loaded.get(name) is not None})
+        return pydantic_model.model_validate(data)
+    
+    return convert
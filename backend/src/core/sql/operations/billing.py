@@ -1,139 +1,284 @@
-from datetime import datetime
-from typing import List, Optional
-from sqlalchemy import func, select, insert, delete
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Sequence, Union
+from sqlalchemy import ColumnElement, Insert, Select, and_, case, cast, func, select, insert, delete, true, tuple_, union_all, update
 from sqlalchemy.orm import selectinload
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 import uuid
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
 
 from ...constants.transaction_const import TransactionStatus, TransactionType, TRANSACTION_TYPE_TO_STATUS
 from ...utils.datetime import DateTimeUtils
+from ...config import BillingConfig
 from .base import BaseOperation
 from ..tables.user_instance import UserInstance
 from ..tables.user import User
 from ..tables.user_wallet import UserWallet
 from ..tables.user_subscription import UserSubscription
 from ..tables.transaction import Transaction
+from ..tables.billing_rollup import BillingRollup
+from ..tables.billing_rollup_delta import BillingRollupDelta
+from ..maintenance import billing_rollup
+from ..tables.user_billing_summary import UserBillingSummary
 from ...models.billing import AllTimePayment, UpcomingPayment, UserBillingOverview
 from ...models.admin import AdminBillingStatsByStatus, AdminBillingStatsByType
 from ...utils.logging import logger
 
 
+# Subscription payments still owed, counted in the upcoming amount
+UPCOMING_STATUSES = [TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
+
+
+def user_billing_summary_select(user_ids: Union[Sequence[uuid.UUID], Select]) -> Select:
+    """The billing summary columns computed from subscriptions and transactions for the given users."""
+    subscriptions = select(
+        func.count(UserSubscription.subscription_id).label("total_subscription"),
+        func.min(UserSubscription.next_payment_date).label("earliest_due_date")
+    ).join(
+        UserInstance, UserSubscription.instance_id == UserInstance.instance_id
+    ).where(UserInstance.user_id == User.user_id).lateral()
+    
+    upcoming = select(
+        func.coalesce(func.sum(Transaction.amount), 0.0).label("upcoming_amount")
+    ).where(
+        Transaction.user_id == User.user_id,
+        Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
+        Transaction.transaction_status.in_(UPCOMING_STATUSES)
+    ).lateral()
+    
+    # Each paid subscription payment is one billing cycle
+    paid = select(
+        func.coalesce(func.sum(Transaction.amount), 0.0).label("all_time_amount"),
+        func.count(Transaction.transaction_id).label("all_time_cycles"),
+        func.max(Transaction.created_at).label("last_payment_date")
+    ).where(
+        Transaction.user_id == User.user_id,
+        Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
+        Transaction.transaction_status == TransactionStatus.PAID
+    ).lateral()
+    
+    return select(
+        User.user_id,
+        subscriptions.c.total_subscription,
+        upcoming.c.upcoming_amount,
+        subscriptions.c.earliest_due_date,
+        paid.c.all_time_amount,
+        paid.c.all_time_cycles,
+        paid.c.last_payment_date,
+        func.now().label("last_updated_at")
+    ).select_from(User).join(
+        subscriptions, true()
+    ).join(
+        upcoming, true()
+    ).join(
+        paid, true()
+    ).where(User.user_id.in_(user_ids))
+
+
+def billing_summary_delta(
+    user_id: ColumnElement,
+    total_subscription: Any = 0,
+    upcoming_amount: Any = 0.0,
+    all_time_amount: Any = 0.0,
+    all_time_cycles: Any = 0,
+    last_payment_date: Any = None
+) -> Select:
+    """A select of what a change adds to its user's billing summary, in the columns apply_billing_summary_deltas sums."""
+    return select(
+        user_id.label("user_id"),
+        cast(total_subscription, UserBillingSummary.total_subscription.type).label("total_subscription"),
+        cast(upcoming_amount, UserBillingSummary.upcoming_amount.type).label("upcoming_amount"),
+        cast(all_time_amount, UserBillingSummary.all_time_amount.type).label("all_time_amount"),
+        cast(all_time_cycles, UserBillingSummary.all_time_cycles.type).label("all_time_cycles"),
+        cast(last_payment_date, UserBillingSummary.last_payment_date.type).label("last_payment_date")
+    )
+
+
+def transaction_summary_delta(rows, sign: int = 1) -> Select:
+    """What the transactions in rows add to their users' billing summaries, with sign=-1 what they take away."""
+    is_payment = rows.c.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT
+    upcoming = and_(is_payment, rows.c.transaction_status.in_(UPCOMING_STATUSES))
+    paid = and_(is_payment, rows.c.transaction_status == TransactionStatus.PAID)
+    return billing_summary_delta(
+        rows.c.user_id,
+        upcoming_amount=case((upcoming, rows.c.amount * sign), else_=0.0),
+        all_time_amount=case((paid, rows.c.amount * sign), else_=0.0),
+        all_time_cycles=case((paid, sign), else_=0),
+        # Only ever moves forward, a paid payment taken back is left to the repair job
+        last_payment_date=case((paid, rows.c.created_at)) if sign > 0 else None
+    ).select_from(rows)
+
+
+def apply_billing_summary_deltas(*deltas: Select) -> Insert:
+    """
+    Upsert adding the deltas to their users' billing summaries.
+
+    Meant as a CTE of the statement that changes the rows the deltas come from,
+    so the summary changes with them. Deltas add up in any order, the summary
+    row lock is all that orders concurrent writers of a user.
+    """
+    rows = (union_all(*deltas) if len(deltas) > 1 else deltas[0]).subquery("deltas")
+    summed = select(
+        rows.c.user_id,
+        func.sum(rows.c.total_subscription).label("total_subscription"),
+        func.sum(rows.c.upcoming_amount).label("upcoming_amount"),
+        func.sum(rows.c.all_time_amount).label("all_time_amount"),
+        func.sum(rows.c.all_time_cycles).label("all_time_cycles"),
+        func.max(rows.c.last_payment_date).label("last_payment_date"),
+        func.now().label("last_updated_at")
+    ).group_by(
+        rows.c.user_id
+    ).order_by(
+        # One lock order for every writer
+        rows.c.user_id
+    )
+    columns = [column.name for column in summed.selected_columns]
+    stmt = pg_insert(UserBillingSummary).from_select(columns, summed)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={
+            'total_subscription': UserBillingSummary.total_subscription + stmt.excluded.total_subscription,
+            'upcoming_amount': UserBillingSummary.upcoming_amount + stmt.excluded.upcoming_amount,
+            'all_time_amount': UserBillingSummary.all_time_amount + stmt.excluded.all_time_amount,
+            'all_time_cycles': UserBillingSummary.all_time_cycles + stmt.excluded.all_time_cycles,
+            'last_payment_date': func.greatest(UserBillingSummary.last_payment_date, stmt.excluded.last_payment_date),
+            'last_updated_at': stmt.excluded.last_updated_at
+        }
+    )
+
+
+async def refresh_earliest_due_dates(
+    db: Union[AsyncSession, AsyncConnection],
+    user_ids: Union[Sequence[uuid.UUID], Select]
+) -> None:
+    """
+    Recompute the earliest payment date of the given users' summaries after their subscriptions changed.
+
+    A minimum can't follow a delta when its subscription goes or moves later. Run
+    it after the statement that applied the deltas, which holds the summary rows,
+    so this statement's snapshot has every other writer's subscriptions.
+    """
+    earliest = select(
+        func.min(UserSubscription.next_payment_date)
+    ).join(
+        UserInstance, UserSubscription.instance_id == UserInstance.instance_id
+    ).where(UserInstance.user_id == UserBillingSummary.user_id).scalar_subquery()
+    await db.execute(
+        update(UserBillingSummary).where(UserBillingSummary.user_id.in_(user_ids)).values(earliest_due_date=earliest)
+    )
+
+
+async def refresh_user_billing_summary(
+    db: Union[AsyncSession, AsyncConnection],
+    user_ids: Union[Sequence[uuid.UUID], Select],
+    only_changed: bool = False
+) -> int:
+    """
+    Recompute the billing summary of the given users from scratch inside the caller's transaction.
+    
+    Writes apply deltas instead, this is for filling and repairing the table.
+    Returns the number of summary rows written, with only_changed rows that
+    already match are left alone.
+    """
+    # Wait for writers that applied deltas to these rows to commit, the aggregate
+    # below is read after them and later ones add their deltas on top
+    await db.execute(
+        select(UserBillingSummary.user_id).where(UserBillingSummary.user_id.in_(user_ids)).order_by(UserBillingSummary.user_id).with_for_update()
+    )
+    
+    computed = user_billing_summary_select(user_ids)
+    columns = [column.name for column in computed.selected_columns]
+    stmt = pg_insert(UserBillingSummary).from_select(columns, computed)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={name: stmt.excluded[name] for name in columns if name != 'user_id'},
+        where=tuple_(
+            *(getattr(UserBillingSummary, name) for name in columns if name not in ('user_id', 'last_updated_at'))
+        ).is_distinct_from(tuple_(
+            *(stmt.excluded[name] for name in columns if name not in ('user_id', 'last_updated_at'))
+        )) if only_changed else None
+    )
+    return (await db.execute(stmt)).rowcount
+
+
 class BillingOperation(BaseOperation):
     async def get_user_billing_overview(
         self,
         username: str,
     ) -> UserBillingOverview:
         """
-        Get the billing overview for a specific user.
+        Get the billing overview for a specific user from the billing summary.
         
-        This method fetches:
-        1. Upcoming payment information (sum of pending payments, total subscriptions, earliest due date)
-        2. All-time payment information (sum of payments, total payment cycles, last payment date)
-        
-        Returns a UserBillingOverview model.
+        Returns None if the user doesn't exist, users without billing activity yet have no
+        summary row and get an empty overview.
         """
         async with self.session() as db:
-            # Get user_id from username
-            user_stmt = select(User.user_id).where(User.username == username)
-            user_id = (await db.execute(user_stmt)).scalar_one_or_none()
+            stmt = select(User.user_id, UserBillingSummary).outerjoin(
+                UserBillingSummary, User.user_id == UserBillingSummary.user_id
+            ).where(User.username == username)
+            result = (await db.execute(stmt)).one_or_none()
             
-            if not user_id:
+            if not result:
                 return None
             
-            # Create upcoming payment information
-            upcoming_payment = await self._get_upcoming_payment_info(db, user_id)
-            
-            # Create all-time payment information
-            all_time_payment = await self._get_all_time_payment_info(db, user_id)
+            summary = result.UserBillingSummary
+            if summary is None:
+                return UserBillingOverview(
+                    upcoming_payment=UpcomingPayment(sum_amount=0.0, total_subscription=0, earliest_due_date=""),
+                    all_time_payment=AllTimePayment(sum_amount=0.0, total_cycle=0, last_payment_date="")
+                )
             
-            # Construct and return the UserBillingOverview
+            # Format the dates if they exist
             return UserBillingOverview(
-                upcoming_payment=upcoming_payment,
-                all_time_payment=all_time_payment
+                upcoming_payment=UpcomingPayment(
+                    sum_amount=summary.upcoming_amount,
+                    total_subscription=summary.total_subscription,
+                    earliest_due_date=DateTimeUtils.to_bkk_string(summary.earliest_due_date) if summary.earliest_due_date else ""
+                ),
+                all_time_payment=AllTimePayment(
+                    sum_amount=summary.all_time_amount,
+                    total_cycle=summary.all_time_cycles,
+                    last_payment_date=DateTimeUtils.to_bkk_string(summary.last_payment_date) if summary.last_payment_date else ""
+                )
             )
-
-    async def _get_upcoming_payment_info(self, db: AsyncSession, user_id: uuid.UUID) -> UpcomingPayment:
-        """
-        Get upcoming payment information for a user.
-        Uses efficient SQL aggregation to avoid loading all transactions into memory.
-        """
-        # Count total active subscriptions
-        subscription_count_stmt = select(
-            func.count(UserSubscription.subscription_id)
-        ).join(
-            UserInstance, UserSubscription.instance_id == UserInstance.instance_id
-        ).where(
-            UserInstance.user_id == user_id
-        )
-        total_subscription = (await db.execute(subscription_count_stmt)).scalar() or 0
-        
-        # Get sum of scheduled/pending payments
-        upcoming_payment_stmt = select(
-            # Sum of all pending amounts
-            func.sum(Transaction.amount).label("sum_amount"),
-        ).where(
-            Transaction.user_id == user_id,
-            Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
-            Transaction.transaction_status.in_([TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE])
-        )
-        
-        sum_amount = (await db.execute(upcoming_payment_stmt)).scalar_one_or_none() or 0.0
-        
-        # Get earliest payment date from user subscriptions
-        earliest_payment_date_stmt = select(
-            func.min(UserSubscription.next_payment_date).label("earliest_due_date")
-        ).join(
-            UserInstance, UserSubscription.instance_id == UserInstance.instance_id
-        ).where(
-            UserInstance.user_id == user_id
-        )
-        
-        earliest_payment_date = (await db.execute(earliest_payment_date_stmt)).scalar_one_or_none()
-        
-        # Format the date if it exists
-        earliest_due_date_str = DateTimeUtils.to_bkk_string(earliest_payment_date) if earliest_payment_date else ""
-        
-        return UpcomingPayment(
-            sum_amount=sum_amount,
-            total_subscription=total_subscription,
-            earliest_due_date=earliest_due_date_str
-        )
-
-    async def _get_all_time_payment_info(self, db: AsyncSession, user_id: uuid.UUID) -> AllTimePayment:
-        """
-        Get all-time payment information for a user.
-        Uses SQL aggregation for better performance.
-        """
-        # Get all-time payment stats using aggregation
-        all_time_stmt = select(
-            # Sum of all successful payments
-            func.sum(Transaction.amount).label("sum_amount"),
-            # Count of payment cycles (each successful payment counts as one cycle)
-            func.count(Transaction.transaction_id).label("total_cycle"),
-            # Latest payment date
-            func.max(Transaction.created_at).label("last_payment_date")
-        ).where(
-            Transaction.user_id == user_id,
-            Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
-            Transaction.transaction_status == TransactionStatus.PAID
-        )
-        
-        all_time_result = (await db.execute(all_time_stmt)).one_or_none()
-        
-        # Handle case where there are no historical payments
-        sum_amount = all_time_result[0] or 0.0
-        total_cycle = all_time_result[1] or 0
-        last_payment_date = all_time_result[2] or None
-        
-        # Format the date if it exists
-        last_payment_date_str = DateTimeUtils.to_bkk_string(last_payment_date) if last_payment_date else ""
-        
-        return AllTimePayment(
-            sum_amount=sum_amount,
-            total_cycle=total_cycle,
-            last_payment_date=last_payment_date_str
-        )
+    
+    async def repair_user_billing_summaries(self, batch_size: int = 500) -> int:
+        """Recompute every user's billing summary in batches, returns how many had drifted."""
+        repaired = 0
+        after = None
+        while True:
+            # A transaction per batch keeps the summary row locks short
+            async with self.session() as db, self.transaction(db):
+                batch_stmt = select(User.user_id).order_by(User.user_id).limit(batch_size)
+                if after is not None:
+                    batch_stmt = batch_stmt.where(User.user_id > after)
+                user_ids = (await db.execute(batch_stmt)).scalars().all()
+                if not user_ids:
+                    return repaired
+                repaired += await refresh_user_billing_summary(db, user_ids, only_changed=True)
+            after = user_ids[-1]
+    
+    async def fold_billing_rollup_deltas(self, batch_size: int = 5000) -> int:
+        """Fold the deltas appended by the rollup trigger into the hourly buckets, returns how many."""
+        folded = 0
+        while True:
+            # A transaction per batch keeps the bucket row locks short
+            async with self.session() as db, self.transaction(db):
+                count = await billing_rollup.fold_deltas(db, batch_size)
+            folded += count
+            if count < batch_size:
+                return folded
+    
+    async def _fold_billing_rollup_backlog(self) -> int:
+        """Fold the deltas when more than the threshold are pending, returns how many."""
+        # Stops at the threshold instead of counting the whole table
+        async with self.session() as db:
+            backlog = (await db.execute(
+                select(BillingRollupDelta.delta_id)
+                .order_by(BillingRollupDelta.delta_id)
+                .offset(BillingConfig.ROLLUP_FOLD_ON_READ_THRESHOLD)
+                .limit(1)
+            )).first()
+        return await self.fold_billing_rollup_deltas() if backlog else 0
     
     async def get_billing_stats_by_date_range(
         self,
@@ -152,28 +297,27 @@ class BillingOperation(BaseOperation):
         Returns:
             List of AdminBillingStatsByType containing statistics for each transaction type
         """
-        async with self.session() as db:
+        # Every read adds the deltas not folded yet, keep them few when no worker folds them
+        await self._fold_billing_rollup_backlog()
+        
+        async with self.session(read_only=True) as db:
             # Get all transaction types to ensure we return all types even if no transactions exist
             all_types = list(TransactionType)
             
-            # Build the base query
-            stats_stmt = select(
-                Transaction.transaction_type,
-                Transaction.transaction_status,
-                func.sum(Transaction.amount).label("total_amount")
-            )
-            
-            # Apply date filtering only if is_alltime is False
+            # Sum pre-aggregated hourly buckets, only partial hours at the edges read raw transactions
             if not is_alltime and start_date and end_date:
-                stats_stmt = stats_stmt.where(
-                    Transaction.created_at >= start_date,
-                    Transaction.created_at <= end_date
-                )
+                sources = self._billing_stats_sources(start_date, end_date)
+            else:
+                sources = self._rollup_amounts()
+            amounts = union_all(*sources).subquery() if len(sources) > 1 else sources[0].subquery()
             
-            # Group by type and status
-            stats_stmt = stats_stmt.group_by(
-                Transaction.transaction_type,
-                Transaction.transaction_status
+            stats_stmt = select(
+                amounts.c.transaction_type,
+                amounts.c.transaction_status,
+                func.sum(amounts.c.amount).label("total_amount")
+            ).group_by(
+                amounts.c.transaction_type,
+                amounts.c.transaction_status
             )
             
             result = await db.execute(stats_stmt)
@@ -216,4 +360,44 @@ class BillingOperation(BaseOperation):
                 for transaction_type in all_types
             ]
             
-            return result
\ No newline at end of file
+            return result
+
+    def _billing_stats_sources(self, start_date: datetime, end_date: datetime) -> List[Select]:
+        """Selects of (type, status, amount) covering created_at in [start_date, end_date]."""
+        start_date, end_date = start_date.astimezone(DateTimeUtils.UTC_TZ), end_date.astimezone(DateTimeUtils.UTC_TZ)
+        # Whole hours inside the range come from the rollup
+        first_full_hour = start_date.replace(minute=0, second=0, microsecond=0)
+        if first_full_hour < start_date:
+            first_full_hour += timedelta(hours=1)
+        full_hours_end = end_date.replace(minute=0, second=0, microsecond=0)
+        
+        if first_full_hour >= full_hours_end:
+            return [self._raw_amounts(Transaction.created_at >= start_date, Transaction.created_at <= end_date)]
+        return [
+            *self._rollup_amounts(first_full_hour, full_hours_end),
+            self._raw_amounts(Transaction.created_at >= start_date, Transaction.created_at < first_full_hour),
+            self._raw_amounts(Transaction.created_at >= full_hours_end, Transaction.created_at <= end_date),
+        ]
+
+    def _rollup_amounts(self, first_hour: Optional[datetime] = None, end_hour: Optional[datetime] = None) -> List[Select]:
+        """Selects of the rollup buckets in [first_hour, end_hour) and the deltas not folded into them yet."""
+        sources = []
+        for table in (BillingRollup, BillingRollupDelta):
+            conditions = []
+            if first_hour is not None:
+                conditions.append(table.bucket_hour >= first_hour)
+            if end_hour is not None:
+                conditions.append(table.bucket_hour < end_hour)
+            sources.append(select(
+                table.transaction_type,
+                table.transaction_status,
+                table.total_amount.label("amount")
+            ).where(*conditions))
+        return sources
+
+    def _raw_amounts(self, *conditions) -> Select:
+        return select(
+            Transaction.transaction_type,
+            Transaction.transaction_status,
+            Transaction.amount.label("amount")
+        ).where(*conditions)
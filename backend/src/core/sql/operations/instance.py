@@ -1,6 +1,7 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Sequence
 import uuid
-from sqlalchemy import delete, insert, select
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.orm import selectinload
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
@@ -12,9 +13,11 @@ from ...models.instance import (
     OsType as OsTypeModel,
     UserInstance as UserInstanceModel,
     UserInstanceFromDB,
-    InstancePlanWithUserInstance
+    InstancePlanWithUserInstance,
+    InstanceTeardown as InstanceTeardownModel
 )
 from ..tables.user_instance import UserInstance
+from ..tables.instance_teardown import InstanceTeardown
 from ..tables.user import User
 
 
@@ -133,6 +136,34 @@ class InstanceOperation(BaseOperation):
             stmt = delete(UserInstance).where(UserInstance.instance_id == instance_id)
             await db.execute(stmt)
 
+    async def get_due_instance_teardowns(
+        self,
+        due_before: datetime,
+        limit: int,
+        instance_ids: Optional[Sequence[uuid.UUID]] = None
+    ) -> List[InstanceTeardownModel]:
+        async with self.session() as db:
+            stmt = select(InstanceTeardown).where(
+                InstanceTeardown.next_attempt_at <= due_before
+            ).order_by(InstanceTeardown.next_attempt_at).limit(limit)
+            if instance_ids is not None:
+                stmt = stmt.where(InstanceTeardown.instance_id.in_(instance_ids))
+            result = (await db.execute(stmt)).scalars().all()
+            return self.to_pydantic(InstanceTeardownModel, result)
+    
+    async def get_next_instance_teardown_at(self) -> Optional[datetime]:
+        async with self.session() as db:
+            return (await db.execute(select(func.min(InstanceTeardown.next_attempt_at)))).scalar()
+    
+    async def fail_instance_teardown(self, instance_id: uuid.UUID, error: str, next_attempt_at: Optional[datetime]) -> None:
+        async with self.session() as db:
+            stmt = update(InstanceTeardown).where(InstanceTeardown.instance_id == instance_id).values(
+                attempts=InstanceTeardown.attempts + 1,
+                next_attempt_at=next_attempt_at,
+                last_error=error
+            )
+            await db.execute(stmt)
+    
     async def get_user_instance(
         self, 
         instance_id: Optional[uuid.UUID] = None, 
@@ -1,22 +1,26 @@
 from datetime import datetime
-from typing import List, Optional
-from sqlalchemy import select, insert, delete
-from sqlalchemy.orm import selectinload
+from typing import Optional
+from sqlalchemy import Boolean, Select, case, func, literal_column, select, insert, delete
+from sqlalchemy.orm import aliased, selectinload
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 import uuid
 
 from .base import BaseOperation
+from .billing import apply_billing_summary_deltas, billing_summary_delta, refresh_earliest_due_dates
 from ..tables.user_instance import UserInstance
 from ..tables.user_wallet import UserWallet
 from ..tables.user_subscription import UserSubscription
+from ..tables.billing_checkpoint import BillingCheckpoint
+from ..tables.user_billing_summary import UserBillingSummary
 from ...models.user import UserInDB as UserModel, UserWallet as UserWalletModel
-from ...models.subscription import UserSubscription as UserSubscriptionModel
+from ...models.subscription import UserSubscription as UserSubscriptionModel, BillingCheckpoint as BillingCheckpointModel
+from ...config import BillingConfig
 
 
 class SubscriptionOperation(BaseOperation):
     async def upsert_subscription(self, instance_id: uuid.UUID, next_payment_date: datetime, next_expire_date: datetime) -> UserSubscriptionModel:
         async with self.session() as db:
-            stmt = pg_insert(UserSubscription).values(
+            upserted = pg_insert(UserSubscription).values(
                 instance_id=instance_id,
                 next_payment_date=next_payment_date,
                 next_expire_date=next_expire_date
@@ -26,8 +30,24 @@ class SubscriptionOperation(BaseOperation):
                     'next_payment_date': next_payment_date,
                     'next_expire_date': next_expire_date
                 }
-            ).returning(UserSubscription)
-            result = (await db.execute(stmt)).scalar()
+            ).returning(
+                *UserSubscription.__table__.c,
+                # Only a new subscription counts, not a rescheduled one
+                literal_column("xmax = 0", Boolean).label("inserted")
+            ).cte("upserted")
+            summarized = apply_billing_summary_deltas(
+                billing_summary_delta(
+                    UserInstance.user_id,
+                    total_subscription=case((upserted.c.inserted, 1), else_=0)
+                ).join_from(upserted, UserInstance, upserted.c.instance_id == UserInstance.instance_id)
+            ).returning(UserBillingSummary.user_id).cte("summarized")
+            result = (await db.execute(select(aliased(UserSubscription, upserted)).add_cte(summarized))).scalar()
+            await refresh_earliest_due_dates(db, self._instance_owner(instance_id))
+            # Delivered on commit, the billing worker leader moves its next run earlier if it has to
+            await db.execute(select(func.pg_notify(
+                BillingConfig.DEADLINE_CHANNEL,
+                f"{next_payment_date.isoformat()} {next_expire_date.isoformat()}"
+            )))
             return self.to_pydantic(UserSubscriptionModel, result)
     
     async def delete_subscription(
@@ -43,8 +63,15 @@ class SubscriptionOperation(BaseOperation):
                 stmt = stmt.where(UserSubscription.subscription_id == subscription_id)
             if instance_id is not None:
                 stmt = stmt.where(UserSubscription.instance_id == instance_id)
-            stmt = stmt.returning(UserSubscription)
-            result = (await db.execute(stmt)).scalar_one_or_none()
+            deleted = stmt.returning(*UserSubscription.__table__.c).cte("deleted")
+            summarized = apply_billing_summary_deltas(
+                billing_summary_delta(UserInstance.user_id, total_subscription=-1).join_from(
+                    deleted, UserInstance, deleted.c.instance_id == UserInstance.instance_id
+                )
+            ).returning(UserBillingSummary.user_id).cte("summarized")
+            result = (await db.execute(select(aliased(UserSubscription, deleted)).add_cte(summarized))).scalar_one_or_none()
+            if result is not None:
+                await refresh_earliest_due_dates(db, self._instance_owner(result.instance_id))
             return self.to_pydantic(UserSubscriptionModel, result)
     
     async def get_subscription_by_id(self, subscription_id: int) -> UserSubscriptionModel:
@@ -69,14 +96,23 @@ class SubscriptionOperation(BaseOperation):
             result = (await db.execute(stmt)).scalar_one()
             return self.to_pydantic(UserSubscriptionModel, result)
     
-    async def get_overdue_subscriptions(self, given_date: datetime) -> List[UserSubscriptionModel]:
+    async def get_billing_checkpoint(self, job: str) -> Optional[BillingCheckpointModel]:
         async with self.session() as db:
-            stmt = select(UserSubscription).where(UserSubscription.next_payment_date < given_date)
-            result = (await db.execute(stmt)).scalars().all()
-            return self.to_pydantic(UserSubscriptionModel, result)
+            result = await db.get(BillingCheckpoint, job)
+            return self.to_pydantic(BillingCheckpointModel, result)
     
-    async def get_expired_subscriptions(self, given_date: datetime) -> List[UserSubscriptionModel]:
+    async def save_billing_checkpoint(self, checkpoint: BillingCheckpointModel) -> None:
         async with self.session() as db:
-            stmt = select(UserSubscription).where(UserSubscription.next_expire_date < given_date)
-            result = (await db.execute(stmt)).scalars().all()
-            return self.to_pydantic(UserSubscriptionModel, result)
\ No newline at end of file
+            values = checkpoint.model_dump()
+            stmt = pg_insert(BillingCheckpoint).values(**values).on_conflict_do_update(
+                index_elements=['job'],
+                set_={key: value for key, value in values.items() if key != 'job'}
+            )
+            await db.execute(stmt)
+    
+    async def delete_billing_checkpoint(self, job: str) -> None:
+        async with self.session() as db:
+            await db.execute(delete(BillingCheckpoint).where(BillingCheckpoint.job == job))
+    
+    def _instance_owner(self, instance_id: uuid.UUID) -> Select:
+        return select(UserInstance.user_id).where(UserInstance.instance_id == instance_id)
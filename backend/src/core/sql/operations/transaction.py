@@ -1,19 +1,24 @@
 from datetime import datetime
-from typing import Callable, List, Optional, Tuple, AsyncContextManager
-from sqlalchemy import select, update, delete
-from sqlalchemy.orm import selectinload
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple, AsyncContextManager
+from sqlalchemy import CTE, Row, Select, String, any_, bindparam, cast, func, insert, literal, select, update, delete, tuple_
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, insert as pg_insert
 import uuid
 
 from .base import BaseOperation
+from .billing import apply_billing_summary_deltas, billing_summary_delta, refresh_earliest_due_dates, transaction_summary_delta
 from ..tables.user import User
 from ..tables.user_wallet import UserWallet
 from ..tables.user_subscription import UserSubscription
 from ..tables.transaction import Transaction
 from ..tables.user_instance import UserInstance
+from ..tables.instance_teardown import InstanceTeardown
+from ..tables.user_billing_summary import UserBillingSummary
 from ...models.user import UserInDB as UserModel, UserWallet as UserWalletModel
-from ...models.transaction import Transaction as TransactionModel
+from ...models.transaction import Transaction as TransactionModel, TransactionHistoryItem
+from ...models.subscription import ExpiryResult, SettlementResult
 from ...constants.transaction_const import TransactionStatus, TransactionType
+from ...utils.datetime import DateTimeUtils
 
 
 class TransactionOperation(BaseOperation):
@@ -26,6 +31,7 @@ class TransactionOperation(BaseOperation):
                 transaction_id=transaction.transaction_id,
                 user_id=transaction.user_id,
                 reference_id=transaction.reference_id,
+                subscription_id=transaction.subscription_id,
                 transaction_type=transaction.transaction_type,
                 transaction_status=transaction.transaction_status,
                 amount=transaction.amount,
@@ -36,13 +42,27 @@ class TransactionOperation(BaseOperation):
                 set_={
                     'user_id': transaction.user_id,
                     'reference_id': transaction.reference_id,
+                    'subscription_id': transaction.subscription_id,
                     'transaction_type': transaction.transaction_type,
                     'transaction_status': transaction.transaction_status,
                     'amount': transaction.amount,
                     'created_at': transaction.created_at,
                     'last_updated_at': transaction.last_updated_at
                 }
-            ).returning(Transaction)
+            )
+            if transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT:
+                # The row as it was comes out of the billing summary, the upserted one goes in
+                previous = self._summary_rows(
+                    Transaction.transaction_id == transaction.transaction_id
+                ).with_for_update().cte("previous")
+                upserted = stmt.returning(*Transaction.__table__.c).cte("upserted")
+                stmt = self._select_with_summary_deltas(
+                    upserted,
+                    transaction_summary_delta(upserted),
+                    transaction_summary_delta(previous, sign=-1)
+                )
+            else:
+                stmt = stmt.returning(Transaction)
             result = (await db.execute(stmt)).scalar()
             return self.to_pydantic(TransactionModel, result)
     
@@ -50,10 +70,24 @@ class TransactionOperation(BaseOperation):
             self,
             transaction: TransactionModel,
             update_balance_func: Callable[[UserWalletModel, TransactionModel], Tuple[UserWalletModel, TransactionModel]]
-    ) -> Tuple[UserWalletModel, TransactionModel]:
-        async with self.session() as db, db.begin():
+    ) -> Tuple[UserWalletModel, Optional[TransactionModel]]:
+        """
+        Apply update_balance_func to the user's wallet and the transaction under their row locks.
+        
+        The transaction is None when the row no longer has the status of the given
+        copy, it was settled meanwhile by someone else and is left alone.
+        """
+        async with self.session() as db, self.transaction(db):
             wallet_stmt = select(UserWallet).where(UserWallet.user_id == transaction.user_id).with_for_update()
             wallet = (await db.execute(wallet_stmt)).scalar_one()
+            # Wallet first and then the payment, in the bulk settlement's lock order
+            current_status = (await db.execute(
+                select(Transaction.transaction_status).where(
+                    Transaction.transaction_id == transaction.transaction_id
+                ).with_for_update()
+            )).scalar_one()
+            if current_status != transaction.transaction_status:
+                return self.to_pydantic(UserWalletModel, wallet), None
 
             updated_wallet, updated_transaction = update_balance_func(
                 self.to_pydantic(UserWalletModel, wallet),
@@ -75,7 +109,19 @@ class TransactionOperation(BaseOperation):
             ).values(
                 transaction_status=updated_transaction.transaction_status,
                 last_updated_at=updated_transaction.last_updated_at
-            ).returning(Transaction)
+            )
+            if transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT:
+                previous = self._summary_rows(
+                    Transaction.transaction_id == updated_transaction.transaction_id
+                ).with_for_update().cte("previous")
+                updated = transaction_update.returning(*Transaction.__table__.c).cte("updated")
+                transaction_update = self._select_with_summary_deltas(
+                    updated,
+                    transaction_summary_delta(updated),
+                    transaction_summary_delta(previous, sign=-1)
+                )
+            else:
+                transaction_update = transaction_update.returning(Transaction)
             result_transaction = (await db.execute(transaction_update)).scalar_one()
             
             return (
@@ -83,22 +129,60 @@ class TransactionOperation(BaseOperation):
                 self.to_pydantic(TransactionModel, result_transaction)
             )
     
-    async def delete_subscription_transaction(self, subscription_id: int) -> Optional[TransactionModel]:
+    async def delete_subscription_transaction(
+        self,
+        subscription_id: Optional[int] = None,
+        instance_id: Optional[uuid.UUID] = None,
+    ) -> Optional[TransactionModel]:
+        if subscription_id is None and instance_id is None:
+            raise ValueError("Either subscription_id or instance_id must be provided.")
         async with self.session() as db:
-            reference_id = f"subscription_{subscription_id}"
             stmt = delete(Transaction).where(
-                Transaction.reference_id == reference_id,
                 Transaction.transaction_status == TransactionStatus.SCHEDULED,
                 Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT
-            ).returning(Transaction)
+            )
+            if subscription_id is not None:
+                stmt = stmt.where(Transaction.subscription_id == subscription_id)
+            if instance_id is not None:
+                stmt = stmt.where(Transaction.subscription_id == select(UserSubscription.subscription_id).where(
+                    UserSubscription.instance_id == instance_id
+                ).scalar_subquery())
+            deleted = stmt.returning(*Transaction.__table__.c).cte("deleted")
+            stmt = self._select_with_summary_deltas(deleted, transaction_summary_delta(deleted, sign=-1))
             result = (await db.execute(stmt)).scalar_one_or_none()
             return self.to_pydantic(TransactionModel, result)
     
-    async def get_all_user_transactions(self, username: str) -> List[TransactionModel]:
+    async def get_user_transactions(
+        self,
+        username: str,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None
+    ) -> List[TransactionHistoryItem]:
+        """A user's transactions newest first, continuing after the (created_at, transaction_id) keyset if given."""
         async with self.session() as db:
-            stmt = select(Transaction).join(User).where(User.username == username)
-            result = (await db.execute(stmt)).scalars().all()
-            return self.to_pydantic(TransactionModel, result)
+            # Only columns in ix_transactions_user_history, so pages are index only scans
+            stmt = select(
+                Transaction.transaction_id,
+                Transaction.transaction_type,
+                Transaction.transaction_status,
+                Transaction.amount,
+                Transaction.created_at,
+                Transaction.last_updated_at
+            ).where(
+                Transaction.user_id == select(User.user_id).where(User.username == username).scalar_subquery()
+            ).order_by(Transaction.created_at.desc(), Transaction.transaction_id.desc())
+            if after is not None:
+                stmt = stmt.where(tuple_(Transaction.created_at, Transaction.transaction_id) < tuple_(*after))
+            if transaction_type:
+                stmt = stmt.where(Transaction.transaction_type.in_(transaction_type))
+            if transaction_status:
+                stmt = stmt.where(Transaction.transaction_status.in_(transaction_status))
+            if limit is not None:
+                stmt = stmt.limit(limit)
+            result = (await db.execute(stmt)).all()
+            return self.to_pydantic(TransactionHistoryItem, result)
     
     async def get_all_transactions(self) -> List[TransactionModel]:
         async with self.session() as db:
@@ -106,45 +190,400 @@ class TransactionOperation(BaseOperation):
             result = (await db.execute(stmt)).scalars().all()
             return self.to_pydantic(TransactionModel, result)
     
-    async def get_all_transactions_with_details(self) -> List[Tuple[Transaction, User, Optional[UserInstance]]]:
-        async with self.session() as db:
-            # Join with User to get username
-            stmt = select(Transaction, User).join(User, Transaction.user_id == User.user_id)
+    async def get_all_transactions_with_details(
+        self,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        username: Optional[str] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[Tuple[Transaction, User, Optional[UserInstance]]]:
+        """Transactions newest first in a single query, continuing after the (created_at, transaction_id) keyset if given."""
+        async with self.session(read_only=True) as db:
+            # Join with User for the username and the subscription's instance, if it still exists
+            stmt = select(Transaction, User, UserInstance).join(
+                User, Transaction.user_id == User.user_id
+            ).outerjoin(
+                UserSubscription, Transaction.subscription_id == UserSubscription.subscription_id
+            ).outerjoin(
+                UserInstance, UserSubscription.instance_id == UserInstance.instance_id
+            ).order_by(Transaction.created_at.desc(), Transaction.transaction_id.desc())
+            if after is not None:
+                stmt = stmt.where(tuple_(Transaction.created_at, Transaction.transaction_id) < tuple_(*after))
+            stmt = self._filter_transactions(stmt, username, transaction_type, transaction_status, start_date, end_date)
+            if limit is not None:
+                stmt = stmt.limit(limit)
             result = (await db.execute(stmt)).all()
-            
-            # Process each transaction to fetch related instance info if needed
-            detailed_transactions = []
-            for transaction, user in result:
-                instance = None
-                # Only for subscription payments, extract subscription_id and find the instance
-                if transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT:
-                    # Extract subscription ID from reference_id (format: "subscription_{subscription_id}")
-                    if transaction.reference_id.startswith("subscription_"):
-                        subscription_id = int(transaction.reference_id.split("_")[1])
-                        # Get the subscription and related instance
-                        subscription_stmt = select(UserSubscription, UserInstance).join(
-                            UserInstance, 
-                            UserSubscription.instance_id == UserInstance.instance_id
-                        ).where(UserSubscription.subscription_id == subscription_id)
-                        subscription_result = (await db.execute(subscription_stmt)).first()
-                        if subscription_result:
-                            _, instance = subscription_result
-                
-                detailed_transactions.append((transaction, user, instance))
-            
-            return detailed_transactions
+            return [(transaction, user, instance) for transaction, user, instance in result]
     
-    async def get_transactions_by_reference_ids(
+    async def stream_transactions_with_details(
         self,
-        reference_ids: List[str],
+        batch_size: int = 1000,
+        username: Optional[str] = None,
         transaction_type: Optional[List[TransactionType]] = None,
-        transaction_status: Optional[List[TransactionStatus]] = None
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> AsyncIterator[Sequence[Row]]:
+        """Transactions oldest first from a server side cursor, in batches of plain rows."""
+        # Detached, the stream is consumed after the request's unit of work has ended
+        async with self.session(read_only=True, detached=True) as db:
+            # Columns only, entities would pile up in the session's identity map
+            stmt = select(
+                Transaction.transaction_id,
+                User.username,
+                UserInstance.hostname,
+                Transaction.transaction_type,
+                Transaction.transaction_status,
+                Transaction.amount,
+                Transaction.created_at,
+                Transaction.last_updated_at
+            ).join(
+                User, Transaction.user_id == User.user_id
+            ).outerjoin(
+                UserSubscription, Transaction.subscription_id == UserSubscription.subscription_id
+            ).outerjoin(
+                UserInstance, UserSubscription.instance_id == UserInstance.instance_id
+            ).order_by(Transaction.created_at, Transaction.transaction_id)
+            stmt = self._filter_transactions(stmt, username, transaction_type, transaction_status, start_date, end_date)
+            result = await db.stream(stmt.execution_options(yield_per=batch_size))
+            async for rows in result.partitions():
+                yield rows
+    
+    def _filter_transactions(
+        self,
+        stmt: Select,
+        username: Optional[str] = None,
+        transaction_type: Optional[List[TransactionType]] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> Select:
+        if username is not None:
+            stmt = stmt.where(User.username == username)
+        if transaction_type:
+            stmt = stmt.where(Transaction.transaction_type.in_(transaction_type))
+        if transaction_status:
+            stmt = stmt.where(Transaction.transaction_status.in_(transaction_status))
+        if start_date is not None:
+            stmt = stmt.where(Transaction.created_at >= start_date)
+        if end_date is not None:
+            stmt = stmt.where(Transaction.created_at < end_date)
+        return stmt
+    
+    async def get_subscription_transactions(
+        self,
+        payment_due_before: Optional[datetime] = None,
+        expired_before: Optional[datetime] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None,
+        subscription_id: Optional[int] = None,
+        user_ids: Optional[Sequence[uuid.UUID]] = None
     ) -> List[TransactionModel]:
+        """Subscription payment transactions joined to their subscription's due dates."""
         async with self.session() as db:
-            stmt = select(Transaction).where(Transaction.reference_id.in_(reference_ids))
-            if transaction_type is not None:
-                stmt = stmt.where(Transaction.transaction_type.in_(transaction_type))
-            if transaction_status is not None:
-                stmt = stmt.where(Transaction.transaction_status.in_(transaction_status))
+            stmt = self._subscription_transactions(payment_due_before, expired_before, transaction_status)
+            if subscription_id is not None:
+                stmt = stmt.where(Transaction.subscription_id == subscription_id)
+            if user_ids is not None:
+                stmt = stmt.where(Transaction.user_id == any_(self._uuid_array("user_ids", user_ids)))
             result = (await db.execute(stmt)).scalars().all()
-            return self.to_pydantic(TransactionModel, result)
\ No newline at end of file
+            return self.to_pydantic(TransactionModel, result)
+    
+    async def iter_due_subscription_users(
+        self,
+        due_before: datetime,
+        after: Optional[uuid.UUID] = None,
+        chunk_size: int = 500
+    ) -> AsyncIterator[List[uuid.UUID]]:
+        """
+        Users with subscription payments due before the given date, in user id order and chunks.
+        
+        Every chunk is its own short keyset query, so nothing stays open while the
+        caller settles a chunk and commits it.
+        """
+        while True:
+            async with self.session() as db:
+                stmt = self._due_subscription_payments(due_before).with_only_columns(
+                    Transaction.user_id
+                ).distinct().order_by(Transaction.user_id).limit(chunk_size)
+                if after is not None:
+                    stmt = stmt.where(Transaction.user_id > after)
+                user_ids = list((await db.execute(stmt)).scalars().all())
+            if not user_ids:
+                return
+            yield user_ids
+            if len(user_ids) < chunk_size:
+                return
+            after = user_ids[-1]
+    
+    async def settle_due_subscription_payments(
+        self,
+        due_before: datetime,
+        next_payment_date: datetime,
+        next_expire_date: datetime,
+        user_ids: Optional[Sequence[uuid.UUID]] = None,
+        subscription_ids: Optional[Sequence[int]] = None
+    ) -> SettlementResult:
+        """
+        Settle every subscription payment due before the given date in one transaction,
+        only the given users' and subscriptions' if any are given.
+        
+        Per user, payments are paid oldest first for as long as the wallet balance
+        covers their running total, the rest are marked overdue. Paid payments move
+        their subscription to the next cycle and schedule its payment. Four
+        statements whatever the number of payments.
+        """
+        async with self.session() as db, self.transaction(db):
+            # Lock every wallet involved up front in one stable order, so concurrent
+            # settlements and top ups wait for each other instead of deadlocking
+            due_payments = self._due_subscription_payments(due_before)
+            if subscription_ids is not None:
+                due_payments = due_payments.where(Transaction.subscription_id.in_(subscription_ids))
+            due_users = due_payments.with_only_columns(Transaction.user_id)
+            if user_ids is not None:
+                due_users = due_users.where(Transaction.user_id == any_(self._uuid_array("user_ids", user_ids)))
+            user_ids = (await db.execute(
+                select(UserWallet.user_id).where(UserWallet.user_id.in_(due_users))
+                .order_by(UserWallet.user_id).with_for_update()
+            )).scalars().all()
+            if not user_ids:
+                return SettlementResult(users=0, due=0, paid=0, overdue=0, scheduled=0)
+            locked_user_ids = self._uuid_array("locked_user_ids", user_ids)
+            
+            now = DateTimeUtils.now_dt()
+            due = due_payments.with_only_columns(
+                Transaction.transaction_id,
+                Transaction.user_id,
+                Transaction.subscription_id,
+                Transaction.transaction_status,
+                Transaction.amount,
+                Transaction.created_at
+            ).where(Transaction.user_id == any_(locked_user_ids)).with_for_update(of=Transaction).cte("due")
+            # Window functions can't be combined with FOR UPDATE, so the running totals come second
+            ranked = select(
+                due,
+                UserWallet.balance,
+                func.sum(due.c.amount).over(
+                    partition_by=due.c.user_id, order_by=(due.c.created_at, due.c.transaction_id)
+                ).label("running_total")
+            ).join(UserWallet, UserWallet.user_id == due.c.user_id).cte("ranked")
+            
+            paid = update(Transaction).where(
+                Transaction.transaction_id == ranked.c.transaction_id,
+                ranked.c.running_total <= ranked.c.balance
+            ).values(
+                transaction_status=TransactionStatus.PAID,
+                last_updated_at=now
+            ).returning(
+                Transaction.user_id, Transaction.subscription_id, Transaction.amount, Transaction.created_at
+            ).cte("paid")
+            overdue = update(Transaction).where(
+                Transaction.transaction_id == ranked.c.transaction_id,
+                ranked.c.running_total > ranked.c.balance,
+                ranked.c.transaction_status == TransactionStatus.SCHEDULED
+            ).values(
+                transaction_status=TransactionStatus.OVERDUE,
+                last_updated_at=now
+            ).returning(Transaction.transaction_id).cte("overdue")
+            
+            debits = select(
+                paid.c.user_id, func.sum(paid.c.amount).label("total")
+            ).group_by(paid.c.user_id).cte("debits")
+            debited = update(UserWallet).where(
+                UserWallet.user_id == debits.c.user_id
+            ).values(
+                balance=UserWallet.balance - debits.c.total,
+                last_updated_at=now
+            ).returning(UserWallet.user_id).cte("debited")
+            renewed = update(UserSubscription).where(
+                UserSubscription.subscription_id == paid.c.subscription_id
+            ).values(
+                next_payment_date=next_payment_date,
+                next_expire_date=next_expire_date
+            ).returning(UserSubscription.subscription_id).cte("renewed")
+            scheduled = insert(Transaction).from_select(
+                [
+                    "transaction_id", "user_id", "reference_id", "subscription_id", "transaction_type",
+                    "transaction_status", "amount", "created_at", "last_updated_at"
+                ],
+                select(
+                    func.gen_random_uuid(),
+                    paid.c.user_id,
+                    literal("subscription_") + cast(paid.c.subscription_id, String),
+                    paid.c.subscription_id,
+                    literal(TransactionType.SUBSCRIPTION_PAYMENT, Transaction.transaction_type.type),
+                    literal(TransactionStatus.SCHEDULED, Transaction.transaction_status.type),
+                    paid.c.amount,
+                    literal(now, Transaction.created_at.type),
+                    literal(now, Transaction.last_updated_at.type)
+                )
+            ).returning(Transaction.transaction_id, Transaction.user_id, Transaction.amount).cte("scheduled")
+            summarized = apply_billing_summary_deltas(
+                # Paid payments move from the upcoming to the all time amount, their next ones are upcoming
+                billing_summary_delta(
+                    paid.c.user_id,
+                    upcoming_amount=-paid.c.amount,
+                    all_time_amount=paid.c.amount,
+                    all_time_cycles=1,
+                    last_payment_date=paid.c.created_at
+                ),
+                billing_summary_delta(scheduled.c.user_id, upcoming_amount=scheduled.c.amount)
+            ).returning(UserBillingSummary.user_id).cte("summarized")
+            
+            counts = (await db.execute(select(
+                *(
+                    select(func.count()).select_from(cte).scalar_subquery().label(cte.name)
+                    for cte in (ranked, paid, overdue, debited, renewed, scheduled, summarized)
+                ),
+                select(func.array_agg(paid.c.user_id.distinct())).scalar_subquery().label("renewed_user_ids")
+            ))).one()
+            
+            if counts.renewed_user_ids:
+                await refresh_earliest_due_dates(db, counts.renewed_user_ids)
+            return SettlementResult(
+                users=len(user_ids),
+                due=counts.ranked,
+                paid=counts.paid,
+                overdue=counts.overdue,
+                scheduled=counts.scheduled
+            )
+    
+    async def expire_due_subscriptions(
+        self,
+        expired_before: datetime,
+        subscription_ids: Optional[Sequence[int]] = None
+    ) -> ExpiryResult:
+        """
+        Expire every overdue subscription payment whose subscription expired before the given date,
+        only the given subscriptions' if any are given.
+        
+        One statement marks the payments expired, removes their subscriptions (and
+        any payment still scheduled for them), marks the instances as deleting and
+        queues them for their containers to be deleted, which is left to the
+        instance teardown.
+        """
+        async with self.session() as db, self.transaction(db):
+            now = DateTimeUtils.now_dt()
+            expired = update(Transaction).where(
+                Transaction.subscription_id == UserSubscription.subscription_id,
+                Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
+                Transaction.transaction_status == TransactionStatus.OVERDUE,
+                UserSubscription.next_expire_date < expired_before
+            )
+            if subscription_ids is not None:
+                expired = expired.where(UserSubscription.subscription_id.in_(subscription_ids))
+            expired = expired.values(
+                transaction_status=TransactionStatus.EXPIRED,
+                last_updated_at=now
+            ).returning(
+                Transaction.user_id, Transaction.amount, UserSubscription.subscription_id, UserSubscription.instance_id
+            ).cte("expired")
+            unscheduled = delete(Transaction).where(
+                Transaction.subscription_id.in_(select(expired.c.subscription_id)),
+                Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
+                Transaction.transaction_status == TransactionStatus.SCHEDULED
+            ).returning(Transaction.transaction_id, Transaction.user_id, Transaction.amount).cte("unscheduled")
+            # Unlinks the expired payments like deleting the instance does
+            removed = delete(UserSubscription).where(
+                UserSubscription.subscription_id.in_(select(expired.c.subscription_id))
+            ).returning(UserSubscription.instance_id).cte("removed")
+            marked = update(UserInstance).where(
+                UserInstance.instance_id.in_(select(removed.c.instance_id))
+            ).values(
+                status="Deleting",
+                last_updated_at=now
+            ).returning(UserInstance.instance_id, UserInstance.user_id, UserInstance.hostname).cte("marked")
+            queued = pg_insert(InstanceTeardown).from_select(
+                ["instance_id", "hostname", "queued_at", "attempts", "next_attempt_at"],
+                select(
+                    marked.c.instance_id,
+                    marked.c.hostname,
+                    literal(now, InstanceTeardown.queued_at.type),
+                    literal(0),
+                    literal(now, InstanceTeardown.next_attempt_at.type)
+                )
+            ).on_conflict_do_nothing(index_elements=["instance_id"]).returning(InstanceTeardown.instance_id).cte("queued")
+            summarized = apply_billing_summary_deltas(
+                # Neither the expired nor the still scheduled payments are upcoming anymore
+                billing_summary_delta(expired.c.user_id, upcoming_amount=-expired.c.amount),
+                billing_summary_delta(unscheduled.c.user_id, upcoming_amount=-unscheduled.c.amount),
+                billing_summary_delta(marked.c.user_id, total_subscription=-1)
+            ).returning(UserBillingSummary.user_id).cte("summarized")
+            
+            # Unreferenced CTEs aren't rendered, every one is counted
+            counts = (await db.execute(select(
+                *(
+                    select(func.count()).select_from(cte).scalar_subquery().label(cte.name)
+                    for cte in (expired, unscheduled, queued, summarized)
+                ),
+                select(func.array_agg(expired.c.user_id.distinct())).scalar_subquery().label("user_ids")
+            ))).one()
+            
+            if counts.user_ids:
+                await refresh_earliest_due_dates(db, counts.user_ids)
+            return ExpiryResult(expired=counts.expired, queued=counts.queued)
+    
+    async def get_next_subscription_deadlines(self) -> Tuple[Optional[datetime], Optional[datetime]]:
+        """The earliest payment date of a scheduled payment and expiry date of an overdue one."""
+        # Not from a replica, a deadline notified a moment ago must already be visible
+        async with self.session() as db:
+            stmt = select(
+                func.min(UserSubscription.next_payment_date).filter(
+                    Transaction.transaction_status == TransactionStatus.SCHEDULED
+                ),
+                func.min(UserSubscription.next_expire_date).filter(
+                    Transaction.transaction_status == TransactionStatus.OVERDUE
+                )
+            ).select_from(Transaction).join(
+                UserSubscription, Transaction.subscription_id == UserSubscription.subscription_id
+            ).where(
+                Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT,
+                Transaction.transaction_status.in_([TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE])
+            )
+            next_payment, next_expire = (await db.execute(stmt)).one()
+            return next_payment, next_expire
+    
+    def _subscription_transactions(
+        self,
+        payment_due_before: Optional[datetime] = None,
+        expired_before: Optional[datetime] = None,
+        transaction_status: Optional[List[TransactionStatus]] = None
+    ) -> Select:
+        stmt = select(Transaction).join(
+            UserSubscription, Transaction.subscription_id == UserSubscription.subscription_id
+        ).where(Transaction.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT)
+        if payment_due_before is not None:
+            stmt = stmt.where(UserSubscription.next_payment_date < payment_due_before)
+        if expired_before is not None:
+            stmt = stmt.where(UserSubscription.next_expire_date < expired_before)
+        if transaction_status is not None:
+            stmt = stmt.where(Transaction.transaction_status.in_(transaction_status))
+        return stmt
+    
+    def _uuid_array(self, name: str, values: Sequence[uuid.UUID]):
+        """One array parameter, however many ids there are"""
+        return bindparam(name, list(values), type_=ARRAY(UUID(as_uuid=True)))
+    
+    def _summary_rows(self, *conditions) -> Select:
+        """The transaction columns a billing summary is built from."""
+        return select(
+            Transaction.user_id,
+            Transaction.transaction_type,
+            Transaction.transaction_status,
+            Transaction.amount,
+            Transaction.created_at
+        ).where(*conditions)
+    
+    def _select_with_summary_deltas(self, changed: CTE, *deltas: Select) -> Select:
+        """Select the changed transactions while the same statement applies the deltas to the billing summaries."""
+        summarized = apply_billing_summary_deltas(*deltas).returning(UserBillingSummary.user_id).cte("summarized")
+        return select(aliased(Transaction, changed)).add_cte(summarized)
+    
+    def _due_subscription_payments(self, due_before: datetime) -> Select:
+        """Unsettled subscription payments whose subscription's payment date has passed."""
+        return self._subscription_transactions(
+            payment_due_before=due_before,
+            transaction_status=[TransactionStatus.SCHEDULED, TransactionStatus.OVERDUE]
+        )
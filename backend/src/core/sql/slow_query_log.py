@@ -0,0 +1,152 @@
+"""
+Bounded log of slow statements with their query plans.
+
+The cursor events in instrumentation hand every statement slower than the
+threshold to the log, together with the operation and route that issued it.
+The plan is captured afterwards with EXPLAIN (ANALYZE off, FORMAT JSON) on a separate
+connection, EXPLAIN without ANALYZE only plans the statement, so writes are
+never repeated.
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Deque, List, Optional, Set
+import asyncio
+import json
+import uuid
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..config import DatabaseConfig
+from ..utils.datetime import DateTimeUtils
+from ..utils.logging import logger
+
+# Execution option marking the log's own EXPLAIN statements, so they are never logged themselves
+SKIP_OPTION = "skip_slow_query_log"
+
+EXPLAINABLE = ("select", "insert", "update", "delete", "with", "values")
+
+
+@dataclass
+class SlowQuery:
+    occurred_at: datetime
+    duration_ms: float
+    statement: str
+    parameters: List[Any]
+    operation: Optional[str]
+    route: Optional[str]
+    plan: Optional[Any] = None
+    plan_error: Optional[str] = None
+
+
+def redact_parameters(parameters: Any) -> List[Any]:
+    """Keep numbers, ids and dates, text and binary values only show their length."""
+    if isinstance(parameters, dict):
+        parameters = list(parameters.values())
+    elif isinstance(parameters, list):
+        # executemany, the first parameter set stands for all of them
+        parameters = parameters[0] if parameters else ()
+    redacted = []
+    for value in parameters or ():
+        if value is None or isinstance(value, (bool, int, float)):
+            redacted.append(value)
+        elif isinstance(value, (Decimal, uuid.UUID)):
+            redacted.append(str(value))
+        elif isinstance(value, (datetime, date)):
+            redacted.append(value.isoformat())
+        elif isinstance(value, (str, bytes)):
+            redacted.append(f"<{type(value).__name__} len={len(value)}>")
+        else:
+            redacted.append(f"<{type(value).__name__}>")
+    return redacted
+
+
+class SlowQueryLog:
+    _instance: Optional["SlowQueryLog"] = None
+
+    # Plans captured at once, each takes a pool connection
+    MAX_PENDING_EXPLAINS = 2
+
+    def __init__(self, threshold_ms: float, size: int):
+        self.threshold_ms = threshold_ms
+        self.size = size
+        self.entries: Deque[SlowQuery] = deque(maxlen=size)
+        self.recorded = 0
+        self.skipped_explains = 0
+        self._pending: Set[asyncio.Task] = set()
+
+    @classmethod
+    def get_instance(cls) -> "SlowQueryLog":
+        """Get the singleton instance of SlowQueryLog"""
+        if cls._instance is None:
+            cls._instance = cls(DatabaseConfig.SLOW_QUERY_MS, DatabaseConfig.SLOW_QUERY_LOG_SIZE)
+        return cls._instance
+
+    def is_slow(self, elapsed_seconds: float, context: Any) -> bool:
+        if self.threshold_ms <= 0 or elapsed_seconds * 1000 < self.threshold_ms:
+            return False
+        return context is None or not context.execution_options.get(SKIP_OPTION, False)
+
+    def record(
+        self,
+        engine: Engine,
+        statement: str,
+        parameters: Any,
+        elapsed_seconds: float,
+        operation: Optional[str],
+        route: Optional[str]
+    ):
+        entry = SlowQuery(
+            occurred_at=DateTimeUtils.now_dt(),
+            duration_ms=round(elapsed_seconds * 1000, 3),
+            statement=statement,
+            parameters=redact_parameters(parameters),
+            operation=operation,
+            route=route
+        )
+        self.entries.append(entry)
+        self.recorded += 1
+        logger.warning(f"Slow query ({entry.duration_ms} ms) in {operation or 'no operation'} on {route or 'no route'}")
+
+        if not statement.lstrip().lower().startswith(EXPLAINABLE):
+            entry.plan_error = "Statement can't be explained"
+            return
+        if len(self._pending) >= self.MAX_PENDING_EXPLAINS:
+            self.skipped_explains += 1
+            entry.plan_error = "Skipped, too many plans being captured"
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            entry.plan_error = "No event loop to capture the plan on"
+            return
+        task = loop.create_task(self._explain(engine, entry, statement, parameters))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _explain(self, engine: Engine, entry: SlowQuery, statement: str, parameters: Any):
+        if isinstance(parameters, list):
+            parameters = parameters[0] if parameters else ()
+        try:
+            async with AsyncEngine(engine).connect() as connection:
+                result = await connection.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE off, FORMAT JSON) {statement}",
+                    parameters or (),
+                    execution_options={SKIP_OPTION: True}
+                )
+                plan = result.scalar_one()
+            # asyncpg hands json columns over as text
+            entry.plan = json.loads(plan) if isinstance(plan, str) else plan
+        except Exception as e:
+            entry.plan_error = str(e)
+
+    def reset(self):
+        self.entries.clear()
+        self.recorded = 0
+        self.skipped_explains = 0
+
+
+def get_slow_query_log() -> SlowQueryLog:
+    return SlowQueryLog.get_instance()
@@ -1,19 +1,33 @@
+from .billing_checkpoint import BillingCheckpoint
+from .billing_rollup import BillingRollup
+from .billing_rollup_delta import BillingRollupDelta
 from .instance_plan import InstancePlan
+from .instance_teardown import InstanceTeardown
 from .os_type import OsType
 from .transaction import Transaction
 from .user import User
 from .user_instance import UserInstance
 from .user_role import UserRole
+from .user_billing_summary import UserBillingSummary
+from .schema_migration import SchemaMigration
+from .seed_marker import SeedMarker
 from .user_subscription import UserSubscription
 from .user_wallet import UserWallet
 
 __all__ = [
+    'BillingCheckpoint',
+    'BillingRollup',
+    'BillingRollupDelta',
     'InstancePlan',
+    'InstanceTeardown',
     'OsType',
     'Transaction',
     'User',
     'UserInstance',
     'UserRole',
+    'UserBillingSummary',
+    'SchemaMigration',
+    'SeedMarker',
     'UserSubscription',
     'UserWallet',
 ]
\ No newline at end of file
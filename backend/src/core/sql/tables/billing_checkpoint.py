@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+from ...utils.datetime import UTCDateTime
+
+class BillingCheckpoint(Base):
+    """How far an unfinished billing job run got, so the next run carries on after the last committed chunk."""
+    __tablename__ = 'billing_checkpoints'
+
+    job: Mapped[str] = mapped_column(primary_key=True)
+    # Cutoff of the interrupted run, a resumed run keeps it so its keyset order stays valid
+    run_started_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
+    # Key of the last row of the last committed chunk
+    position: Mapped[str] = mapped_column(nullable=False)
+    processed: Mapped[int] = mapped_column(nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Enum
+
+from .base import Base
+from ...constants.transaction_const import TransactionType, TransactionStatus
+from ...utils.datetime import UTCDateTime
+
+class BillingRollup(Base):
+    """Transaction totals per UTC hour, billing_rollup_deltas holds the changes not folded in yet."""
+    __tablename__ = 'billing_rollups'
+
+    bucket_hour: Mapped[datetime] = mapped_column(UTCDateTime, primary_key=True)
+    transaction_type: Mapped[TransactionType] = mapped_column(Enum(TransactionType), primary_key=True)
+    transaction_status: Mapped[TransactionStatus] = mapped_column(Enum(TransactionStatus), primary_key=True)
+    total_amount: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    transaction_count: Mapped[int] = mapped_column(nullable=False, default=0)
@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, Enum
+
+from .base import Base
+from ...constants.transaction_const import TransactionType, TransactionStatus
+from ...utils.datetime import UTCDateTime
+
+class BillingRollupDelta(Base):
+    """Changes to billing_rollups appended by the billing_rollup_apply trigger, folded into it by the billing worker."""
+    __tablename__ = 'billing_rollup_deltas'
+
+    delta_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    bucket_hour: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
+    transaction_type: Mapped[TransactionType] = mapped_column(Enum(TransactionType), nullable=False)
+    transaction_status: Mapped[TransactionStatus] = mapped_column(Enum(TransactionStatus), nullable=False)
+    total_amount: Mapped[float] = mapped_column(nullable=False)
+    transaction_count: Mapped[int] = mapped_column(nullable=False)
@@ -0,0 +1,23 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import ForeignKey, Index, UUID
+import uuid
+
+from .base import Base
+from ...utils.datetime import UTCDateTime
+
+class InstanceTeardown(Base):
+    """Instances of expired subscriptions whose LXD container still has to be deleted, gone with the instance row."""
+    __tablename__ = 'instance_teardowns'
+    __table_args__ = (
+        Index('ix_instance_teardowns_next_attempt_at', 'next_attempt_at'),
+    )
+
+    instance_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey('user_instances.instance_id', ondelete='CASCADE'), primary_key=True)
+    hostname: Mapped[str] = mapped_column(nullable=False)
+    queued_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
+    # NULL once the attempts ran out, the row stays for an admin to look at
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(nullable=True)
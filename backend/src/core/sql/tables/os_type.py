@@ -1,5 +1,6 @@
 from typing import TYPE_CHECKING, List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import Index
 
 from .base import Base
 
@@ -8,6 +9,10 @@ if TYPE_CHECKING:
 
 class OsType(Base):
     __tablename__ = 'os_types'
+    __table_args__ = (
+        # Conflict target of the seed data
+        Index('uq_os_types_image', 'os_image_name', 'os_image_version', unique=True),
+    )
 
     os_type_id: Mapped[int] = mapped_column(primary_key=True)
     os_image_name: Mapped[str] = mapped_column(nullable=False)
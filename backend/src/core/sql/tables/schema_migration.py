@@ -0,0 +1,12 @@
+from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+from ...utils.datetime import UTCDateTime
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
@@ -0,0 +1,14 @@
+from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+from ...utils.datetime import UTCDateTime
+
+class SeedMarker(Base):
+    """Digest of the seed data last applied, so startup can skip seeding when nothing changed."""
+    __tablename__ = 'seed_markers'
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    digest: Mapped[str] = mapped_column(nullable=False)
+    schema_version: Mapped[int] = mapped_column(nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
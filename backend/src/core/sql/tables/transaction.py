@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, UUID, Enum, String
+from sqlalchemy import ForeignKey, Index, UUID, Enum, String
 import uuid
 
 from .base import Base
@@ -13,10 +13,23 @@ if TYPE_CHECKING:
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_reference_id', 'reference_id'),
+        Index('ix_transactions_type_status', 'transaction_type', 'transaction_status'),
+        Index('ix_transactions_subscription_id', 'subscription_id'),
+        # Admin listing, newest first across all users
+        Index('ix_transactions_created_at', 'created_at', 'transaction_id'),
+        # Covers the paginated history, newest first pages are backward scans, and any lookup by user
+        Index(
+            'ix_transactions_user_history', 'user_id', 'created_at', 'transaction_id',
+            postgresql_include=['transaction_type', 'transaction_status', 'amount', 'last_updated_at']
+        ),
+    )
 
     transaction_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.user_id'), nullable=False)
     reference_id: Mapped[str] = mapped_column(String, nullable=False)
+    subscription_id: Mapped[Optional[int]] = mapped_column(ForeignKey('user_subscriptions.subscription_id', ondelete='SET NULL'), nullable=True)
     transaction_type: Mapped[TransactionType] = mapped_column(Enum(TransactionType), nullable=False)
     transaction_status: Mapped[TransactionStatus] = mapped_column(Enum(TransactionStatus), nullable=False)
     amount: Mapped[float] = mapped_column(nullable=False)
@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import ForeignKey, UUID
+import uuid
+
+from .base import Base
+from ...utils.datetime import UTCDateTime
+
+class UserBillingSummary(Base):
+    """A user's billing overview, the statements that change subscriptions and payments add their deltas to it."""
+    __tablename__ = 'user_billing_summary'
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    total_subscription: Mapped[int] = mapped_column(nullable=False, default=0)
+    upcoming_amount: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    earliest_due_date: Mapped[Optional[datetime]] = mapped_column(UTCDateTime, nullable=True)
+    all_time_amount: Mapped[float] = mapped_column(nullable=False, default=0.0)
+    all_time_cycles: Mapped[int] = mapped_column(nullable=False, default=0)
+    last_payment_date: Mapped[Optional[datetime]] = mapped_column(UTCDateTime, nullable=True)
+    last_updated_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import TYPE_CHECKING
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey, UUID
+from sqlalchemy import ForeignKey, Index, UUID
 import uuid
 
 from ...utils.datetime import UTCDateTime
@@ -15,6 +15,10 @@ if TYPE_CHECKING:
 
 class UserInstance(Base):
     __tablename__ = 'user_instances'
+    __table_args__ = (
+        Index('ix_user_instances_user_id', 'user_id'),
+        Index('ix_user_instances_hostname', 'hostname'),
+    )
 
     instance_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.user_id'), nullable=False)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import TYPE_CHECKING
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 import uuid
 
 from .base import Base
@@ -12,6 +12,10 @@ if TYPE_CHECKING:
 
 class UserSubscription(Base):
     __tablename__ = 'user_subscriptions'
+    __table_args__ = (
+        Index('ix_user_subscriptions_next_payment_date', 'next_payment_date'),
+        Index('ix_user_subscriptions_next_expire_date', 'next_expire_date'),
+    )
 
     subscription_id: Mapped[int] = mapped_column(primary_key=True)
     instance_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('user_instances.instance_id'), unique=True, nullable=False)
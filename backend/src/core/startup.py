@@ -1,10 +1,12 @@
+import time
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 from .sql.init_data import initialize_data
+from .sql.migrations import run_migrations
 from .utils.logging import logger
 from .container import AppContainer
-from .config import APP_ENV
+from .config import APP_ENV, DatabaseConfig
 
 class AppStartupManager:
     """
@@ -28,12 +30,25 @@ class AppStartupManager:
                 except Exception as e:
                     logger.error(f"Failed to clean up test database: {str(e)}")
             
-            await db_manager.create_all()
+            started = time.perf_counter()
+            await run_migrations()
+            migrated = time.perf_counter()
             await initialize_data()
-            logger.info("Database initialized successfully")
+            logger.info(
+                f"Database initialized successfully, migrations took {migrated - started:.3f}s "
+                f"and seeding ({DatabaseConfig.SEED_MODE}) {time.perf_counter() - migrated:.3f}s"
+            )
         except Exception as e:
             logger.error(f"Failed to initialize database: {str(e)}")
     
+    async def warmup_database_pool(self):
+        """Open pooled connections before the first requests arrive."""
+        try:
+            opened = await self.container.db_manager().warmup(DatabaseConfig.POOL_WARMUP)
+            logger.info(f"Database pool warmed up with {opened} connections")
+        except Exception as e:
+            logger.error(f"Failed to warm up database pool: {str(e)}")
+    
     def initialize_lxd_manager(self):
         """Initialize the LXD container manager."""
         try:
@@ -42,6 +57,13 @@ class AppStartupManager:
         except Exception as e:
             logger.error(f"Failed to initialize LXD Manager: {str(e)}")
     
+    def initialize_password_hasher(self):
+        """Create the process pool used for bcrypt."""
+        try:
+            self.container.password_hasher().start()
+        except Exception as e:
+            logger.error(f"Failed to start password hasher: {str(e)}")
+    
     async def start_billing_worker(self):
         """Initialize and start the billing worker."""
         try:
@@ -53,21 +75,29 @@ class AppStartupManager:
     
     async def startup(self):
         """Initialize all required components."""
+        started = time.perf_counter()
         await self.initialize_database()
+        await self.warmup_database_pool()
         self.initialize_lxd_manager()
+        self.initialize_password_hasher()
         
         # In test mode, we will trigger the subscription action manually
         if APP_ENV != "test":
             await self.start_billing_worker()
+        
+        logger.info(f"Startup completed in {time.perf_counter() - started:.3f}s")
     
     async def shutdown(self):
         """Clean up resources and stop services."""
         # Stop the billing worker
         billing_worker = self.container.billing_worker()
         if billing_worker.is_running:
-            billing_worker.stop()
+            await billing_worker.stop()
             logger.info("Billing worker stopped")
         
+        # Stop the password hashing processes
+        await self.container.password_hasher().shutdown()
+        
         # Close database connections
         try:
             db_manager = self.container.db_manager()
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Optional
 import pytz
-from sqlalchemy import TypeDecorator, String
+from sqlalchemy import TypeDecorator, DateTime
 
 class DateTimeUtils:
     BKK_TZ = pytz.timezone("Asia/Bangkok")
@@ -48,30 +48,24 @@ class DateTimeUtils:
 
 # Custom SQLAlchemy type for UTC dates
 class UTCDateTime(TypeDecorator):
-    """SQLAlchemy type that stores datetime as UTC strings but loads as datetime objects"""
-    impl = String
+    """SQLAlchemy type that stores datetime as TIMESTAMP WITH TIME ZONE and loads it as UTC datetime objects"""
+    impl = DateTime(timezone=True)
     cache_ok = True
 
-    def process_bind_param(self, value, dialect) -> Optional[str]:
+    def process_bind_param(self, value, dialect) -> Optional[datetime]:
         if value is None:
             return None
         if isinstance(value, str):
-            # If it's already a string, ensure it's in UTC format
-            dt = datetime.strptime(value, DateTimeUtils.FORMAT)
-            if dt.tzinfo is None:
-                dt = DateTimeUtils.UTC_TZ.localize(dt)
-            else:
-                dt = dt.astimezone(DateTimeUtils.UTC_TZ)
-            return dt.strftime(DateTimeUtils.FORMAT)
+            # Accept strings in the standard format, they are always UTC
+            value = datetime.strptime(value, DateTimeUtils.FORMAT)
         
         # Ensure datetime is in UTC
         if value.tzinfo is None:
-            value = DateTimeUtils.UTC_TZ.localize(value)
-        else:
-            value = value.astimezone(DateTimeUtils.UTC_TZ)
-        return value.strftime(DateTimeUtils.FORMAT)
+            return DateTimeUtils.UTC_TZ.localize(value)
+        return value.astimezone(DateTimeUtils.UTC_TZ)
 
     def process_result_value(self, value, dialect) -> Optional[datetime]:
         if value is None:
             return None
-        return DateTimeUtils.from_string(value)
\ No newline at end of file
+        # asyncpg already returns aware datetimes, only normalize the zone
+        return value.astimezone(DateTimeUtils.UTC_TZ)
@@ -1,44 +1,80 @@
-from typing import Optional
-from fastapi import Depends, HTTPException, Request, WebSocket, status
+from typing import AsyncIterator, Optional
+from fastapi import Depends, HTTPException, Request, Response, WebSocket, status
+from fastapi.requests import HTTPConnection
 from contextvars import ContextVar
 
-from ..models.user import UserSessionResponse, UserInDB
+from ..models.user import UserSessionResponse, UserIdentity
 from ..service.user import UserService
+from ..sql.database import get_db_manager
+from ..sql.instrumentation import request_route_ctx
+from ..config import DatabaseConfig
+from .identity_cache import get_identity_cache
 
 # Context variable to store the current user session
-user_session_ctx: ContextVar[Optional[UserInDB]] = ContextVar("user_session", default=None)
+user_session_ctx: ContextVar[Optional[UserIdentity]] = ContextVar("user_session", default=None)
+
+# Share one database session across every operation of an HTTP request
+async def db_unit_of_work(
+    connection: HTTPConnection
+) -> AsyncIterator[None]:
+    # Websockets live too long to hold a transaction open
+    if not DatabaseConfig.UNIT_OF_WORK or connection.scope["type"] != "http":
+        yield
+        return
+    async with get_db_manager().unit_of_work():
+        yield
+
+# Attribute operation metrics to the matched route template, not the raw path
+async def track_request_route(
+    connection: HTTPConnection
+) -> None:
+    route = connection.scope.get("route")
+    method = connection.scope.get("method", "WS")
+    request_route_ctx.set(f"{method} {route.path}" if route else f"{method} {connection.url.path}")
+
+def _raise_not_authenticated():
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _to_session(identity: UserIdentity) -> UserSessionResponse:
+    return UserSessionResponse(
+        is_authenticated=True,
+        username=identity.username,
+        email=identity.email,
+        role=identity.role
+    )
 
 # Define a dependency that gets the current user
 async def get_current_user(
-    request: Request
+    request: Request,
+    response: Response
 ) -> UserSessionResponse:
     user_service: UserService = request.app.state.container.user_service()
-    user_session = await user_service.get_user_session(request)
-    if not user_session.is_authenticated:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # Store the user session in the context
-    user_session_ctx.set(await user_service.user_opr.get_user_by_username(user_session.username))
-    return user_session
+    get_identity_cache().begin_request()
+    access_token = request.cookies.get("access_token")
+    if not access_token:
+        _raise_not_authenticated()
+    # Store the user identity in the context
+    identity = await user_service.get_user_identity(access_token, response)
+    user_session_ctx.set(identity)
+    return _to_session(identity)
 
 async def get_current_user_ws(
     websocket: WebSocket
 ) -> UserSessionResponse:
     user_service: UserService = websocket.app.state.container.user_service()
-    user_session = await user_service.get_user_session_websocket(websocket)
-    if not user_session.is_authenticated:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    get_identity_cache().begin_request()
+    access_token = websocket.cookies.get("access_token")
+    if not access_token:
+        _raise_not_authenticated()
     
-    # Store the user session in the context
-    user_session_ctx.set(await user_service.user_opr.get_user_by_username(user_session.username))
-    return user_session
+    # Store the user identity in the context
+    identity = await user_service.get_user_identity(access_token)
+    user_session_ctx.set(identity)
+    return _to_session(identity)
 
 # Use the previous dependency for admin check
 async def get_admin_user(
@@ -0,0 +1,132 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ..config import IdentityCacheConfig
+from ..models.user import UserInDB, UserRole
+
+# Context variable holding the identities resolved during the current request
+identity_scope_ctx: ContextVar[Optional[Dict[Tuple[str, str], Any]]] = ContextVar("identity_scope", default=None)
+
+
+class IdentityCache:
+    """
+    Caches user identities and roles so each request resolves them once.
+
+    Lookups are answered from the current request scope first, then from the
+    optional cross-request cache (keyed by username, bounded by a TTL), and
+    only then from the database through the given loader.
+    """
+    _instance: Optional["IdentityCache"] = None
+
+    USER = "user"
+    ROLE = "role"
+
+    def __init__(self, ttl_seconds: float = 0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._shared: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self.request_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_instance(cls) -> "IdentityCache":
+        """Get the singleton instance of IdentityCache"""
+        if cls._instance is None:
+            cls._instance = cls(
+                ttl_seconds=IdentityCacheConfig.TTL_SECONDS,
+                max_entries=IdentityCacheConfig.MAX_ENTRIES
+            )
+        return cls._instance
+
+    @property
+    def saved_queries(self) -> int:
+        """Number of database round trips answered from the cache."""
+        return self.request_hits + self.shared_hits
+
+    @property
+    def shared_entries(self) -> int:
+        return len(self._shared)
+
+    def begin_request(self) -> None:
+        """Start a fresh identity scope for the current request."""
+        identity_scope_ctx.set({})
+
+    async def get_user(
+        self,
+        username: str,
+        loader: Callable[[str], Awaitable[Optional[UserInDB]]]
+    ) -> Optional[UserInDB]:
+        return await self._get(self.USER, username, loader)
+
+    async def get_role(
+        self,
+        username: str,
+        loader: Callable[[str], Awaitable[Optional[UserRole]]]
+    ) -> Optional[UserRole]:
+        return await self._get(self.ROLE, username, loader)
+
+    def invalidate(self, username: str) -> None:
+        """Drop every cached entry of a user, e.g. after a role change."""
+        scope = identity_scope_ctx.get()
+        for kind in (self.USER, self.ROLE):
+            self._shared.pop((kind, username), None)
+            if scope is not None:
+                scope.pop((kind, username), None)
+
+    def clear(self) -> None:
+        self._shared.clear()
+
+    async def _get(self, kind: str, username: str, loader: Callable[[str], Awaitable[Any]]) -> Any:
+        key = (kind, username)
+        scope = identity_scope_ctx.get()
+        if scope is not None and key in scope:
+            self.request_hits += 1
+            return scope[key]
+
+        value = self._get_shared(key)
+        if value is not None:
+            self.shared_hits += 1
+        else:
+            self.misses += 1
+            value = await loader(username)
+            if value is not None:
+                self._set_shared(key, value)
+
+        # Don't remember missing users, they may be created later in the request
+        if scope is not None and value is not None:
+            scope[key] = value
+        return value
+
+    def _get_shared(self, key: Tuple[str, str]) -> Any:
+        if self.ttl_seconds <= 0:
+            return None
+        entry = self._shared.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._shared.pop(key, None)
+            return None
+        # Hand out copies so one request can't mutate another request's identity
+        return value.model_copy()
+
+    def _set_shared(self, key: Tuple[str, str], value: Any) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        if len(self._shared) >= self.max_entries:
+            self._evict_expired()
+            if len(self._shared) >= self.max_entries:
+                # Still full, drop the oldest inserted entry
+                self._shared.pop(next(iter(self._shared)))
+        self._shared[key] = (time.monotonic() + self.ttl_seconds, value.model_copy())
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._shared.items() if expires_at < now]:
+            del self._shared[key]
+
+
+def get_identity_cache() -> IdentityCache:
+    return IdentityCache.get_instance()
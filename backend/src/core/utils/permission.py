@@ -6,6 +6,7 @@ import uuid
 from contextvars import ContextVar
 
 from .dependencies import user_session_ctx
+from .identity_cache import get_identity_cache
 from .decorator import create_decorator
 from ..constants.user_const import UserRole
 from ..config import APP_ENV
@@ -21,7 +22,7 @@ def worker_context():
     
     Example:
         with worker_context():
-            await subscription_service.get_overdue_subscriptions()
+            await subscription_service.expire_due_subscriptions()
     """
     token = worker_context_var.set(True)
     try:
@@ -76,13 +77,10 @@ async def check_permission(self: Any, args: list, kwargs: dict, allowed_roles: L
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Authorization check
-    from ..sql.operations import UserOperation
-    from ..container import AppContainer
-    user_opr: UserOperation = AppContainer.user_opr()
-    current_user_role = await user_opr.get_user_role(user_session_ctx.get().username)
+    # Authorization check, the role comes from the verified token claims
+    current_user_role = user_session_ctx.get().role
     
-    if not any(_get_role_value(role) == current_user_role.role_name for role in allowed_roles):
+    if not any(_get_role_value(role) == current_user_role for role in allowed_roles):
         raise exception_cls(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"Insufficient permissions. Required roles: {_format_role_list(allowed_roles)}",
@@ -119,12 +117,9 @@ async def check_instance_ownership(self: Any, args: list, kwargs: dict,
         )
     
     # Get user role - admin bypass ownership check
-    from ..sql.operations import UserOperation
-    from ..container import AppContainer
-    user_opr: UserOperation = AppContainer.user_opr()
-    current_user_role = await user_opr.get_user_role(user_session_ctx.get().username)
+    current_user_role = user_session_ctx.get().role
     
-    if _get_role_value(current_user_role.role_name) == _get_role_value(UserRole.ADMIN):
+    if _get_role_value(current_user_role) == _get_role_value(UserRole.ADMIN):
         return args, kwargs
     
     # Extract instance ID or name from arguments
@@ -139,6 +134,7 @@ async def check_instance_ownership(self: Any, args: list, kwargs: dict,
     
     # Check if user owns the instance
     from ..sql.operations import InstanceOperation
+    from ..container import AppContainer
     instance_opr: InstanceOperation = AppContainer.instance_opr()
     
     instance = None
@@ -208,16 +204,15 @@ async def check_account_ownership(self: Any, args: list, kwargs: dict,
         return args, kwargs
     
     # Check if user is admin
+    if _get_role_value(user_session_ctx.get().role) == _get_role_value(UserRole.ADMIN):
+        return args, kwargs
+    
     from ..sql.operations import UserOperation
     from ..container import AppContainer
     user_opr: UserOperation = AppContainer.user_opr()
-    current_user_role = await user_opr.get_user_role(current_username)
-    
-    if _get_role_value(current_user_role.role_name) == _get_role_value(UserRole.ADMIN):
-        return args, kwargs
     
     # Check if target user exists
-    user = await user_opr.get_user_by_username(username)
+    user = await get_identity_cache().get_user(username, user_opr.get_user_by_username)
     
     if user is None:
         raise exception_cls(
@@ -1,20 +1,51 @@
 from fastapi import Response, WebSocket
 from jose import jwt
 from datetime import datetime, timedelta
+from typing import Dict, Optional
 import secrets
+import time
+import uuid
 
 from ..config import TokenConfig
+from ..models.user import UserIdentity
 from .datetime import DateTimeUtils
 
+class TokenRevocationList:
+    """
+    Remembers users whose identity changed, so their older tokens stop being
+    trusted for claims. Entries only need to outlive the claims max age.
+
+    Revocations are kept per process. Other backend processes keep trusting
+    the claims until they are older than TokenConfig.CLAIMS_MAX_AGE_MINUTES,
+    which bounds how long a changed identity or role can still be used.
+    """
+    _revoked_at: Dict[str, float] = {}
+
+    @classmethod
+    def revoke(cls, username: str) -> None:
+        cls._prune()
+        cls._revoked_at[username] = time.time()
+
+    @classmethod
+    def is_revoked(cls, username: str, issued_at: float) -> bool:
+        revoked_at = cls._revoked_at.get(username)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    @classmethod
+    def _prune(cls) -> None:
+        oldest = time.time() - TokenConfig.CLAIMS_MAX_AGE_MINUTES * 60
+        for username in [u for u, revoked_at in cls._revoked_at.items() if revoked_at < oldest]:
+            del cls._revoked_at[username]
+
 class TokenUtils:
     @classmethod
-    def _generate_token(cls, data: dict, expires_delta: timedelta):
+    def _generate_token(cls, data: dict, expires_delta: timedelta, expires_at: Optional[datetime] = None):
         """Generate a JWT token."""
         to_encode = data.copy()
         now = DateTimeUtils.now_dt()
 
         to_encode.update({
-            "exp": now + expires_delta,
+            "exp": expires_at or now + expires_delta,
             "iat": now,
             "jti": secrets.token_hex(16),
             "iss": TokenConfig.ISSUER,
@@ -24,9 +55,9 @@ class TokenUtils:
         return jwt.encode(to_encode, TokenConfig.SECRET_KEY, algorithm=TokenConfig.ALGORITHM)
 
     @classmethod
-    def create_access_token(cls, data: dict):
-        """Create an access token."""
-        return cls._generate_token(data, timedelta(minutes=TokenConfig.ACCESS_TOKEN_EXPIRE_MINUTES))
+    def create_access_token(cls, data: dict, expires_at: Optional[datetime] = None):
+        """Create an access token, optionally keeping the expiry of the token it replaces."""
+        return cls._generate_token(data, timedelta(minutes=TokenConfig.ACCESS_TOKEN_EXPIRE_MINUTES), expires_at)
 
     @classmethod
     def create_refresh_token(cls, data: dict):
@@ -34,12 +65,40 @@ class TokenUtils:
         return cls._generate_token(data, timedelta(days=TokenConfig.REFRESH_TOKEN_EXPIRE_DAYS))
 
     @classmethod
-    def set_secure_cookie(cls, response: Response, token: str, token_type: str):
-        """Set a secure, HTTP-only cookie."""
-        max_age = (
-            TokenConfig.ACCESS_TOKEN_EXPIRE_MINUTES * 60 if token_type == "access"
-            else TokenConfig.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    def identity_claims(cls, identity: UserIdentity) -> dict:
+        """Claims that let authenticated requests skip the users table."""
+        return {
+            "sub": identity.username,
+            "email": identity.email,
+            "uid": str(identity.user_id),
+            "role": identity.role
+        }
+
+    @classmethod
+    def get_identity_from_claims(cls, payload: dict) -> Optional[UserIdentity]:
+        """Build the identity from validated claims, or None if they are missing, stale or revoked."""
+        if not all(payload.get(claim) for claim in ("sub", "email", "uid", "role", "iat")):
+            return None
+        issued_at = payload["iat"]
+        if time.time() - issued_at > TokenConfig.CLAIMS_MAX_AGE_MINUTES * 60:
+            return None
+        if TokenRevocationList.is_revoked(payload["sub"], issued_at):
+            return None
+        return UserIdentity(
+            user_id=uuid.UUID(payload["uid"]),
+            username=payload["sub"],
+            email=payload["email"],
+            role=payload["role"]
         )
+
+    @classmethod
+    def set_secure_cookie(cls, response: Response, token: str, token_type: str, max_age: Optional[int] = None):
+        """Set a secure, HTTP-only cookie."""
+        if max_age is None:
+            max_age = (
+                TokenConfig.ACCESS_TOKEN_EXPIRE_MINUTES * 60 if token_type == "access"
+                else TokenConfig.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+            )
         response.set_cookie(
             key=f"{token_type}_token",
             value=token,
@@ -61,4 +120,4 @@ class TokenUtils:
                 audience=TokenConfig.AUDIENCE
             )
         except Exception as e:
-            return None
\ No newline at end of file
+            return None
@@ -1,55 +1,229 @@
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Optional, Set
+import asyncio
+
 from fastapi import Depends
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, JobExecutionEvent
 from apscheduler.triggers.interval import IntervalTrigger
 
 from ..service.subscription import SubscriptionService
+from ..service.billing import BillingService
+from ..service.instance import InstanceService
 from ..utils.logging import logger
 from ..config import BillingConfig
 from ..utils.permission import worker_context
+from ..utils.datetime import DateTimeUtils
+from .leader import LeaderElection
+from .notifications import NotificationListener
+from ..service.helpers.settlement import SettlementHistory
 
 
 class BillingWorker:
+    """
+    Runs the billing jobs in the process that leads the billing worker.
+
+    Overdue and expired subscriptions are handled at their deadline: after every
+    run the next due payment and expiry are looked up and the job is moved to
+    that moment, and subscription changes notify the leader when they bring a
+    deadline forward. Containers of expired instances are deleted by a job of
+    their own, so a slow one never holds up the expiry. The interval triggers
+    are only a safety net.
+    """
+    OVERDUE_JOB = "overdue_subscriptions_job"
+    EXPIRED_JOB = "expired_subscriptions_job"
+    TEARDOWN_JOB = "instance_teardown_job"
+
     def __init__(
         self,
-        subscription_service: SubscriptionService
+        subscription_service: SubscriptionService,
+        billing_service: BillingService,
+        instance_service: InstanceService,
+        leader: LeaderElection,
+        settlement_history: SettlementHistory,
+        deadline_listener: NotificationListener
     ):
         self.subscription_service = subscription_service
+        self.billing_service = billing_service
+        self.instance_service = instance_service
+        self.leader = leader
+        self.settlement_history = settlement_history
+        self.deadline_listener = deadline_listener
         self.scheduler = AsyncIOScheduler()
+        self.deadline_queries = 0
+        # Milliseconds between a deadline and the start of its run, per job
+        self.lateness_ms: Dict[str, Deque[float]] = {
+            job_id: deque(maxlen=BillingConfig.DEADLINE_HISTORY)
+            for job_id in (self.OVERDUE_JOB, self.EXPIRED_JOB, self.TEARDOWN_JOB)
+        }
+        self._deadlines: Dict[str, datetime] = {}
+        self._started: Dict[str, datetime] = {}
+        # Jobs whose last run left work that was already due, e.g. a full teardown batch or a resumed settlement run
+        self._backlog: Set[str] = set()
+        self._deadline_lock = asyncio.Lock()
+        self._deadline_tasks: Set[asyncio.Task] = set()
         self._is_running = False
     
     @property
     def is_running(self):
         return self._is_running
 
+    @property
+    def is_leader(self):
+        return self.leader.is_leader
+
+    @property
+    def next_runs(self) -> Dict[str, Optional[datetime]]:
+        return {job.id: job.next_run_time for job in self.scheduler.get_jobs()}
+
+    async def _resume_jobs(self):
+        self.scheduler.resume()
+        # Connecting looks the deadlines up, whatever the previous leader left behind
+        self.deadline_listener.start(on_notify=self._deadline_notified, on_connected=self.schedule_deadlines)
+        logger.info("Billing jobs resumed, this process leads the billing worker")
+
+    async def _pause_jobs(self):
+        # Runs in progress finish, no new ones start until this process leads again
+        self.scheduler.pause()
+        await self.deadline_listener.stop()
+        logger.info("Billing jobs paused until this process leads the billing worker again")
+
+    async def schedule_deadlines(self):
+        """Move the jobs forward to the next payment, expiry and container teardown deadlines."""
+        try:
+            # One lookup at a time, a later one may have been notified of a deadline an earlier one missed
+            async with self._deadline_lock:
+                with worker_context():
+                    next_payment, next_expire = await self.subscription_service.get_next_deadlines()
+                    next_teardown = await self.instance_service.get_next_teardown_at()
+                self.deadline_queries += 1
+                self._run_at(self.OVERDUE_JOB, next_payment)
+                self._run_at(self.EXPIRED_JOB, next_expire)
+                self._run_at(self.TEARDOWN_JOB, next_teardown)
+        except Exception as e:
+            logger.error(f"Error scheduling billing deadlines: {str(e)}")
+
+    def _run_at(self, job_id: str, deadline: Optional[datetime]):
+        job = self.scheduler.get_job(job_id)
+        if job is None or deadline is None:
+            return
+        # Was due when the job last ran and is still there, a payment or expiry that failed
+        # waits for the interval instead of spinning the job
+        if job_id not in self._backlog and job_id in self._started and deadline < self._started[job_id]:
+            return
+        self._backlog.discard(job_id)
+        if job.next_run_time is not None and job.next_run_time <= deadline:
+            return
+        job.modify(next_run_time=max(deadline, DateTimeUtils.now_dt()))
+        self._deadlines[job_id] = deadline
+
+    def _deadline_notified(self, payload: str):
+        next_payment, next_expire = (datetime.fromisoformat(value) for value in payload.split(" "))
+        next_runs = self.next_runs
+        # Deadlines after the next runs are looked up by those runs, nothing to do now
+        if any(
+            next_runs.get(job_id) is None or deadline < next_runs[job_id]
+            for job_id, deadline in ((self.OVERDUE_JOB, next_payment), (self.EXPIRED_JOB, next_expire))
+        ):
+            self._schedule_deadlines_soon()
+
+    def _job_finished(self, event: JobExecutionEvent):
+        # After the run is counted as finished, a job moved to now from within itself would be skipped
+        if event.job_id in self.lateness_ms:
+            self._schedule_deadlines_soon()
+
+    def _schedule_deadlines_soon(self):
+        task = asyncio.create_task(self.schedule_deadlines())
+        self._deadline_tasks.add(task)
+        task.add_done_callback(self._deadline_tasks.discard)
+
+    def _job_started(self, job_id: str):
+        now = DateTimeUtils.now_dt()
+        self._started[job_id] = now
+        deadline = self._deadlines.pop(job_id, None)
+        if deadline is not None:
+            self.lateness_ms[job_id].append(round((now - deadline).total_seconds() * 1000, 3))
+
     async def overdue_subscriptions_job(self):
-        """Process all overdue subscriptions by attempting to bill them again."""
+        """Settle all due and overdue subscription payments, in bulk or through the settlement pipeline."""
+        self._job_started(self.OVERDUE_JOB)
         try:
             # Use worker context to bypass normal authentication
             with worker_context():
-                overdues = await self.subscription_service.get_overdue_subscriptions()
-                if not overdues:
-                    logger.info("No overdue subscriptions found")
-                    return
-                await self.subscription_service.process_overdue_subscriptions(overdues)
-                logger.info("Finished processing overdue subscriptions")
+                run = await self.subscription_service.settle_due_subscriptions_in_chunks()
+            if run.started_at < self._started[self.OVERDUE_JOB]:
+                # Resumed a checkpoint and only settled what was due by then, the rest may be due already
+                self._backlog.add(self.OVERDUE_JOB)
+            if not run.processed:
+                logger.info("No overdue subscriptions found")
+                return
+            self.settlement_history.record(run)
+            logger.info(
+                f"Settled {run.processed} subscription payments of {run.users} users ({run.mode}) in "
+                f"{run.duration_ms:.0f} ms, {run.per_second:.0f}/s: {run.paid} paid, {run.unpaid} unpaid, "
+                f"{run.failed} failed, {run.retries} retries"
+            )
+            for failure in run.failures:
+                logger.error(
+                    f"Failed to process transaction({failure.transaction_id}) after {failure.attempts} attempts: {failure.error}"
+                )
         except Exception as e:
             logger.error(f"Error processing overdue subscriptions: {str(e)}")
 
     async def expired_subscriptions_job(self):
-        """Process all expired subscriptions by applying penalties."""
+        """Expire all overdue subscriptions past their expiry date, queueing their instances for teardown."""
+        self._job_started(self.EXPIRED_JOB)
         try:
-            logger.info("Processing expired subscriptions")
             # Use worker context to bypass normal authentication
             with worker_context():
-                expireds = await self.subscription_service.get_expired_subscriptions()
-                if not expireds:
-                    logger.info("No expired subscriptions found")
-                    return
-                await self.subscription_service.process_expired_subscriptions(expired_subscriptions=expireds)
-                logger.info("Finished processing expired subscriptions")
+                result = await self.subscription_service.expire_due_subscriptions()
+            if not result.expired:
+                logger.info("No expired subscriptions found")
+                return
+            logger.info(f"Expired {result.expired} subscriptions, {result.queued} instances queued for teardown")
         except Exception as e:
             logger.error(f"Error processing expired subscriptions: {str(e)}")
 
+    async def instance_teardown_job(self):
+        """Delete the containers of expired instances, retrying the ones that fail later."""
+        self._job_started(self.TEARDOWN_JOB)
+        try:
+            with worker_context():
+                run = await self.instance_service.process_instance_teardowns()
+            if run.attempted == BillingConfig.TEARDOWN_BATCH_SIZE:
+                # The rest of the queue is already due
+                self._backlog.add(self.TEARDOWN_JOB)
+            if run.attempted:
+                logger.info(
+                    f"Deleted {run.deleted} of {run.attempted} expired instance containers in "
+                    f"{run.duration_ms:.0f} ms, {run.failed} failed, {run.given_up} given up"
+                )
+        except Exception as e:
+            logger.error(f"Error tearing down expired instances: {str(e)}")
+
+    async def billing_summary_repair_job(self):
+        """Recompute billing summaries and report the ones that had drifted."""
+        try:
+            with worker_context():
+                repaired = await self.billing_service.repair_billing_summaries()
+            if repaired:
+                logger.warning(f"Repaired {repaired} drifted billing summaries")
+            else:
+                logger.info("Billing summaries are consistent")
+        except Exception as e:
+            logger.error(f"Error repairing billing summaries: {str(e)}")
+
+    async def billing_rollup_fold_job(self):
+        """Fold the billing rollup deltas into the hourly buckets."""
+        try:
+            with worker_context():
+                folded = await self.billing_service.fold_billing_rollup()
+            if folded:
+                logger.info(f"Folded {folded} billing rollup deltas")
+        except Exception as e:
+            logger.error(f"Error folding billing rollup deltas: {str(e)}")
+
     def start(self):
         """Start the billing worker with scheduled jobs."""
         if self._is_running:
@@ -57,40 +231,82 @@ class BillingWorker:
             return
 
         try:
-            # Schedule job to process overdue subscriptions
+            # Schedule job to process overdue subscriptions, moved forward to every payment deadline.
+            # Deadlines that passed while paused or busy still run once
             self.scheduler.add_job(
                 self.overdue_subscriptions_job,
                 trigger=IntervalTrigger(minutes=BillingConfig.OVERDUE_CHECK_INTERVAL_MINUTES),
-                id="overdue_subscriptions_job",
-                misfire_grace_time=5,
+                id=self.OVERDUE_JOB,
+                misfire_grace_time=None,
+                coalesce=True,
                 max_instances=BillingConfig.OVERDUE_MAX_INSTANCES,
                 replace_existing=True
             )
 
-            # Schedule job to process expired subscriptions
+            # Schedule job to process expired subscriptions, moved forward to every expiry deadline
             self.scheduler.add_job(
                 self.expired_subscriptions_job,
                 trigger=IntervalTrigger(minutes=BillingConfig.EXPIRE_CHECK_INTERVAL_MINUTES),
-                id="expired_subscriptions_job",
-                misfire_grace_time=5,
+                id=self.EXPIRED_JOB,
+                misfire_grace_time=None,
+                coalesce=True,
                 max_instances=BillingConfig.EXPIRE_MAX_INSTANCES,
                 replace_existing=True
             )
 
-            # Start the scheduler
-            self.scheduler.start()
+            # Schedule job to delete containers of expired instances, moved forward whenever some are queued
+            self.scheduler.add_job(
+                self.instance_teardown_job,
+                trigger=IntervalTrigger(minutes=BillingConfig.TEARDOWN_CHECK_INTERVAL_MINUTES),
+                id=self.TEARDOWN_JOB,
+                misfire_grace_time=None,
+                coalesce=True,
+                max_instances=1,
+                replace_existing=True
+            )
+
+            # Schedule job to repair drifted billing summaries
+            self.scheduler.add_job(
+                self.billing_summary_repair_job,
+                trigger=IntervalTrigger(minutes=BillingConfig.SUMMARY_REPAIR_INTERVAL_MINUTES),
+                id="billing_summary_repair_job",
+                misfire_grace_time=60,
+                max_instances=1,
+                replace_existing=True
+            )
+
+            # Schedule job to fold the billing rollup deltas
+            self.scheduler.add_job(
+                self.billing_rollup_fold_job,
+                trigger=IntervalTrigger(seconds=BillingConfig.ROLLUP_FOLD_INTERVAL_SECONDS),
+                id="billing_rollup_fold_job",
+                misfire_grace_time=60,
+                coalesce=True,
+                max_instances=1,
+                replace_existing=True
+            )
+
+            # Every billing run looks up the next deadlines once it is done: paid payments scheduled
+            # their next one, unpaid ones started towards expiry and expiries queued teardowns
+            self.scheduler.add_listener(self._job_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+            # Jobs only run while this process holds the leader lock
+            self.scheduler.start(paused=True)
+            self.leader.start(on_elected=self._resume_jobs, on_demoted=self._pause_jobs)
             self._is_running = True
             logger.info("Billing worker started successfully")
         except Exception as e:
             logger.error(f"Failed to start billing worker: {str(e)}")
 
-    def stop(self):
-        """Stop the billing worker."""
+    async def stop(self):
+        """Stop the billing worker and hand leadership to another process."""
         if not self._is_running:
             logger.warning("Billing worker is not running")
             return
 
         try:
+            await self.leader.stop()
+            await self.deadline_listener.close()
             self.scheduler.shutdown()
             self._is_running = False
             logger.info("Billing worker stopped successfully")
@@ -0,0 +1,173 @@
+"""
+Leader election over a Postgres session advisory lock.
+
+Every process polls pg_try_advisory_lock on its own connection, the one that
+gets the lock is the leader until that connection goes away. Postgres releases
+the lock when the session ends, so a crashed leader is replaced within one poll
+interval (plus the TCP keepalive timeout when its host vanished). A leader that
+can't heartbeat its connection steps down before the server gives up on it.
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Optional
+import asyncio
+import os
+import socket
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from ..utils.datetime import DateTimeUtils
+from ..utils.logging import logger
+
+
+@dataclass
+class LeaderHandoff:
+    at: datetime
+    # Since the previous leader was last seen holding the lock, at most one poll interval after it let go
+    wait_ms: Optional[float]
+    previous_leader: Optional[str]
+
+
+class LeaderElection:
+    # Handoffs kept for the status endpoint
+    HANDOFF_HISTORY = 20
+
+    def __init__(
+        self,
+        name: str,
+        db_url: str,
+        lock_key: int,
+        check_interval: float
+    ):
+        self.name = name
+        self.lock_key = int(lock_key)
+        self.check_interval = check_interval
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self.engine = create_async_engine(
+            db_url,
+            # The lock lives as long as its connection, it must never go back to a pool
+            poolclass=NullPool,
+            connect_args={"server_settings": {
+                # Lets other processes see who leads
+                "application_name": f"{name}:{self.identity}"[:63],
+                # Lets the server end the session, and release the lock, when the leader's host dies
+                "tcp_keepalives_idle": "5",
+                "tcp_keepalives_interval": "2",
+                "tcp_keepalives_count": "3",
+            }},
+        )
+        self.is_leader = False
+        self.leader_since: Optional[datetime] = None
+        self.leader_identity: Optional[str] = None
+        self.elections = 0
+        self.demotions = 0
+        self.last_error: Optional[str] = None
+        self.handoffs: Deque[LeaderHandoff] = deque(maxlen=self.HANDOFF_HISTORY)
+        self._connection: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._other_leader_seen_at: Optional[float] = None
+        self._on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self._on_demoted: Optional[Callable[[], Awaitable[None]]] = None
+
+    def start(self, on_elected: Callable[[], Awaitable[None]], on_demoted: Callable[[], Awaitable[None]]):
+        """Campaign in the background, the callbacks run whenever this process gains or loses leadership."""
+        if self._task is None:
+            self._on_elected = on_elected
+            self._on_demoted = on_demoted
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-leader-election")
+
+    async def stop(self):
+        """Step down and release the lock right away, so a follower takes over on its next poll."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            try:
+                await self._connection.execute(text(f"SELECT pg_advisory_unlock({self.lock_key})"))
+            except Exception as e:
+                self.last_error = str(e)
+            await self._demote("shutting down")
+        await self._disconnect()
+        await self.engine.dispose()
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_leader:
+                    await self._heartbeat()
+                else:
+                    await self._try_acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"{self.name} leader election failed: {self.last_error}")
+                if self.is_leader:
+                    await self._demote("lost its database connection")
+                await self._disconnect()
+            await asyncio.sleep(self.check_interval)
+
+    async def _connect(self) -> AsyncConnection:
+        if self._connection is None:
+            connection = await self.engine.connect()
+            # Session lock and heartbeats, no transaction held open between them
+            self._connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        return self._connection
+
+    async def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception:
+                # The connection is gone anyway, and the lock with it
+                await connection.invalidate()
+
+    async def _try_acquire(self):
+        connection = await self._connect()
+        row = (await asyncio.wait_for(connection.execute(text(
+            f"SELECT pg_try_advisory_lock({self.lock_key}) AS acquired, "
+            "(SELECT a.application_name FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid "
+            f"WHERE l.locktype = 'advisory' AND l.granted AND l.objsubid = 1 "
+            f"AND l.classid = ({self.lock_key} >> 32)::oid "
+            f"AND l.objid = ({self.lock_key} & 4294967295)::oid) AS holder"
+        )), timeout=self.check_interval * 3)).one()
+        if not row.acquired:
+            self.leader_identity = row.holder
+            self._other_leader_seen_at = time.monotonic()
+            return
+
+        now = time.monotonic()
+        self.handoffs.append(LeaderHandoff(
+            at=DateTimeUtils.now_dt(),
+            wait_ms=round((now - self._other_leader_seen_at) * 1000, 3) if self._other_leader_seen_at else None,
+            previous_leader=self.leader_identity
+        ))
+        self.is_leader = True
+        self.leader_since = DateTimeUtils.now_dt()
+        self.leader_identity = f"{self.name}:{self.identity}"
+        self.elections += 1
+        self._other_leader_seen_at = None
+        logger.info(f"{self.identity} became the {self.name} leader")
+        await self._on_elected()
+
+    async def _heartbeat(self):
+        connection = await self._connect()
+        # Step down before the server's keepalives give the lock to another process
+        await asyncio.wait_for(connection.execute(text("SELECT 1")), timeout=self.check_interval * 3)
+
+    async def _demote(self, reason: str):
+        self.is_leader = False
+        self.leader_since = None
+        self.leader_identity = None
+        self.demotions += 1
+        logger.warning(f"{self.identity} stepped down as the {self.name} leader, {reason}")
+        await self._on_demoted()
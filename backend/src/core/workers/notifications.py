@@ -0,0 +1,95 @@
+"""
+Postgres LISTEN on a connection of its own.
+
+NOTIFY is delivered when the notifying transaction commits, so listeners only
+hear about rows they can already read. LISTEN needs a session on the database
+itself, through PgBouncer in transaction mode it would never hear anything.
+Notifications sent while the connection is down are lost, on_connected runs
+after every (re)connect so the caller can catch up on what it missed.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from ..utils.logging import logger
+
+
+class NotificationListener:
+    def __init__(self, name: str, db_url: str, channel: str, reconnect_interval: float):
+        self.name = name
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.engine = create_async_engine(
+            db_url,
+            # LISTEN belongs to its session, the connection must never go back to a pool
+            poolclass=NullPool,
+            connect_args={"server_settings": {"application_name": name[:63]}},
+        )
+        self.is_listening = False
+        self.notifications = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self._connection: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._on_notify: Optional[Callable[[str], None]] = None
+        self._on_connected: Optional[Callable[[], Awaitable[None]]] = None
+
+    def start(self, on_notify: Callable[[str], None], on_connected: Callable[[], Awaitable[None]]):
+        """Listen in the background, on_notify gets every payload from the event loop."""
+        if self._task is None:
+            self._on_notify = on_notify
+            self._on_connected = on_connected
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-listener")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    async def close(self):
+        await self.stop()
+        await self.engine.dispose()
+
+    async def _run(self):
+        while True:
+            try:
+                lost = asyncio.Event()
+                self._connection = await self.engine.connect()
+                driver_connection = (await self._connection.get_raw_connection()).driver_connection
+                driver_connection.add_termination_listener(lambda _: lost.set())
+                await driver_connection.add_listener(self.channel, self._notified)
+                self.is_listening = True
+                await self._on_connected()
+                await lost.wait()
+                raise ConnectionError("connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"{self.name} stopped listening on {self.channel}: {self.last_error}")
+            await self._disconnect()
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_interval)
+
+    def _notified(self, connection, pid: int, channel: str, payload: str):
+        self.notifications += 1
+        try:
+            self._on_notify(payload)
+        except Exception as e:
+            logger.error(f"{self.name} failed to handle a notification on {channel}: {str(e)}")
+
+    async def _disconnect(self):
+        self.is_listening = False
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception:
+                await connection.invalidate()
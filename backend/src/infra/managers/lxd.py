@@ -84,6 +84,13 @@ class LXDManager:
         except exceptions.LXDAPIException as e:
             raise LXDManagerException(f"Failed to get container {name}: {str(e)}")
     
+    @_ensure_connected()
+    def container_exists(self, name: str) -> bool:
+        try:
+            return self.client.instances.exists(name)
+        except exceptions.LXDAPIException as e:
+            raise LXDManagerException(f"Failed to check container {name}: {str(e)}")
+    
     @_ensure_connected()
     def create_container(self, instance_create_config: dict) -> models.Instance:
         try:
@@ -0,0 +1,101 @@
+"""
+Fixtures for the backend tests that run against a real database.
+
+The tests use the test database (APP_ENV=test), which is dropped and migrated
+once per session, and are skipped when it can't be reached.
+"""
+import os
+import uuid
+from datetime import datetime
+
+os.environ.setdefault("APP_ENV", "test")
+
+import pytest
+from sqlalchemy import text
+
+from src.core.container import AppContainer
+from src.core.models.instance import UserInstance
+from src.core.models.subscription import UserSubscription
+from src.core.models.user import UserInDB, UserWallet
+from src.core.sql.database import get_db_manager
+from src.core.sql.init_data import initialize_data
+from src.core.sql.migrations import run_migrations
+from src.core.utils.datetime import DateTimeUtils
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def database(anyio_backend):
+    """Migrated and seeded test database, shared by the whole session."""
+    db_manager = get_db_manager()
+    try:
+        async with db_manager.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    except Exception as e:
+        pytest.skip(f"Test database is not reachable: {str(e)}")
+
+    await db_manager.drop_all()
+    await run_migrations()
+    await initialize_data()
+    yield db_manager
+    await db_manager.close()
+
+
+@pytest.fixture
+def container(database) -> AppContainer:
+    return AppContainer()
+
+
+@pytest.fixture
+async def create_user(container: AppContainer):
+    """Create a user with a wallet, usernames are unique per call."""
+    user_opr = container.user_opr()
+
+    async def _create_user(balance: float = 0.0) -> UserInDB:
+        name = f"user_{uuid.uuid4().hex[:12]}"
+        user = await user_opr.upsert_user(UserInDB(
+            username=name,
+            email=f"{name}@example.com",
+            password_hash="not-a-real-hash",
+            last_updated_at=DateTimeUtils.now_dt()
+        ))
+        await user_opr.upsert_user_wallet(UserWallet(
+            user_id=user.user_id,
+            balance=balance,
+            last_updated_at=DateTimeUtils.now_dt()
+        ))
+        return user
+
+    return _create_user
+
+
+@pytest.fixture
+async def create_subscription(container: AppContainer):
+    """Create an instance of the user with a subscription on the first plan and OS type."""
+    instance_opr = container.instance_opr()
+    subscription_opr = container.subscription_opr()
+
+    async def _create_subscription(
+        user: UserInDB,
+        next_payment_date: datetime,
+        next_expire_date: datetime
+    ) -> UserSubscription:
+        plan = (await instance_opr.get_all_instance_plans())[0]
+        os_type = (await instance_opr.get_all_os_types())[0]
+        instance = await instance_opr.upsert_user_instance(UserInstance(
+            user_id=user.user_id,
+            instance_plan_id=plan.instance_plan_id,
+            os_type_id=os_type.os_type_id,
+            hostname=f"instance-{uuid.uuid4().hex[:12]}",
+            lxd_node_name="test",
+            status="Running",
+            created_at=DateTimeUtils.now_dt(),
+            last_updated_at=DateTimeUtils.now_dt()
+        ))
+        return await subscription_opr.upsert_subscription(instance.instance_id, next_payment_date, next_expire_date)
+
+    return _create_subscription
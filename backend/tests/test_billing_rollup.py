@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from src.core.config import BillingConfig
+from src.core.constants.transaction_const import TransactionStatus, TransactionType
+from src.core.models.transaction import Transaction
+from src.core.sql.maintenance import billing_rollup
+from src.core.sql.tables.billing_rollup_delta import BillingRollupDelta
+from src.core.utils.datetime import DateTimeUtils
+
+pytestmark = pytest.mark.anyio
+
+
+async def _top_up(transaction_opr, user, amount):
+    created_at = DateTimeUtils.now_dt()
+    return await transaction_opr.upsert_transaction(Transaction(
+        user_id=user.user_id,
+        reference_id=f"topup_rollup_{user.username}_{amount}",
+        transaction_type=TransactionType.TOP_UP,
+        transaction_status=TransactionStatus.SUCCESS,
+        amount=amount,
+        created_at=created_at,
+        last_updated_at=created_at
+    ))
+
+
+async def _pending_deltas(db_manager) -> int:
+    async with db_manager.session() as db:
+        return (await db.execute(select(func.count()).select_from(BillingRollupDelta))).scalar_one()
+
+
+async def test_writes_append_deltas_that_fold_into_the_rollup(database, container, create_user):
+    user = await create_user()
+    transaction_opr = container.transaction_opr()
+    billing_opr = container.billing_opr()
+    await billing_opr.fold_billing_rollup_deltas()
+
+    created_at = DateTimeUtils.now_dt() - timedelta(hours=3)
+    transaction = await transaction_opr.upsert_transaction(Transaction(
+        user_id=user.user_id,
+        reference_id=f"topup_rollup_{user.username}",
+        transaction_type=TransactionType.TOP_UP,
+        transaction_status=TransactionStatus.PENDING,
+        amount=25.0,
+        created_at=created_at,
+        last_updated_at=created_at
+    ))
+    transaction.transaction_status = TransactionStatus.SUCCESS
+    await transaction_opr.upsert_transaction(transaction)
+    # The insert, then the status change out of PENDING and into SUCCESS
+    assert await _pending_deltas(database) == 3
+
+    # Stats add the pending deltas, so they are exact before the fold
+    async with database.connect() as connection:
+        assert await billing_rollup.find_mismatches(connection) == []
+
+    assert await billing_opr.fold_billing_rollup_deltas(batch_size=2) == 3
+    assert await _pending_deltas(database) == 0
+    async with database.connect() as connection:
+        assert await billing_rollup.find_mismatches(connection) == []
+
+
+async def test_billing_stats_fold_the_deltas_past_the_threshold(database, container, create_user, monkeypatch):
+    monkeypatch.setattr(BillingConfig, "ROLLUP_FOLD_ON_READ_THRESHOLD", 2)
+    user = await create_user()
+    transaction_opr = container.transaction_opr()
+    billing_opr = container.billing_opr()
+    await billing_opr.fold_billing_rollup_deltas()
+
+    for amount in (1.0, 2.0):
+        await _top_up(transaction_opr, user, amount)
+    await billing_opr.get_billing_stats_by_date_range(is_alltime=True)
+    # Not past the threshold yet, left to the worker
+    assert await _pending_deltas(database) == 2
+
+    await _top_up(transaction_opr, user, 3.0)
+    await billing_opr.get_billing_stats_by_date_range(is_alltime=True)
+    assert await _pending_deltas(database) == 0
+    async with database.connect() as connection:
+        assert await billing_rollup.find_mismatches(connection) == []
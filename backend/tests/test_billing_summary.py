@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+
+from src.core.constants.transaction_const import TransactionStatus, TransactionType
+from src.core.models.transaction import Transaction
+from src.core.sql.operations.billing import user_billing_summary_select
+from src.core.sql.tables.user_billing_summary import UserBillingSummary
+from src.core.utils.datetime import DateTimeUtils
+
+pytestmark = pytest.mark.anyio
+
+SUMMARY_COLUMNS = (
+    "total_subscription", "upcoming_amount", "earliest_due_date",
+    "all_time_amount", "all_time_cycles", "last_payment_date"
+)
+
+
+async def _assert_summary_matches(db_manager, user_id):
+    """The summary the deltas built equals the one recomputed from scratch."""
+    async with db_manager.session() as db:
+        summary = (await db.execute(
+            select(UserBillingSummary).where(UserBillingSummary.user_id == user_id)
+        )).scalar_one()
+        computed = (await db.execute(user_billing_summary_select([user_id]))).one()
+    for column in SUMMARY_COLUMNS:
+        assert getattr(summary, column) == getattr(computed, column), column
+    return summary
+
+
+async def test_writes_apply_deltas_to_the_billing_summary(database, container, create_user, create_subscription):
+    user = await create_user()
+    transaction_opr = container.transaction_opr()
+    subscription_opr = container.subscription_opr()
+    now = DateTimeUtils.now_dt()
+
+    subscription = await create_subscription(user, now + timedelta(days=30), now + timedelta(days=37))
+    later = await create_subscription(user, now + timedelta(days=60), now + timedelta(days=67))
+    summary = await _assert_summary_matches(database, user.user_id)
+    assert summary.total_subscription == 2
+
+    # Rescheduling doesn't count the subscription again
+    await subscription_opr.upsert_subscription(subscription.instance_id, now + timedelta(days=90), now + timedelta(days=97))
+    summary = await _assert_summary_matches(database, user.user_id)
+    assert summary.total_subscription == 2
+    assert summary.earliest_due_date == later.next_payment_date
+
+    payment = await transaction_opr.upsert_transaction(Transaction(
+        user_id=user.user_id,
+        reference_id=f"subscription_{subscription.subscription_id}",
+        subscription_id=subscription.subscription_id,
+        transaction_type=TransactionType.SUBSCRIPTION_PAYMENT,
+        transaction_status=TransactionStatus.SCHEDULED,
+        amount=12.5,
+        created_at=now,
+        last_updated_at=now
+    ))
+    summary = await _assert_summary_matches(database, user.user_id)
+    assert summary.upcoming_amount == 12.5
+
+    payment.transaction_status = TransactionStatus.PAID
+    await transaction_opr.upsert_transaction(payment)
+    summary = await _assert_summary_matches(database, user.user_id)
+    assert (summary.upcoming_amount, summary.all_time_amount, summary.all_time_cycles) == (0.0, 12.5, 1)
+
+    payment.transaction_id = None
+    payment.transaction_status = TransactionStatus.SCHEDULED
+    await transaction_opr.upsert_transaction(payment)
+    await transaction_opr.delete_subscription_transaction(subscription_id=subscription.subscription_id)
+    await subscription_opr.delete_subscription(subscription_id=later.subscription_id)
+    summary = await _assert_summary_matches(database, user.user_id)
+    assert (summary.total_subscription, summary.upcoming_amount) == (1, 0.0)
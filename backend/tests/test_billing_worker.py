@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from src.core.service.helpers.settlement import SettlementHistory, settlement_run
+from src.core.utils.datetime import DateTimeUtils
+from src.core.workers.billing import BillingWorker
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSubscriptionService:
+    """Settles nothing, in a run resumed from the given time or started now."""
+
+    def __init__(self, resumed_from=None):
+        self.resumed_from = resumed_from
+
+    async def settle_due_subscriptions_in_chunks(self):
+        run_started_at = self.resumed_from or DateTimeUtils.now_dt()
+        return settlement_run("bulk", run_started_at, time.perf_counter(), users=0, processed=0, paid=0)
+
+
+async def _run_overdue_job(resumed_from=None) -> BillingWorker:
+    worker = BillingWorker(FakeSubscriptionService(resumed_from), None, None, None, SettlementHistory(), None)
+    worker.scheduler.add_job(worker.overdue_subscriptions_job, "interval", minutes=15, id=BillingWorker.OVERDUE_JOB)
+    worker.scheduler.start(paused=True)
+    await worker.overdue_subscriptions_job()
+    return worker
+
+
+async def test_resumed_settlement_run_moves_the_job_to_deadlines_it_missed():
+    # The checkpoint's run started before this one, deadlines since then were left for the next run
+    worker = await _run_overdue_job(DateTimeUtils.now_dt() - timedelta(hours=1))
+    try:
+        missed = DateTimeUtils.now_dt() - timedelta(minutes=30)
+        worker._run_at(BillingWorker.OVERDUE_JOB, missed)
+
+        assert worker._deadlines[BillingWorker.OVERDUE_JOB] == missed
+        assert BillingWorker.OVERDUE_JOB not in worker._backlog
+    finally:
+        worker.scheduler.shutdown(wait=False)
+
+
+async def test_fresh_settlement_run_leaves_deadlines_it_saw_to_the_interval():
+    worker = await _run_overdue_job()
+    try:
+        # Was due when the run started, so the run failed to settle it
+        worker._run_at(BillingWorker.OVERDUE_JOB, DateTimeUtils.now_dt() - timedelta(minutes=30))
+
+        assert BillingWorker.OVERDUE_JOB not in worker._deadlines
+    finally:
+        worker.scheduler.shutdown(wait=False)
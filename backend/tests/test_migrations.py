@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from src.core.sql.migrations.versions import seed_markers
+from src.core.utils.datetime import DateTimeUtils
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_seed_markers_merges_duplicate_os_types(database, create_user, create_subscription):
+    now = DateTimeUtils.now_dt()
+    subscription = await create_subscription(await create_user(), now + timedelta(days=30), now + timedelta(days=37))
+    params = {"instance_id": subscription.instance_id}
+
+    async with database.connect_autocommit() as connection:
+        # Back to before the unique index, with an instance on a second row of its image
+        await connection.execute(text("DROP INDEX uq_os_types_image"))
+        kept = (await connection.execute(text(
+            "SELECT os_type_id FROM user_instances WHERE instance_id = :instance_id"
+        ), params)).scalar_one()
+        duplicate = (await connection.execute(text(
+            "INSERT INTO os_types (os_image_name, os_image_version) "
+            "SELECT os_image_name, os_image_version FROM os_types WHERE os_type_id = :kept "
+            "RETURNING os_type_id"
+        ), {"kept": kept})).scalar_one()
+        await connection.execute(text(
+            "UPDATE user_instances SET os_type_id = :duplicate WHERE instance_id = :instance_id"
+        ), {**params, "duplicate": duplicate})
+
+        await seed_markers(connection)
+
+        assert (await connection.execute(text(
+            "SELECT os_type_id FROM user_instances WHERE instance_id = :instance_id"
+        ), params)).scalar_one() == kept
+        assert (await connection.execute(text(
+            "SELECT count(*) FROM os_types WHERE os_type_id = :duplicate"
+        ), {"duplicate": duplicate})).scalar_one() == 0
+        assert (await connection.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'uq_os_types_image'"
+        ))).first() is not None
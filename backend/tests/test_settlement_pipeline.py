@@ -0,0 +1,121 @@
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+import pytest
+
+from src.core.constants.transaction_const import TransactionStatus, TransactionType
+from src.core.models.transaction import Transaction
+from src.core.service.helpers import settlement
+from src.core.service.helpers.settlement import SettlementPipeline, settlement_run
+from src.core.utils.datetime import DateTimeUtils
+
+pytestmark = pytest.mark.anyio
+
+
+def _payment(user_id: uuid.UUID, minutes_ago: int) -> Transaction:
+    created_at = DateTimeUtils.now_dt() - timedelta(minutes=minutes_ago)
+    return Transaction(
+        transaction_id=uuid.uuid4(),
+        user_id=user_id,
+        reference_id="subscription_1",
+        subscription_id=1,
+        transaction_type=TransactionType.SUBSCRIPTION_PAYMENT,
+        transaction_status=TransactionStatus.SCHEDULED,
+        amount=10.0,
+        created_at=created_at,
+        last_updated_at=created_at
+    )
+
+
+class FakeSettlement:
+    """Pays every payment, after failing the given ones as many times as asked."""
+
+    def __init__(self, failures: dict = None):
+        self.failures = dict(failures or {})
+        self.processed = []
+        self.units = 0
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        self.units += 1
+        yield
+
+    async def process(self, transaction: Transaction) -> Transaction:
+        self.processed.append(transaction.transaction_id)
+        if self.failures.get(transaction.transaction_id, 0):
+            self.failures[transaction.transaction_id] -= 1
+            # Changes of a failed attempt must not leak into the next one
+            transaction.transaction_status = TransactionStatus.OVERDUE
+            raise RuntimeError("wallet locked")
+        assert transaction.transaction_status == TransactionStatus.SCHEDULED
+        transaction.transaction_status = TransactionStatus.PAID
+        return transaction
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list:
+    """Backoff waits of the pipeline, recorded instead of slept."""
+    waits = []
+    yield_to_loop = settlement.asyncio.sleep
+
+    async def sleep(seconds, *args, **kwargs):
+        # The event loop sleeps for 0 on its own
+        if seconds:
+            waits.append(seconds)
+        await yield_to_loop(0)
+
+    monkeypatch.setattr(settlement.asyncio, "sleep", sleep)
+    return waits
+
+
+async def test_each_user_is_settled_oldest_first(sleeps):
+    users = [uuid.uuid4() for _ in range(3)]
+    payments = [_payment(user_id, minutes_ago) for minutes_ago in (1, 3, 2) for user_id in users]
+    fake = FakeSettlement()
+
+    run = await SettlementPipeline(fake.process, fake.unit_of_work, concurrency=2).run(payments)
+
+    for user_id in users:
+        expected = [p.transaction_id for p in sorted(payments, key=lambda p: p.created_at) if p.user_id == user_id]
+        assert [transaction_id for transaction_id in fake.processed if transaction_id in expected] == expected
+    assert (run.mode, run.users, run.processed, run.paid, run.unpaid, run.failed, run.retries) == ("pipeline", 3, 9, 9, 0, 0, 0)
+    assert fake.units == 9
+    assert sleeps == []
+
+
+async def test_failed_attempts_are_retried_with_doubling_backoff(sleeps):
+    payment = _payment(uuid.uuid4(), 1)
+    fake = FakeSettlement({payment.transaction_id: 2})
+
+    run = await SettlementPipeline(fake.process, fake.unit_of_work, max_attempts=3, retry_backoff=0.5).run([payment])
+
+    assert fake.processed == [payment.transaction_id] * 3
+    assert sleeps == [0.5, 1.0]
+    assert (run.paid, run.failed, run.retries) == (1, 0, 2)
+    # Every attempt worked on a copy, the caller's model is untouched
+    assert payment.transaction_status == TransactionStatus.SCHEDULED
+
+
+async def test_payment_is_recorded_after_its_last_attempt_and_the_rest_carry_on(sleeps):
+    user_id = uuid.uuid4()
+    failing, later = _payment(user_id, 2), _payment(user_id, 1)
+    fake = FakeSettlement({failing.transaction_id: 5})
+
+    run = await SettlementPipeline(fake.process, fake.unit_of_work, max_attempts=3, retry_backoff=0.1).run([later, failing])
+
+    assert fake.processed == [failing.transaction_id] * 3 + [later.transaction_id]
+    assert (run.processed, run.paid, run.unpaid, run.failed, run.retries) == (2, 1, 0, 1, 2)
+    [failure] = run.failures
+    assert (failure.transaction_id, failure.user_id, failure.attempts, failure.error) == (
+        failing.transaction_id, user_id, 3, "wallet locked"
+    )
+
+
+def test_settlement_run_counts_unpaid_apart_from_failures():
+    run = settlement_run("bulk", DateTimeUtils.now_dt(), time.perf_counter() - 2, users=4, processed=10, paid=6)
+
+    assert (run.users, run.processed, run.paid, run.unpaid, run.failed, run.retries) == (4, 10, 6, 4, 0, 0)
+    assert run.duration_ms >= 2000
+    assert 0 < run.per_second <= 5
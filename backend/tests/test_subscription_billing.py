@@ -0,0 +1,191 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from src.core.config import BillingConfig
+from src.core.constants.transaction_const import TransactionStatus, TransactionType
+from src.core.models.subscription import BillingCheckpoint
+from src.core.models.transaction import Transaction
+from src.core.service.subscription import SETTLEMENT_CHECKPOINT
+from src.core.sql.tables.instance_teardown import InstanceTeardown
+from src.core.sql.tables.transaction import Transaction as TransactionRow
+from src.core.sql.tables.user_instance import UserInstance
+from src.core.sql.tables.user_subscription import UserSubscription
+from src.core.utils.datetime import DateTimeUtils
+from src.core.utils.permission import worker_context
+
+pytestmark = pytest.mark.anyio
+
+
+async def _schedule_payment(container, user, subscription, amount, created_at, status=TransactionStatus.SCHEDULED):
+    return await container.transaction_opr().upsert_transaction(Transaction(
+        user_id=user.user_id,
+        reference_id=f"subscription_{subscription.subscription_id}",
+        subscription_id=subscription.subscription_id,
+        transaction_type=TransactionType.SUBSCRIPTION_PAYMENT,
+        transaction_status=status,
+        amount=amount,
+        created_at=created_at,
+        last_updated_at=created_at
+    ))
+
+
+async def _payment_statuses(db_manager, user_id) -> dict:
+    """Statuses of the user's subscription payments by subscription, oldest payment first."""
+    async with db_manager.session() as db:
+        rows = (await db.execute(
+            select(TransactionRow.subscription_id, TransactionRow.transaction_status).where(
+                TransactionRow.user_id == user_id,
+                TransactionRow.transaction_type == TransactionType.SUBSCRIPTION_PAYMENT
+            ).order_by(TransactionRow.created_at)
+        )).all()
+    statuses = {}
+    for subscription_id, status in rows:
+        statuses.setdefault(subscription_id, []).append(status)
+    return statuses
+
+
+async def test_partial_funds_pay_the_earliest_payments_and_renew_them(database, container, create_user, create_subscription):
+    user = await create_user(balance=25.0)
+    now = DateTimeUtils.now_dt()
+    subscriptions = [
+        await create_subscription(user, now - timedelta(hours=1), now + timedelta(days=7))
+        for _ in range(3)
+    ]
+    # Later subscriptions get the older payments, so it's the payments' order that's paid in
+    for hours, subscription in zip((1, 2, 3), subscriptions):
+        await _schedule_payment(container, user, subscription, 10.0, now - timedelta(hours=hours))
+    newest, middle, oldest = subscriptions
+
+    next_payment_date = now + timedelta(days=30)
+    result = await container.transaction_opr().settle_due_subscription_payments(
+        due_before=now,
+        next_payment_date=next_payment_date,
+        next_expire_date=next_payment_date + timedelta(days=7),
+        user_ids=[user.user_id]
+    )
+
+    assert (result.users, result.due, result.paid, result.overdue, result.scheduled) == (1, 3, 2, 1, 2)
+    assert (await container.user_opr().get_user_wallet(user_id=user.user_id)).balance == 5.0
+    statuses = await _payment_statuses(database, user.user_id)
+    assert statuses[oldest.subscription_id] == [TransactionStatus.PAID, TransactionStatus.SCHEDULED]
+    assert statuses[middle.subscription_id] == [TransactionStatus.PAID, TransactionStatus.SCHEDULED]
+    assert statuses[newest.subscription_id] == [TransactionStatus.OVERDUE]
+
+    # Paid subscriptions move to the next cycle, the overdue one keeps its dates
+    subscription_opr = container.subscription_opr()
+    for paid in (oldest, middle):
+        assert (await subscription_opr.get_subscription_by_id(paid.subscription_id)).next_payment_date == next_payment_date
+    assert (await subscription_opr.get_subscription_by_id(newest.subscription_id)).next_payment_date == newest.next_payment_date
+
+
+async def test_overdue_subscriptions_past_expiry_are_expired(database, container, create_user, create_subscription):
+    user = await create_user()
+    now = DateTimeUtils.now_dt()
+    expiring = await create_subscription(user, now - timedelta(days=8), now - timedelta(days=1))
+    grace = await create_subscription(user, now - timedelta(days=2), now + timedelta(days=5))
+    await _schedule_payment(container, user, expiring, 10.0, now - timedelta(days=8), TransactionStatus.OVERDUE)
+    await _schedule_payment(container, user, expiring, 10.0, now - timedelta(days=1))
+    await _schedule_payment(container, user, grace, 10.0, now - timedelta(days=2), TransactionStatus.OVERDUE)
+
+    result = await container.transaction_opr().expire_due_subscriptions(expired_before=now)
+
+    assert result.expired >= 1 and result.queued >= 1
+    statuses = await _payment_statuses(database, user.user_id)
+    # The expired payment is unlinked from its deleted subscription, the scheduled one is gone
+    assert statuses[None] == [TransactionStatus.EXPIRED]
+    assert statuses[grace.subscription_id] == [TransactionStatus.OVERDUE]
+    async with database.session() as db:
+        assert await db.get(UserSubscription, expiring.subscription_id) is None
+        assert (await db.get(UserInstance, expiring.instance_id)).status == "Deleting"
+        assert await db.get(InstanceTeardown, expiring.instance_id) is not None
+        assert await db.get(InstanceTeardown, grace.instance_id) is None
+
+
+async def test_chunked_settlement_resumes_after_its_checkpoint(database, container, create_user, create_subscription, monkeypatch):
+    monkeypatch.setattr(BillingConfig, "SETTLEMENT_MODE", "bulk")
+    monkeypatch.setattr(BillingConfig, "SETTLEMENT_CHUNK_SIZE", 1)
+    now = DateTimeUtils.now_dt()
+    users = sorted([await create_user(balance=10.0) for _ in range(2)], key=lambda user: user.user_id)
+    for user in users:
+        subscription = await create_subscription(user, now - timedelta(hours=1), now + timedelta(days=7))
+        await _schedule_payment(container, user, subscription, 10.0, now - timedelta(hours=1))
+
+    # An interrupted run that got as far as the first user
+    subscription_opr = container.subscription_opr()
+    await subscription_opr.save_billing_checkpoint(BillingCheckpoint(
+        job=SETTLEMENT_CHECKPOINT,
+        run_started_at=now,
+        position=str(users[0].user_id),
+        processed=1,
+        updated_at=now
+    ))
+
+    with worker_context():
+        run = await container.subscription_service().settle_due_subscriptions_in_chunks()
+
+    assert run.started_at == now
+    assert list((await _payment_statuses(database, users[0].user_id)).values()) == [[TransactionStatus.SCHEDULED]]
+    assert list((await _payment_statuses(database, users[1].user_id)).values()) == [
+        [TransactionStatus.PAID, TransactionStatus.SCHEDULED]
+    ]
+    assert await subscription_opr.get_billing_checkpoint(SETTLEMENT_CHECKPOINT) is None
+
+
+async def test_overdue_trigger_settles_the_instance_before_its_payment_date(database, container, create_user, create_subscription):
+    user = await create_user(balance=20.0)
+    now = DateTimeUtils.now_dt()
+    subscription = await create_subscription(user, now + timedelta(days=30), now + timedelta(days=37))
+    # Falls due earlier, but belongs to another instance
+    other = await create_subscription(user, now + timedelta(days=10), now + timedelta(days=17))
+    await _schedule_payment(container, user, subscription, 10.0, now)
+    await _schedule_payment(container, user, other, 10.0, now)
+    hostname = (await container.instance_opr().get_user_instance(instance_id=subscription.instance_id)).hostname
+
+    with worker_context():
+        await container.billing_service().trigger_overdue_subscription_action(instance_name=hostname)
+
+    statuses = await _payment_statuses(database, user.user_id)
+    assert statuses[subscription.subscription_id] == [TransactionStatus.PAID, TransactionStatus.SCHEDULED]
+    assert statuses[other.subscription_id] == [TransactionStatus.SCHEDULED]
+
+
+async def test_expired_trigger_rejects_an_instance_without_overdue_payment(database, container, create_user, create_subscription):
+    user = await create_user()
+    now = DateTimeUtils.now_dt()
+    subscription = await create_subscription(user, now + timedelta(days=30), now + timedelta(days=37))
+    await _schedule_payment(container, user, subscription, 10.0, now)
+    hostname = (await container.instance_opr().get_user_instance(instance_id=subscription.instance_id)).hostname
+
+    with worker_context(), pytest.raises(HTTPException) as raised:
+        await container.billing_service().trigger_expired_subscription_action(instance_name=hostname)
+
+    assert raised.value.status_code == 409
+    statuses = await _payment_statuses(database, user.user_id)
+    assert statuses[subscription.subscription_id] == [TransactionStatus.SCHEDULED]
+
+
+async def test_pipeline_and_top_up_settlement_charge_a_payment_once(database, container, create_user, create_subscription):
+    user = await create_user(balance=20.0)
+    now = DateTimeUtils.now_dt()
+    subscription = await create_subscription(user, now - timedelta(hours=1), now + timedelta(days=7))
+    await _schedule_payment(container, user, subscription, 10.0, now - timedelta(hours=1))
+    subscription_service = container.subscription_service()
+    # The copy the pipeline read before the top up settled the user's payments
+    stale = await container.transaction_opr().get_subscription_transactions(subscription_id=subscription.subscription_id)
+
+    with worker_context():
+        await asyncio.gather(
+            subscription_service.process_overdue_subscriptions_concurrently(stale),
+            subscription_service.settle_due_subscriptions(user_id=user.user_id)
+        )
+        # Whichever came second finds the payment settled
+        run = await subscription_service.process_overdue_subscriptions_concurrently(stale)
+
+    assert (run.paid, run.failed) == (0, 0)
+    assert (await container.user_opr().get_user_wallet(user_id=user.user_id)).balance == 10.0
+    statuses = await _payment_statuses(database, user.user_id)
+    assert statuses[subscription.subscription_id] == [TransactionStatus.PAID, TransactionStatus.SCHEDULED]
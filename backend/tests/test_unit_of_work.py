@@ -0,0 +1,72 @@
+import uuid
+
+import pytest
+from sqlalchemy import exc, select, text
+
+from src.core.sql.database import DatabaseException
+from src.core.sql.tables.user import User
+from src.core.utils.datetime import DateTimeUtils
+
+pytestmark = pytest.mark.anyio
+
+
+def _user(name: str) -> User:
+    return User(
+        username=name,
+        email=f"{name}@example.com",
+        password_hash="not-a-real-hash",
+        last_updated_at=DateTimeUtils.now_dt()
+    )
+
+
+async def _existing_usernames(db_manager, names) -> set:
+    async with db_manager.session() as db:
+        return set((await db.execute(select(User.username).where(User.username.in_(names)))).scalars())
+
+
+async def test_failure_outside_database_only_undoes_its_operation(database):
+    names = [f"uow_{uuid.uuid4().hex[:12]}" for _ in range(3)]
+
+    async with database.unit_of_work():
+        async with database.session() as db:
+            db.add(_user(names[0]))
+        with pytest.raises(RuntimeError):
+            async with database.session() as db:
+                db.add(_user(names[1]))
+                await db.flush()
+                raise RuntimeError("not a database error")
+        async with database.session() as db:
+            db.add(_user(names[2]))
+
+    assert await _existing_usernames(database, names) == {names[0], names[2]}
+
+
+async def test_database_error_fails_the_whole_unit(database):
+    name = f"uow_{uuid.uuid4().hex[:12]}"
+
+    with pytest.raises(DatabaseException):
+        async with database.unit_of_work():
+            async with database.session() as db:
+                db.add(_user(name))
+            with pytest.raises(exc.DBAPIError):
+                async with database.session() as db:
+                    await db.execute(text("SELECT 1 / 0"))
+            async with database.session() as db:
+                pass
+
+    assert await _existing_usernames(database, [name]) == set()
+
+
+async def test_commit_keeps_earlier_work_when_the_unit_fails_later(database):
+    names = [f"uow_{uuid.uuid4().hex[:12]}" for _ in range(2)]
+
+    with pytest.raises(RuntimeError):
+        async with database.unit_of_work():
+            async with database.session() as db:
+                db.add(_user(names[0]))
+            await database.commit_unit_of_work()
+            async with database.session() as db:
+                db.add(_user(names[1]))
+            raise RuntimeError("request failed after the side effect")
+
+    assert await _existing_usernames(database, names) == {names[0]}
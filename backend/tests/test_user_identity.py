@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from fastapi import HTTPException, Response
+
+from src.core.models.user import UserIdentity
+from src.core.utils import token as token_module
+from src.core.utils.token import TokenUtils
+from src.core.config import TokenConfig
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_token_without_claims_is_resolved_from_database(container, create_user):
+    user = await create_user()
+    user_service = container.user_service()
+    # Tokens issued before identity claims existed only carry sub and email
+    access_token = TokenUtils.create_access_token({"sub": user.username, "email": user.email})
+
+    response = Response()
+    identity = await user_service.get_user_identity(access_token, response)
+
+    assert identity == UserIdentity(user_id=user.user_id, username=user.username, email=user.email, role="user")
+    # The cookie is re-issued with claims, so the next request skips the database
+    reissued = TokenUtils.validate_token(_cookie_value(response, "access_token"))
+    assert TokenUtils.get_identity_from_claims(reissued) == identity
+
+
+async def test_stale_claims_are_checked_against_database(container, create_user, monkeypatch):
+    user = await create_user()
+    user_service = container.user_service()
+    access_token = TokenUtils.create_access_token(TokenUtils.identity_claims(UserIdentity(
+        user_id=user.user_id,
+        username=user.username,
+        email=user.email,
+        role="admin"
+    )))
+    stale_at = time.time() + TokenConfig.CLAIMS_MAX_AGE_MINUTES * 60 + 1
+    monkeypatch.setattr(token_module.time, "time", lambda: stale_at)
+
+    identity = await user_service.get_user_identity(access_token)
+
+    assert identity.user_id == user.user_id
+    assert identity.role == "user"
+
+
+async def test_stale_claims_of_unknown_user_are_rejected(container):
+    user_service = container.user_service()
+    access_token = TokenUtils.create_access_token({"sub": "nobody_here", "email": "nobody_here@example.com"})
+
+    with pytest.raises(HTTPException) as exc_info:
+        await user_service.get_user_identity(access_token)
+
+    assert exc_info.value.status_code == 401
+
+
+def _cookie_value(response: Response, name: str) -> str:
+    for header, value in response.raw_headers:
+        if header == b"set-cookie" and value.startswith(f"{name}=".encode()):
+            return value.decode().split(";", 1)[0].split("=", 1)[1]
+    raise AssertionError(f"{name} cookie was not set")
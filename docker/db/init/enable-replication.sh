@@ -0,0 +1,7 @@
+#!/bin/bash
+
+# Allow streaming replication for the local read replica stand-in (profile "replica")
+
+set -e
+
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"